@@ -9,15 +9,52 @@ Tecnologias: OpenAI GPT-4, Chainlit, Python
 import chainlit as cl
 from openai import OpenAI
 import pyodbc
+import re
 import json
 import os
+import time
+import queue
+import hashlib
+import random
+import atexit
+import asyncio
+import threading
+from types import SimpleNamespace
+from collections import OrderedDict
+from functools import lru_cache
+from dataclasses import dataclass
 from typing import Optional, Dict, Any, List, Union
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 from dotenv import load_dotenv
 
+try:
+    import tiktoken
+except ImportError:  # opcional: contagem aproximada de tokens
+    tiktoken = None
+
+import tracing
+import metrics
+import risk_engine
+from serialization import dumps, loads
+from intent_router import IntentRouter
+
+try:
+    import portfolio_engine
+    import valuation_engine
+except ImportError:  # opcional: pandas/numpy para os motores de carteira e valuation
+    portfolio_engine = None
+    valuation_engine = None
+
+try:
+    import cashflow_engine
+except ImportError:  # opcional: numpy para fluxo de caixa, TIR/VPL e amortização
+    cashflow_engine = None
+
 # MCP imports
 from mcp import ClientSession
+import mcp.types as mcp_types
+from mcp.shared.exceptions import McpError
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -102,6 +139,21 @@ class Config:
     # Database
     DEFAULT_DB_PORT = int(os.getenv("DB_PORT", "1433"))
     QUERY_LIMIT = int(os.getenv("QUERY_LIMIT", "100"))
+    SQL_QUERY_TIMEOUT = int(os.getenv("SQL_QUERY_TIMEOUT", "30"))
+
+    # Histórico dos agentes persistido na thread (retomada sem reconsultar o banco)
+    HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "6000"))
+    HISTORY_TOOL_RESULT_CHARS = int(os.getenv("HISTORY_TOOL_RESULT_CHARS", "4000"))
+
+    # Roteador de intenção local (pula o Coordinator em casos claros)
+    INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+    INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.85"))
+    INTENT_ROUTER_MIN_EXAMPLES = int(os.getenv("INTENT_ROUTER_MIN_EXAMPLES", "20"))
+
+    # MCP - timeout de leitura do cliente (acima dos timeouts dos servidores)
+    MCP_TOOL_TIMEOUT = float(os.getenv("MCP_TOOL_TIMEOUT", "150"))
+    # Conecta os bancos default em background assim que a sessão MCP existe
+    MCP_WARMUP_ENABLED = os.getenv("MCP_WARMUP_ENABLED", "true").lower() == "true"
 
     # MSSQL Configuration
     MSSQL_SERVER = os.getenv("MSSQL_SERVER", "localhost")
@@ -135,6 +187,18 @@ class Config:
     # Sistema
     ENABLE_LOGGING = os.getenv("ENABLE_LOGGING", "true").lower() == "true"
     LOG_FILE = os.getenv("LOG_FILE", "agent_logs.txt")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json, text
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "500"))
+    LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+    # Métricas Prometheus (endpoint HTTP separado do Chainlit)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
     
     # Personalização de Agentes
     AGENT_LANGUAGE = os.getenv("AGENT_LANGUAGE", "pt")  # pt, en, es
@@ -147,6 +211,28 @@ class Config:
     CAP_RATE_GOOD_THRESHOLD = float(os.getenv("CAP_RATE_GOOD", "5"))
     RISK_HIGH_THRESHOLD = int(os.getenv("RISK_HIGH", "50"))
     RISK_MEDIUM_THRESHOLD = int(os.getenv("RISK_MEDIUM", "25"))
+    DSCR_MIN_THRESHOLD = float(os.getenv("DSCR_MIN", "1.2"))
+
+    # Memoização das ferramentas financeiras (resultado depende só dos argumentos e do Config)
+    FINANCIAL_CACHE_SIZE = int(os.getenv("FINANCIAL_CACHE_SIZE", "256"))
+
+    # Motor de carteira (pandas): tabela de imóveis carregada uma vez por sessão
+    PORTFOLIO_QUERY = os.getenv("PORTFOLIO_QUERY", "SELECT * FROM properties")
+    PORTFOLIO_CACHE_TTL = float(os.getenv("PORTFOLIO_CACHE_TTL", "300"))
+    PORTFOLIO_MAX_ROWS = int(os.getenv("PORTFOLIO_MAX_ROWS", "200000"))
+
+    # Valuation de Monte Carlo (trajetórias por imóvel; semente fixa = resultado reproduzível)
+    VALUATION_PATHS = int(os.getenv("VALUATION_PATHS", "10000"))
+    VALUATION_MAX_PATHS = int(os.getenv("VALUATION_MAX_PATHS", "100000"))
+    VALUATION_YEARS = int(os.getenv("VALUATION_YEARS", "10"))
+    VALUATION_DISCOUNT_RATE = float(os.getenv("VALUATION_DISCOUNT_RATE", "0.10"))
+    VALUATION_SEED = int(os.getenv("VALUATION_SEED", "42"))
+    # Processos para carteiras grandes (0 = número de CPUs) a partir de imóveis × trajetórias
+    VALUATION_WORKERS = int(os.getenv("VALUATION_WORKERS", "0"))
+    VALUATION_PARALLEL_MIN_PATHS = int(os.getenv("VALUATION_PARALLEL_MIN_PATHS", "5000000"))
+
+    # scenario_grid: máximo de cenários (produto dos eixos) por chamada
+    SCENARIO_GRID_MAX = int(os.getenv("SCENARIO_GRID_MAX", "200"))
 
 
 # Inicializar cliente OpenAI
@@ -158,19 +244,161 @@ connections_store: Dict[str, Dict[str, Any]] = {}
 
 # ==================== LOGGING ====================
 
-def log_message(level: str, message: str, user_id: str = "system"):
-    """Sistema de logging customizável"""
+class LogPipeline:
+    """Logging assíncrono: fila em memória + thread escritora com gravação em lote
+
+    O event loop só enfileira o evento; a thread mantém o arquivo aberto,
+    grava lotes, rotaciona por tamanho/tempo e descarta eventos quando a
+    fila enche (DEBUG é amostrado sempre).
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._opened_at = 0.0
+        self.dropped = 0
+
+    def emit(self, event: Dict[str, Any]):
+        """Enfileira evento sem bloquear (descarta se a fila estiver cheia)"""
+        if event["level"] == "DEBUG" and random.random() >= Config.LOG_DEBUG_SAMPLE_RATE:
+            return
+
+        self._ensure_started()
+        try:
+            if event["level"] == "ERROR":
+                # Erros esperam um pouco por espaço na fila antes de descartar
+                self._queue.put(event, timeout=0.05)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Grava o que restar na fila e fecha o arquivo"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=Config.LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            while len(batch) < Config.LOG_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            self._write([event for event in batch if event is not None])
+            if stop:
+                if self._file:
+                    self._file.close()
+                return
+
+    def _write(self, events: List[Dict[str, Any]]):
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            events.append(self._event("WARNING", f"{dropped} eventos de log descartados (fila cheia)", "system"))
+
+        try:
+            self._rotate_if_needed()
+            self._file.write("".join(self._format(event) for event in events))
+            self._file.flush()
+        except Exception as e:
+            print(f"Erro ao gravar log: {e}")
+
+    def _rotate_if_needed(self):
+        if self._file is None:
+            self._open()
+            return
+
+        too_big = Config.LOG_MAX_BYTES and self._file.tell() >= Config.LOG_MAX_BYTES
+        too_old = Config.LOG_ROTATE_HOURS and time.time() - self._opened_at >= Config.LOG_ROTATE_HOURS * 3600
+        if not (too_big or too_old):
+            return
+
+        self._file.close()
+        os.replace(Config.LOG_FILE, f"{Config.LOG_FILE}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+
+        # Remove backups excedentes (mais antigos primeiro)
+        log_dir = os.path.dirname(os.path.abspath(Config.LOG_FILE))
+        prefix = os.path.basename(Config.LOG_FILE) + "."
+        backups = sorted(f for f in os.listdir(log_dir) if f.startswith(prefix))
+        for old in backups[:max(len(backups) - Config.LOG_BACKUP_COUNT, 0)]:
+            os.remove(os.path.join(log_dir, old))
+
+        self._open()
+
+    def _open(self):
+        self._file = open(Config.LOG_FILE, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    @staticmethod
+    def _event(level: str, message: str, user_id: str, **fields) -> Dict[str, Any]:
+        return {"ts": datetime.now().isoformat(timespec="milliseconds"), "level": level,
+                "user_id": user_id, "message": message, **fields}
+
+    @staticmethod
+    def _format(event: Dict[str, Any]) -> str:
+        if Config.LOG_FORMAT == "text":
+            return f"[{event['ts']}] [{event['level']}] [{event['user_id']}] {event['message']}\n"
+        return json.dumps(event, ensure_ascii=False, default=str) + "\n"
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.close)
+
+
+def log_message(level: str, message: str, user_id: str = "system", **fields):
+    """Sistema de logging customizável (não bloqueia o event loop)"""
     if not Config.ENABLE_LOGGING:
         return
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] [{level}] [{user_id}] {message}\n"
-    
+
+    log_pipeline.emit(LogPipeline._event(level, message, user_id, **fields))
+
+
+# ==================== MÉTRICAS ====================
+
+TURN_LATENCY = metrics.REGISTRY.histogram(
+    "chat_turn_seconds", "Latência de um turno do chat (mensagem até resposta)")
+LLM_LATENCY = metrics.REGISTRY.histogram(
+    "llm_request_seconds", "Latência das chamadas ao modelo", ["agent", "model"])
+TOOL_LATENCY = metrics.REGISTRY.histogram(
+    "tool_call_seconds", "Latência de execução de tools", ["tool", "source"])
+SQL_LATENCY = metrics.REGISTRY.histogram(
+    "sql_query_seconds", "Latência das queries SQL diretas (pyodbc)", ["tool"])
+LLM_TOKENS = metrics.REGISTRY.counter(
+    "llm_tokens_total", "Tokens consumidos no modelo", ["agent", "type"])
+DELEGATIONS = metrics.REGISTRY.counter(
+    "delegations_total", "Delegações do Coordinator para especialistas", ["target"])
+CACHE_REQUESTS = metrics.REGISTRY.counter(
+    "cache_requests_total", "Consultas a caches (hit/miss)", ["cache", "result"])
+CACHE_EVICTIONS = metrics.REGISTRY.counter(
+    "cache_evictions_total", "Entradas removidas de caches LRU", ["cache"])
+ACTIVE_SESSIONS = metrics.REGISTRY.gauge(
+    "active_sessions", "Sessões de chat ativas")
+INTENT_ROUTES = metrics.REGISTRY.counter(
+    "intent_routes_total", "Decisões do roteador de intenção local", ["route"])
+
+if Config.METRICS_ENABLED:
     try:
-        with open(Config.LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
-    except Exception as e:
-        print(f"Erro ao gravar log: {e}")
+        metrics.start_http_server(Config.METRICS_PORT)
+    except OSError as e:
+        log_message("WARNING", f"Endpoint de métricas indisponível na porta {Config.METRICS_PORT}: {str(e)}")
 
 
 # ==================== ENUMS ====================
@@ -252,6 +480,23 @@ SQL_TOOLS = [
 
 # ==================== FERRAMENTAS FINANCEIRAS ====================
 
+# Parâmetros da simulação de valuation (valuation_analysis e portfolio_valuation)
+VALUATION_PARAMETERS = {
+    "paths": {"type": "integer", "description": f"Trajetórias por imóvel (padrão: {Config.VALUATION_PATHS}, máx: {Config.VALUATION_MAX_PATHS})"},
+    "years": {"type": "integer", "description": f"Horizonte em anos (padrão: {Config.VALUATION_YEARS})"},
+    "seed": {"type": "integer", "description": f"Semente (padrão: {Config.VALUATION_SEED}); mesma semente, mesmo resultado"},
+    "rent_growth_mean": {"type": "number", "description": "Crescimento anual médio do aluguel (fração, ex: 0.04)"},
+    "vacancy_mean": {"type": "number", "description": "Vacância média (fração); omitido usa a vacância atual de cada imóvel"},
+    "cap_rate_drift_mean": {"type": "number", "description": "Deriva anual média do cap rate de saída (fração, ex: 0.001)"},
+    "financing_rate_mean": {"type": "number", "description": "Custo médio anual da dívida (fração, ex: 0.11)"},
+    "discount_rate": {"type": "number", "description": f"Taxa de desconto anual (padrão: {Config.VALUATION_DISCOUNT_RATE})"}
+}
+
+AMORTIZATION_PARAMETER = {
+    "type": "string", "enum": ["price", "sac"],
+    "description": "Sistema de amortização: price (parcelas iguais) ou sac (amortização constante). Padrão: price"
+}
+
 FINANCIAL_TOOLS = [
     {
         "type": "function",
@@ -334,24 +579,206 @@ FINANCIAL_TOOLS = [
         "type": "function",
         "function": {
             "name": "valuation_analysis",
-            "description": "Análise de valuation e potencial de valorização",
+            "description": "Valuation por simulação de Monte Carlo (aluguel, vacância, cap rate de saída e custo da dívida): valor presente em percentis, probabilidade de valer menos que hoje e valor do equity",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "property_details": {"type": "string", "description": "Detalhes do imóvel em JSON"}
+                    "property_details": {"type": "string", "description": "Imóvel (ou lista de imóveis) em JSON: current_value, annual_noi (ou rental_yield), occupancy_rate, debt"},
+                    **VALUATION_PARAMETERS
                 },
                 "required": ["property_details"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "cash_flow_projection",
+            "description": "Projeta o fluxo de caixa anual de um imóvel (NOI, serviço da dívida, DSCR, venda) e calcula TIR e VPL desalavancados e alavancados",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "purchase_price": {"type": "number", "description": "Preço de aquisição"},
+                    "annual_noi": {"type": "number", "description": "NOI do primeiro ano"},
+                    "years": {"type": "integer", "description": "Horizonte de investimento em anos"},
+                    "noi_growth": {"type": "number", "description": "Crescimento anual do NOI (fração, ex: 0.03)"},
+                    "exit_cap_rate": {"type": "number", "description": "Cap rate de saída (fração); padrão: cap rate de entrada"},
+                    "selling_cost": {"type": "number", "description": "Custo de venda (fração do valor de venda)"},
+                    "loan_amount": {"type": "number", "description": "Valor financiado"},
+                    "interest_rate": {"type": "number", "description": "Taxa de juros nominal anual (fração, ex: 0.11)"},
+                    "loan_years": {"type": "number", "description": "Prazo do financiamento em anos (padrão: 20)"},
+                    "amortization": AMORTIZATION_PARAMETER,
+                    "discount_rate": {"type": "number", "description": f"Taxa de desconto anual do VPL (padrão: {Config.VALUATION_DISCOUNT_RATE})"}
+                },
+                "required": ["purchase_price", "annual_noi", "years"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "loan_schedule",
+            "description": "Cronograma de amortização de um financiamento (Price ou SAC) consolidado por ano: parcelas, juros, amortização e saldo",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "principal": {"type": "number", "description": "Valor financiado"},
+                    "interest_rate": {"type": "number", "description": "Taxa de juros nominal anual (fração, ex: 0.11)"},
+                    "years": {"type": "number", "description": "Prazo em anos"},
+                    "amortization": AMORTIZATION_PARAMETER,
+                    "payments_per_year": {"type": "integer", "description": "Parcelas por ano (padrão: 12)"}
+                },
+                "required": ["principal", "interest_rate", "years"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "irr_npv_batch",
+            "description": "TIR e VPL de muitos fluxos de caixa em uma chamada (ex: todos os imóveis da carteira): distribuição, totais e melhores/piores",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "cash_flows": {
+                        "type": "array",
+                        "items": {"type": "array", "items": {"type": "number"}},
+                        "description": "Um fluxo por imóvel; o primeiro valor é o período 0 (investimento, negativo)"
+                    },
+                    "ids": {"type": "array", "items": {"type": "string"}, "description": "Identificadores (opcional)"},
+                    "discount_rate": {"type": "number", "description": f"Taxa de desconto anual (padrão: {Config.VALUATION_DISCOUNT_RATE})"},
+                    "periods_per_year": {"type": "integer", "description": "Períodos por ano dos fluxos (1 = anual, 12 = mensal)"},
+                    "top": {"type": "integer", "description": "Quantidade de melhores/piores (padrão: 10)"}
+                },
+                "required": ["cash_flows"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "loan_portfolio_analysis",
+            "description": "Analisa milhares de financiamentos em uma chamada: serviço da dívida, juros totais, taxa e prazo médios ponderados e DSCR (com os empréstimos abaixo do mínimo)",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "principals": {"type": "array", "items": {"type": "number"}, "description": "Saldo financiado de cada empréstimo"},
+                    "interest_rates": {"type": "array", "items": {"type": "number"}, "description": "Taxa nominal anual de cada empréstimo (fração)"},
+                    "terms_years": {"type": "array", "items": {"type": "number"}, "description": "Prazo em anos de cada empréstimo"},
+                    "interest_rate": {"type": "number", "description": "Taxa única para todos (quando interest_rates não é informado)"},
+                    "term_years": {"type": "number", "description": "Prazo único para todos (quando terms_years não é informado)"},
+                    "annual_nois": {"type": "array", "items": {"type": "number"}, "description": "NOI anual do imóvel de cada empréstimo (para o DSCR)"},
+                    "ids": {"type": "array", "items": {"type": "string"}, "description": "Identificadores (opcional)"},
+                    "amortization": AMORTIZATION_PARAMETER,
+                    "dscr_min": {"type": "number", "description": f"DSCR mínimo aceitável (padrão: {Config.DSCR_MIN_THRESHOLD})"},
+                    "top": {"type": "integer", "description": "Quantidade de piores DSCR listados (padrão: 10)"}
+                },
+                "required": ["principals"]
+            }
+        }
+    }
+]
+
+
+# ==================== FERRAMENTAS DE CARTEIRA ====================
+
+PORTFOLIO_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "analyze_portfolio",
+            "description": "Analisa a carteira inteira direto do banco em uma chamada: ROI, cap rate, cash-on-cash, risco e diversificação por imóvel, totais ponderados, distribuições, melhores/piores imóveis e agrupamentos",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "group_by": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas de agrupamento (ex: property_type, location)"
+                    },
+                    "status": {"type": "string", "description": "Filtra por status (ex: Ativo)"},
+                    "top": {"type": "integer", "description": "Quantidade de melhores/piores imóveis (padrão: 10)"},
+                    "refresh": {"type": "boolean", "description": "Recarrega a carteira do banco ignorando o cache"}
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "risk_assessment_batch",
+            "description": "Avalia o risco de muitos imóveis de uma vez (mesmas regras do risk_assessment): distribuição de scores, níveis, fatores e imóveis de maior risco. Sem colunas informadas, usa a carteira do banco.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "occupancy_rates": {"type": "array", "items": {"type": "number"}, "description": "Taxas de ocupação (0-100), uma por imóvel"},
+                    "debt_ratios": {"type": "array", "items": {"type": "number"}, "description": "Ratios de dívida (0-1), um por imóvel"},
+                    "property_types": {"type": "array", "items": {"type": "string"}, "description": "Tipos de propriedade, um por imóvel"},
+                    "ids": {"type": "array", "items": {"type": "string"}, "description": "Identificadores dos imóveis (opcional)"},
+                    "status": {"type": "string", "description": "Filtra a carteira do banco por status (ex: Ativo)"},
+                    "top": {"type": "integer", "description": "Quantidade de imóveis de maior risco (padrão: 10)"},
+                    "refresh": {"type": "boolean", "description": "Recarrega a carteira do banco ignorando o cache"}
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "portfolio_valuation",
+            "description": "Valuation de Monte Carlo de todos os imóveis da carteira do banco: percentis do valor da carteira (choques de mercado correlacionados) e imóveis com maior probabilidade de perda",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "status": {"type": "string", "description": "Filtra por status (ex: Ativo)"},
+                    "top": {"type": "integer", "description": "Quantidade de imóveis detalhados (padrão: 10)"},
+                    "refresh": {"type": "boolean", "description": "Recarrega a carteira do banco ignorando o cache"},
+                    **VALUATION_PARAMETERS
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "scenario_grid",
+            "description": "Análise de sensibilidade em uma chamada: avalia todas as combinações de juros, vacância, crescimento do NOI e variação do cap rate sobre a carteira inteira e devolve uma tabela (NOI, valor, serviço da dívida, DSCR, fluxo de caixa, TIR alavancada mediana e VPL por cenário). Use em vez de perguntar cenário a cenário.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "interest_rates": {"type": "array", "items": {"type": "number"}, "description": "Taxas de juros anuais a testar (fração, ex: [0.10, 0.12, 0.14])"},
+                    "vacancies": {"type": "array", "items": {"type": "number"}, "description": "Vacâncias a testar (fração, ex: [0.05, 0.15]); omitido usa a vacância atual de cada imóvel"},
+                    "noi_growths": {"type": "array", "items": {"type": "number"}, "description": "Crescimentos anuais do NOI a testar (fração)"},
+                    "cap_rate_shifts": {"type": "array", "items": {"type": "number"}, "description": "Variações do cap rate sobre o atual (fração, ex: [-0.005, 0, 0.01])"},
+                    "interest_rate": {"type": "number", "description": "Juros base quando interest_rates não é informado"},
+                    "noi_growth": {"type": "number", "description": "Crescimento base quando noi_growths não é informado"},
+                    "years": {"type": "integer", "description": "Horizonte em anos (padrão: 10)"},
+                    "loan_years": {"type": "number", "description": "Prazo restante das dívidas em anos (padrão: 20)"},
+                    "amortization": AMORTIZATION_PARAMETER,
+                    "discount_rate": {"type": "number", "description": f"Taxa de desconto do VPL (padrão: {Config.VALUATION_DISCOUNT_RATE})"},
+                    "property_details": {"type": "string", "description": "Imóveis em JSON (opcional); sem ele usa a carteira do banco"},
+                    "status": {"type": "string", "description": "Filtra a carteira do banco por status (ex: Ativo)"},
+                    "refresh": {"type": "boolean", "description": "Recarrega a carteira do banco ignorando o cache"}
+                }
+            }
+        }
     }
 ]
 
+PORTFOLIO_TOOL_NAMES = {tool["function"]["name"] for tool in PORTFOLIO_TOOLS}
+
+# Tools financeiras pesadas em CPU: executadas fora do event loop
+BLOCKING_FINANCIAL_TOOLS = {"valuation_analysis", "irr_npv_batch", "loan_portfolio_analysis"}
+CASH_FLOW_TOOL_NAMES = {"cash_flow_projection", "loan_schedule", "irr_npv_batch", "loan_portfolio_analysis"}
+
 
 # ==================== EXECUÇÃO DE FERRAMENTAS SQL ====================
 
+@tracing.traced("sql.tool")
 def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
     """Executa ferramentas SQL"""
     session_id = cl.user_session.get("id", "default")
+    tracing.current_span().set_attribute("tool", tool_name)
     
     if session_id not in connections_store:
         connections_store[session_id] = {"connections": {}, "current": None}
@@ -378,12 +805,16 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             log_message("INFO", f"Conectando a {server}/{database}", session_id)
             
             conn = pyodbc.connect(conn_str, timeout=10)
+            conn.timeout = Config.SQL_QUERY_TIMEOUT  # SQL_ATTR_QUERY_TIMEOUT
             session_data["connections"]["main"] = {
                 "connection": conn,
                 "server": server,
                 "database": database
             }
             session_data["current"] = "main"
+            # Nova conexão (outro servidor/base): a carteira em cache não vale mais
+            if portfolio_cache:
+                portfolio_cache.invalidate(session_id)
             
             log_message("SUCCESS", f"Conectado com sucesso a {server}/{database}", session_id)
             return f"✅ Conectado à base {database} no servidor {server}"
@@ -404,9 +835,11 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             
             log_message("INFO", f"Executando query: {query[:100]}...", session_id)
             
-            cursor.execute(query)
-            rows = cursor.fetchmany(limit)
+            with SQL_LATENCY.time(tool=tool_name):
+                cursor.execute(query)
+                rows = cursor.fetchmany(limit)
             columns = [desc[0] for desc in cursor.description]
+            tracing.current_span().set_attribute("rows", len(rows))
             
             result = {
                 "columns": columns,
@@ -415,7 +848,7 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
                 "limited": len(rows) == limit
             }
             
-            return json.dumps(result, indent=2, default=str)
+            return dumps(result)
         
         elif tool_name == "list_tables":
             cursor.execute("""
@@ -425,7 +858,7 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
                 ORDER BY TABLE_SCHEMA, TABLE_NAME
             """)
             tables = [{"schema": row[0], "name": row[1]} for row in cursor.fetchall()]
-            return json.dumps(tables, indent=2)
+            return dumps(tables)
         
         elif tool_name == "describe_table":
             table = tool_input.get("table_name")
@@ -441,7 +874,7 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
                 "max_length": r[2],
                 "nullable": r[3]
             } for r in cursor.fetchall()]
-            return json.dumps(cols, indent=2)
+            return dumps(cols)
         
         elif tool_name == "get_portfolio_summary":
             # Query customizável - adapte ao seu schema
@@ -457,14 +890,14 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             row = cursor.fetchone()
             
             if row:
-                return json.dumps({
+                return dumps({
                     "total_properties": row[0] or 0,
                     "total_invested": float(row[1]) if row[1] else 0,
                     "current_value": float(row[2]) if row[2] else 0,
                     "avg_yield": float(row[3]) if row[3] else 0
-                }, indent=2)
+                })
             else:
-                return json.dumps({"error": "Nenhum dado encontrado"})
+                return dumps({"error": "Nenhum dado encontrado"})
         
     except Exception as e:
         log_message("ERROR", f"Erro SQL: {str(e)}", session_id)
@@ -473,7 +906,118 @@ def execute_sql_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
 
 # ==================== EXECUÇÃO DE FERRAMENTAS FINANCEIRAS ====================
 
+class FinancialToolCache:
+    """LRU de resultados das ferramentas financeiras (puras), com contadores
+
+    Compartilhado entre sessões e threads (tools pesadas rodam em
+    asyncio.to_thread), por isso protegido por lock.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache="financial", result="miss" if result is None else "hit")
+        return result
+
+    def add(self, key: str, result: str):
+        with self._lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            evicted = len(self.entries) > self.max_size
+            if evicted:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        if evicted:
+            CACHE_EVICTIONS.inc(cache="financial")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "cached_results": len(self.entries),
+            "evictions": self.evictions
+        }
+
+
+financial_cache = FinancialToolCache(Config.FINANCIAL_CACHE_SIZE)
+
+
+def financial_config_fingerprint() -> tuple:
+    """Valores do Config que alteram o resultado das ferramentas financeiras"""
+    return tuple(
+        (name, value) for name, value in sorted(vars(Config).items())
+        if name.startswith(("ROI_", "CAP_RATE_", "RISK_", "DSCR_", "VALUATION_"))
+    )
+
+
+def _canonical_arguments(value: Any) -> Any:
+    """Argumentos equivalentes → mesma forma (None omitido, 12 == 12.0)"""
+    if isinstance(value, dict):
+        return {key: _canonical_arguments(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_arguments(item) for item in value]
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def financial_cache_key(tool_name: str, tool_input: Dict[str, Any]) -> str:
+    """Hash de tool + argumentos canônicos + fingerprint do Config
+
+    Hash em vez do JSON bruto: tools em lote recebem milhares de valores.
+    """
+    canonical = json.dumps(
+        [tool_name, _canonical_arguments(tool_input or {}), financial_config_fingerprint()],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
 def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
+    """Executa ferramenta financeira reaproveitando resultados já calculados
+
+    Repetições (retries, follow-ups) com os mesmos argumentos e thresholds
+    devolvem o JSON serializado do cache LRU. Erros não são guardados.
+    """
+    if Config.FINANCIAL_CACHE_SIZE <= 0:
+        return compute_financial_tool(tool_name, tool_input)
+
+    key = financial_cache_key(tool_name, tool_input)
+    result = financial_cache.get(key)
+    if result is None:
+        result = compute_financial_tool(tool_name, tool_input)
+        if isinstance(result, str) and not is_error_result(result):
+            financial_cache.add(key, result)
+    return result
+
+
+def is_error_result(result: str) -> bool:
+    """Erro da tool: texto "❌ ..." ou payload JSON com success false"""
+    if result.startswith("❌"):
+        return True
+    try:
+        payload = loads(result)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get("success") is False
+
+
+def compute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
     """Executa ferramentas financeiras com thresholds personalizáveis"""
     try:
         if tool_name == "calculate_roi":
@@ -492,7 +1036,7 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             else:
                 interpretation = "Regular"
             
-            return json.dumps({
+            return dumps({
                 "roi_percentage": round(roi, 2),
                 "annual_roi": round(annual_roi, 2),
                 "absolute_gain": round(current - initial, 2),
@@ -501,7 +1045,7 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
                     "excellent": f">{Config.ROI_EXCELLENT_THRESHOLD}%",
                     "good": f">{Config.ROI_GOOD_THRESHOLD}%"
                 }
-            }, indent=2)
+            })
         
         elif tool_name == "calculate_cap_rate":
             noi = tool_input.get("annual_noi")
@@ -516,12 +1060,12 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             else:
                 interpretation = "Baixo"
             
-            return json.dumps({
+            return dumps({
                 "cap_rate": round(cap_rate, 2),
                 "interpretation": interpretation,
                 "annual_noi": noi,
                 "property_value": value
-            }, indent=2)
+            })
         
         elif tool_name == "calculate_cash_on_cash":
             cash_flow = tool_input.get("annual_cash_flow")
@@ -531,12 +1075,12 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             
             interpretation = "Excelente" if coc > 10 else "Bom" if coc > 6 else "Regular"
             
-            return json.dumps({
+            return dumps({
                 "cash_on_cash": round(coc, 2),
                 "interpretation": interpretation,
                 "annual_cash_flow": cash_flow,
                 "total_invested": invested
-            }, indent=2)
+            })
         
         elif tool_name == "risk_assessment":
             prop_type = tool_input.get("property_type")
@@ -544,54 +1088,25 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             occupancy = tool_input.get("occupancy_rate")
             debt = tool_input.get("debt_ratio", 0)
             
-            risk_score = 0
-            factors = {}
-            
-            # Fatores de risco personalizáveis
-            if occupancy < 80:
-                risk_score += 30
-                factors["occupancy"] = "Risco - Taxa abaixo de 80%"
-            else:
-                factors["occupancy"] = "OK"
-            
-            if debt > 0.7:
-                risk_score += 25
-                factors["debt"] = "Alto - Alavancagem acima de 70%"
-            else:
-                factors["debt"] = "OK"
-            
-            if prop_type.lower() in ["comercial", "retail", "commercial"]:
-                risk_score += 15
-                factors["type"] = "Risco elevado - Setor comercial"
-            else:
-                factors["type"] = "OK"
-            
-            # Interpretação baseada em thresholds
-            if risk_score > Config.RISK_HIGH_THRESHOLD:
-                risk_level = "Alto"
-                recommendation = "Considerar venda ou reestruturação"
-            elif risk_score > Config.RISK_MEDIUM_THRESHOLD:
-                risk_level = "Médio"
-                recommendation = "Monitorar de perto e avaliar melhorias"
-            else:
-                risk_level = "Baixo"
-                recommendation = "Manter"
+            # Mesmas regras do cálculo em lote (risk_engine)
+            risk_score, factors = risk_engine.score_property(prop_type, occupancy, debt)
+            risk_level = risk_engine.risk_level(risk_score, Config.RISK_HIGH_THRESHOLD, Config.RISK_MEDIUM_THRESHOLD)
             
-            return json.dumps({
+            return dumps({
                 "risk_score": risk_score,
                 "risk_level": risk_level,
                 "factors": factors,
-                "recommendation": recommendation,
+                "recommendation": risk_engine.RECOMMENDATIONS[risk_level],
                 "details": {
                     "property_type": prop_type,
                     "location": location,
                     "occupancy_rate": occupancy,
                     "debt_ratio": debt
                 }
-            }, indent=2)
+            })
         
         elif tool_name == "diversification_analysis":
-            portfolio = json.loads(tool_input.get("portfolio_data"))
+            portfolio = loads(tool_input.get("portfolio_data"))
             
             types = {}
             locations = {}
@@ -610,51 +1125,427 @@ def execute_financial_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
             
             recommendation = "Bem diversificada" if len(types) >= 3 and len(locations) >= 3 else "Considerar diversificar"
             
-            return json.dumps({
+            return dumps({
                 "by_type": types,
                 "by_location": locations,
                 "total_properties": len(portfolio),
                 "total_value": total_value,
                 "diversification_score": diversification_score,
                 "recommendation": recommendation
-            }, indent=2)
+            })
         
         elif tool_name == "valuation_analysis":
-            details = json.loads(tool_input.get("property_details"))
+            if portfolio_engine is None:
+                return dumps({"success": False, "error": "Valuation indisponível: instale pandas e numpy"})
+
+            details = loads(tool_input.get("property_details"))
+            records = details if isinstance(details, list) else [details]
+            valuation = portfolio_engine.valuation(
+                portfolio_engine.from_records(records),
+                portfolio_thresholds(),
+                top=len(records),
+                **valuation_options(tool_input)
+            )
+            if not valuation["properties_simulated"]:
+                return dumps({
+                    "success": False,
+                    "error": "Informe current_value e annual_noi (ou rental_yield) positivos",
+                    "property_details": details
+                })
             
-            # Análise simplificada - pode ser expandida
-            return json.dumps({
-                "valuation_status": "Em análise",
-                "market_comparison": "Dados comparativos em processamento",
-                "appreciation_potential": "Médio-Alto",
-                "factors": {
-                    "location_score": 8,
-                    "condition_score": 7,
-                    "market_trend": "Positivo"
-                },
-                "property_details": details
-            }, indent=2)
+            return dumps({"success": True, **valuation})
+        
+        elif tool_name in CASH_FLOW_TOOL_NAMES:
+            if cashflow_engine is None:
+                return dumps({"success": False, "error": "Fluxo de caixa indisponível: instale numpy"})
+            return dumps({"success": True, **execute_cash_flow_tool(tool_name, tool_input)})
         
     except Exception as e:
         return f"❌ Erro na análise financeira: {str(e)}"
 
 
+def execute_cash_flow_tool(tool_name: str, tool_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Ferramentas de fluxo de caixa (cashflow_engine); taxas de entrada em fração"""
+    method = tool_input.get("amortization") or "price"
+    discount_rate = tool_input.get("discount_rate")
+    discount_rate = Config.VALUATION_DISCOUNT_RATE if discount_rate is None else float(discount_rate)
+
+    if tool_name == "cash_flow_projection":
+        return cashflow_engine.project_property(
+            tool_input.get("purchase_price"),
+            tool_input.get("annual_noi"),
+            int(tool_input.get("years")),
+            noi_growth=tool_input.get("noi_growth") or 0,
+            exit_cap_rate=tool_input.get("exit_cap_rate"),
+            selling_cost=tool_input.get("selling_cost") or 0,
+            loan_amount=tool_input.get("loan_amount") or 0,
+            annual_rate=tool_input.get("interest_rate") or 0,
+            loan_years=tool_input.get("loan_years") or 20,
+            method=method,
+            discount_rate=discount_rate,
+            dscr_min=Config.DSCR_MIN_THRESHOLD
+        )
+
+    if tool_name == "loan_schedule":
+        return cashflow_engine.loan_report(
+            tool_input.get("principal"),
+            tool_input.get("interest_rate"),
+            tool_input.get("years"),
+            payments_per_year=int(tool_input.get("payments_per_year") or 12),
+            method=method
+        )
+
+    if tool_name == "irr_npv_batch":
+        return cashflow_engine.evaluate_cash_flows(
+            tool_input.get("cash_flows") or [],
+            discount_rate,
+            periods_per_year=int(tool_input.get("periods_per_year") or 1),
+            ids=tool_input.get("ids"),
+            top=tool_input.get("top", 10)
+        )
+
+    # loan_portfolio_analysis: colunas por empréstimo ou valor único para todos
+    rates = tool_input.get("interest_rates")
+    terms = tool_input.get("terms_years")
+    if rates is None and tool_input.get("interest_rate") is None:
+        raise ValueError("Informe interest_rates (um por empréstimo) ou interest_rate")
+    if terms is None and tool_input.get("term_years") is None:
+        raise ValueError("Informe terms_years (um por empréstimo) ou term_years")
+    principals = tool_input.get("principals") or []
+    for name, column in (("interest_rates", rates), ("terms_years", terms), ("annual_nois", tool_input.get("annual_nois"))):
+        if column is not None and len(column) != len(principals):
+            raise ValueError(f"{name} com tamanho diferente de principals")
+
+    return cashflow_engine.evaluate_loans(
+        principals,
+        rates if rates is not None else tool_input.get("interest_rate"),
+        terms if terms is not None else tool_input.get("term_years"),
+        annual_noi=tool_input.get("annual_nois"),
+        method=method,
+        dscr_min=tool_input.get("dscr_min") or Config.DSCR_MIN_THRESHOLD,
+        ids=tool_input.get("ids"),
+        top=tool_input.get("top", 10)
+    )
+
+
+# ==================== MOTOR DE CARTEIRA ====================
+
+# Frames por sessão (fora do user_session: DataFrame não é serializável)
+portfolio_cache = portfolio_engine.PortfolioCache(Config.PORTFOLIO_CACHE_TTL) if portfolio_engine else None
+
+
+def portfolio_thresholds():
+    """Thresholds do Config no formato do motor de carteira"""
+    return portfolio_engine.Thresholds(
+        roi_excellent=Config.ROI_EXCELLENT_THRESHOLD,
+        roi_good=Config.ROI_GOOD_THRESHOLD,
+        cap_rate_excellent=Config.CAP_RATE_EXCELLENT_THRESHOLD,
+        cap_rate_good=Config.CAP_RATE_GOOD_THRESHOLD,
+        risk_high=Config.RISK_HIGH_THRESHOLD,
+        risk_medium=Config.RISK_MEDIUM_THRESHOLD
+    )
+
+
+def valuation_options(tool_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Opções do valuation_engine.simulate: argumentos da tool sobre o Config"""
+    overrides = {
+        key: float(tool_input[key])
+        for key in ("rent_growth_mean", "vacancy_mean", "cap_rate_drift_mean", "financing_rate_mean")
+        if tool_input.get(key) is not None
+    }
+    return {
+        "assumptions": valuation_engine.Assumptions(
+            discount_rate=float(Config.VALUATION_DISCOUNT_RATE if tool_input.get("discount_rate") is None
+                                else tool_input["discount_rate"]),
+            **overrides
+        ),
+        "paths": min(int(Config.VALUATION_PATHS if tool_input.get("paths") is None else tool_input["paths"]),
+                     Config.VALUATION_MAX_PATHS),
+        "years": int(Config.VALUATION_YEARS if tool_input.get("years") is None else tool_input["years"]),
+        "seed": int(Config.VALUATION_SEED if tool_input.get("seed") is None else tool_input["seed"]),
+        "workers": Config.VALUATION_WORKERS,
+        "parallel_min_paths": Config.VALUATION_PARALLEL_MIN_PATHS
+    }
+
+
+SCENARIO_AXIS_ARGUMENTS = {
+    "interest_rates": "interest_rate",
+    "vacancies": "vacancy",
+    "noi_growths": "noi_growth",
+    "cap_rate_shifts": "cap_rate_shift"
+}
+
+
+def scenario_options(tool_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Eixos, base e opções do cashflow_engine.scenario_grid a partir da tool"""
+    axes = {
+        axis: sorted({float(value) for value in tool_input[argument]})
+        for argument, axis in SCENARIO_AXIS_ARGUMENTS.items() if tool_input.get(argument)
+    }
+    scenarios = 1
+    for values in axes.values():
+        scenarios *= len(values)
+    if scenarios > Config.SCENARIO_GRID_MAX:
+        raise ValueError(f"Grade com {scenarios} cenários excede o máximo de {Config.SCENARIO_GRID_MAX}; reduza os eixos")
+
+    defaults = valuation_engine.Assumptions()
+    interest_rate, noi_growth = tool_input.get("interest_rate"), tool_input.get("noi_growth")
+    base = {
+        "interest_rate": defaults.financing_rate_mean if interest_rate is None else float(interest_rate),
+        "vacancy": valuation_engine.DEFAULT_VACANCY,
+        "noi_growth": defaults.rent_growth_mean if noi_growth is None else float(noi_growth),
+        "cap_rate_shift": 0.0
+    }
+    discount_rate = tool_input.get("discount_rate")
+    return {
+        "axes": axes,
+        "base": base,
+        "years": int(tool_input.get("years") or 10),
+        "loan_years": float(tool_input.get("loan_years") or 20),
+        "method": tool_input.get("amortization") or "price",
+        "discount_rate": Config.VALUATION_DISCOUNT_RATE if discount_rate is None else float(discount_rate),
+        "dscr_min": Config.DSCR_MIN_THRESHOLD
+    }
+
+
+async def load_portfolio_frame(refresh: bool = False) -> tuple:
+    """Carteira da sessão: cache (TTL) → conexão direta → execute_query via MCP
+
+    Retorna (frame, origem, veio do cache).
+    """
+    session_id = cl.user_session.get("id", "default")
+    session_data = connections_store.get(session_id) or {}
+    mcp_route = resolve_mcp_tool("execute_query")
+
+    if session_data.get("current"):
+        connection = session_data["connections"][session_data["current"]]
+        source = f"sql:{connection['server']}/{connection['database']}"
+    elif mcp_route:
+        source = f"mcp:{mcp_route[0]}"
+    else:
+        raise ValueError("Nenhuma conexão ativa. Conecte um banco (connect_database ou MCP) primeiro.")
+
+    if not refresh:
+        frame = portfolio_cache.get(session_id, source)
+        if frame is not None:
+            CACHE_REQUESTS.inc(cache="portfolio", result="hit")
+            return frame, source, True
+    CACHE_REQUESTS.inc(cache="portfolio", result="miss")
+
+    if session_data.get("current"):
+        conn = session_data["connections"][session_data["current"]]["connection"]
+        with SQL_LATENCY.time(tool="analyze_portfolio"):
+            frame = await asyncio.to_thread(
+                portfolio_engine.read_sql, conn, Config.PORTFOLIO_QUERY, Config.PORTFOLIO_MAX_ROWS
+            )
+    else:
+        payload = loads(await execute_mcp_tool(
+            "execute_query", {"query": Config.PORTFOLIO_QUERY, "limit": Config.PORTFOLIO_MAX_ROWS}
+        ))
+        if not payload.get("success"):
+            raise ValueError(payload.get("error", "Falha ao carregar a carteira via MCP"))
+        frame = portfolio_engine.from_records(payload["rows"])
+
+    log_message("INFO", f"Carteira carregada ({len(frame)} imóveis) de {source}", session_id)
+    portfolio_cache.set(session_id, source, frame)
+    return frame, source, False
+
+
+async def execute_portfolio_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
+    """Executa ferramentas do motor de carteira sobre o frame da sessão"""
+    if portfolio_engine is None:
+        return dumps({"success": False, "error": "Motor de carteira indisponível: instale pandas e numpy"})
+
+    try:
+        if tool_name == "risk_assessment_batch" and any(
+                tool_input.get(key) is not None for key in ("occupancy_rates", "debt_ratios", "property_types")):
+            # Colunas informadas pelo modelo: não precisa do banco
+            assessment = await asyncio.to_thread(
+                risk_engine.assess_batch,
+                occupancy_rate=tool_input.get("occupancy_rates"),
+                debt_ratio=tool_input.get("debt_ratios"),
+                property_type=tool_input.get("property_types"),
+                high=Config.RISK_HIGH_THRESHOLD,
+                medium=Config.RISK_MEDIUM_THRESHOLD,
+                ids=tool_input.get("ids"),
+                top=tool_input.get("top", 10)
+            )
+            return dumps({"success": True, "source": "input", **assessment})
+
+        if tool_name == "scenario_grid" and tool_input.get("property_details"):
+            # Imóveis informados pelo modelo: não precisa do banco
+            details = loads(tool_input["property_details"])
+            frame = portfolio_engine.from_records(details if isinstance(details, list) else [details])
+            source, cached = "input", False
+        else:
+            frame, source, cached = await load_portfolio_frame(tool_input.get("refresh", False))
+        if frame.empty:
+            return dumps({"success": False, "error": "Nenhum imóvel encontrado", "source": source})
+
+        if tool_name == "analyze_portfolio":
+            # Cálculo vetorizado fora do event loop (carteiras grandes)
+            analysis = await asyncio.to_thread(
+                portfolio_engine.analyze,
+                frame,
+                portfolio_thresholds(),
+                group_by=tool_input.get("group_by"),
+                top=tool_input.get("top", 10),
+                status=tool_input.get("status")
+            )
+            return dumps({"success": True, "source": source, "cached": cached, **analysis})
+
+        if tool_name == "risk_assessment_batch":
+            assessment = await asyncio.to_thread(
+                portfolio_engine.assess_risk,
+                frame,
+                portfolio_thresholds(),
+                top=tool_input.get("top", 10),
+                status=tool_input.get("status")
+            )
+            return dumps({"success": True, "source": source, "cached": cached, **assessment})
+
+        if tool_name == "portfolio_valuation":
+            valuation = await asyncio.to_thread(
+                portfolio_engine.valuation,
+                frame,
+                portfolio_thresholds(),
+                top=tool_input.get("top", 10),
+                status=tool_input.get("status"),
+                **valuation_options(tool_input)
+            )
+            return dumps({"success": True, "source": source, "cached": cached, **valuation})
+
+        if tool_name == "scenario_grid":
+            # Todos os cenários × imóveis em matrizes: uma chamada no lugar de várias perguntas
+            grid = await asyncio.to_thread(
+                portfolio_engine.scenario_grid,
+                frame,
+                portfolio_thresholds(),
+                status=tool_input.get("status"),
+                **scenario_options(tool_input)
+            )
+            return dumps({"success": True, "source": source, "cached": cached, **grid})
+
+        return dumps({"success": False, "error": f"Tool '{tool_name}' não reconhecida"})
+
+    except Exception as e:
+        log_message("ERROR", f"Erro no motor de carteira: {str(e)}", cl.user_session.get("id", "default"))
+        return dumps({"success": False, "error": str(e)})
+
+
 # ==================== CLASSE AGENT ====================
 
+@lru_cache(maxsize=1)
+def _token_encoder():
+    try:
+        return tiktoken.encoding_for_model(Config.MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Conta tokens com tiktoken (se instalado) ou estima ~4 caracteres por token"""
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    return len(_token_encoder().encode(text))
+
+
+@dataclass(frozen=True)
+class AgentDefinition:
+    """Definição imutável de um agente, compartilhada por todas as sessões"""
+
+    type: AgentType
+    name: str
+    system_prompt: str
+    tools: tuple
+
+    @classmethod
+    def create(cls, agent_type: AgentType, name: str, system_prompt: str, tools: List[Dict] = None):
+        return cls(
+            type=agent_type,
+            name=name,
+            system_prompt=system_prompt,
+            tools=tuple(tools or ())
+        )
+
+
+HISTORY_FIELDS = ("role", "content", "tool_calls", "tool_call_id", "name")
+
+
+def compact_history(messages: List[Dict], max_tokens: int = None) -> List[Dict]:
+    """Compacta o histórico para persistir na thread
+
+    Remove campos vazios do model_dump, trunca resultados de tools longos e
+    mantém as mensagens mais recentes dentro do orçamento de tokens, sempre
+    começando numa mensagem do usuário (sem tool results órfãos).
+    """
+    max_tokens = max_tokens or Config.HISTORY_MAX_TOKENS
+    limit = Config.HISTORY_TOOL_RESULT_CHARS
+
+    compacted = []
+    for message in messages:
+        item = {key: message[key] for key in HISTORY_FIELDS if message.get(key) is not None}
+        if item.get("role") == "tool" and len(item.get("content", "")) > limit:
+            item["content"] = item["content"][:limit] + "\n… [resultado truncado]"
+        compacted.append(item)
+
+    total = 0
+    start = len(compacted)
+    while start > 0:
+        cost = count_tokens(dumps(compacted[start - 1]))
+        if total + cost > max_tokens:
+            break
+        total += cost
+        start -= 1
+
+    while start < len(compacted) and compacted[start].get("role") != "user":
+        start += 1
+
+    return compacted[start:]
+
+
 class Agent:
-    """Classe base para agentes especializados"""
-    
-    def __init__(self, agent_type: AgentType, name: str, system_prompt: str, tools: List[Dict] = None):
-        self.type = agent_type
-        self.name = name
-        self.system_prompt = system_prompt
-        self.tools = tools or []
-        self.message_history = [{"role": "system", "content": self.system_prompt}]
+    """Classe base para agentes especializados
+
+    Guarda apenas o estado da sessão (histórico e, opcionalmente, tools
+    próprias da sessão); prompt e tools padrão vêm da AgentDefinition.
+    """
+
+    __slots__ = ("definition", "message_history", "_tools", "_pending_history")
+
+    def __init__(self, definition: AgentDefinition):
+        self.definition = definition
+        self._tools: Optional[List[Dict]] = None
+        self._pending_history: Optional[List[Dict]] = None
+        self.message_history = [{"role": "system", "content": definition.system_prompt}]
+
+    @property
+    def type(self) -> AgentType:
+        return self.definition.type
+
+    @property
+    def name(self) -> str:
+        return self.definition.name
+
+    @property
+    def system_prompt(self) -> str:
+        return self.definition.system_prompt
+
+    @property
+    def tools(self):
+        return self._tools if self._tools is not None else self.definition.tools
+
+    @tools.setter
+    def tools(self, tools: Optional[List[Dict]]):
+        # Override por sessão (ex: tools MCP do analista); None volta ao padrão
+        self._tools = tools
     
+    @tracing.traced("agent.process")
     async def process(self, user_message: str, context: Dict = None, agents_ref: Dict = None) -> str:
         """Processa mensagem e retorna resposta"""
+        self._hydrate()
         if context:
-            user_message = f"CONTEXTO: {json.dumps(context, indent=2, ensure_ascii=False)}\n\nPERGUNTA: {user_message}"
+            user_message = f"CONTEXTO: {dumps(context)}\n\nPERGUNTA: {user_message}"
         
         self.message_history.append({
             "role": "user",
@@ -662,56 +1553,103 @@ class Agent:
         })
         
         # Loop de tool calling
+        iteration = 0
         while True:
+            iteration += 1
             try:
-                response = client.chat.completions.create(
-                    model=Config.MODEL,
-                    messages=self.message_history,
-                    tools=self.tools if self.tools else None,
-                    tool_choice="auto",
-                    max_tokens=Config.MAX_TOKENS,
-                    temperature=0.7
-                )
-                
-                message = response.choices[0].message
-                self.message_history.append(message.model_dump())
-                
-                # Verifica se há tool calls
-                if message.tool_calls:
-                    for tool_call in message.tool_calls:
-                        function_name = tool_call.function.name
-                        function_args = json.loads(tool_call.function.arguments)
-                        
-                        # Executa a função
-                        if self.type == AgentType.COORDINATOR:
-                            # Coordinator usa delegação
-                            result = await execute_coordinator_tool(function_name, function_args, agents_ref or {})
-                        elif self.type == AgentType.DATA_ANALYST:
-                            result = execute_sql_tool(function_name, function_args)
-                        elif self.type == AgentType.FINANCIAL_EXPERT:
-                            result = execute_financial_tool(function_name, function_args)
-                        else:
-                            result = "Tool execution not implemented"
-                        
-                        # Adiciona resultado ao histórico
-                        self.message_history.append({
-                            "role": "tool",
-                            "content": result,
-                            "tool_call_id": tool_call.id
-                        })
-                    continue
-                
-                # Retorna resposta final
-                return message.content
-                
+                with tracing.span("agent.iteration", agent=self.name, iteration=iteration):
+                    with tracing.span("openai.chat.completions", model=Config.MODEL) as llm_span, \
+                            LLM_LATENCY.time(agent=self.name, model=Config.MODEL):
+                        response = client.chat.completions.create(
+                            model=Config.MODEL,
+                            messages=self.message_history,
+                            tools=list(self.tools) if self.tools else None,
+                            tool_choice="auto",
+                            max_tokens=Config.MAX_TOKENS,
+                            temperature=0.7
+                        )
+                        if response.usage:
+                            llm_span.set_attributes(
+                                prompt_tokens=response.usage.prompt_tokens,
+                                completion_tokens=response.usage.completion_tokens,
+                                total_tokens=response.usage.total_tokens
+                            )
+                            LLM_TOKENS.inc(response.usage.prompt_tokens, agent=self.name, type="prompt")
+                            LLM_TOKENS.inc(response.usage.completion_tokens, agent=self.name, type="completion")
+
+                    message = response.choices[0].message
+                    self.message_history.append(message.model_dump())
+
+                    # Verifica se há tool calls
+                    if message.tool_calls:
+                        for tool_call in message.tool_calls:
+                            function_name = tool_call.function.name
+                            function_args = loads(tool_call.function.arguments)
+
+                            with tracing.span("agent.tool", agent=self.name, tool=function_name) as tool_span, \
+                                    TOOL_LATENCY.time(tool=function_name, source=self.type.value):
+                                # Executa a função
+                                if self.type == AgentType.COORDINATOR:
+                                    # Coordinator usa delegação
+                                    result = await execute_coordinator_tool(function_name, function_args, agents_ref or {})
+                                elif self.type == AgentType.DATA_ANALYST:
+                                    if resolve_mcp_tool(function_name):
+                                        # Tools MCP: mesma conexão e schema cache do servidor
+                                        result = await execute_mcp_tool(function_name, function_args)
+                                    else:
+                                        result = execute_sql_tool(function_name, function_args)
+                                elif self.type == AgentType.FINANCIAL_EXPERT:
+                                    if function_name in PORTFOLIO_TOOL_NAMES:
+                                        result = await execute_portfolio_tool(function_name, function_args)
+                                    elif function_name in BLOCKING_FINANCIAL_TOOLS:
+                                        result = await asyncio.to_thread(execute_financial_tool, function_name, function_args)
+                                    else:
+                                        result = execute_financial_tool(function_name, function_args)
+                                else:
+                                    result = "Tool execution not implemented"
+                                tool_span.set_attribute("bytes", len((result or "").encode("utf-8")))
+
+                            # Adiciona resultado ao histórico
+                            self.message_history.append({
+                                "role": "tool",
+                                "content": result,
+                                "tool_call_id": tool_call.id
+                            })
+                        continue
+
+                    # Retorna resposta final
+                    return message.content
+
             except Exception as e:
                 log_message("ERROR", f"Erro ao processar: {str(e)}", "agent")
                 return f"❌ Erro: {str(e)}"
     
     def clear_history(self):
         """Limpa histórico de mensagens"""
+        self._pending_history = None
         self.message_history = [{"role": "system", "content": self.system_prompt}]
 
+    def restore_history(self, history: List[Dict]):
+        """Agenda a restauração do histórico (materializado só quando o agente for usado)"""
+        self._pending_history = history or None
+
+    def export_history(self) -> List[Dict]:
+        """Histórico compactado, pronto para persistir na thread"""
+        if self._pending_history is not None:
+            return self._pending_history
+        return compact_history(self.message_history[1:])
+
+    def append_exchange(self, user_message: str, response: str, answered_by: str):
+        """Registra no histórico um turno respondido diretamente por outro agente"""
+        self._hydrate()
+        self.message_history.append({"role": "user", "content": user_message})
+        self.message_history.append({"role": "assistant", "content": f"[Respondido por {answered_by}]\n{response}"})
+
+    def _hydrate(self):
+        if self._pending_history is not None:
+            self.message_history = [self.message_history[0], *self._pending_history]
+            self._pending_history = None
+
 
 # ==================== ORQUESTRAÇÃO ====================
 
@@ -751,18 +1689,24 @@ def create_delegation_tools() -> List[Dict]:
         }
     ]
 
+@tracing.traced("coordinator.tool")
 async def execute_coordinator_tool(tool_name: str, tool_input: Dict[str, Any], agents: Dict[str, Any]) -> str:
     """Executa tools de delegação do Coordinator"""
+    tracing.current_span().set_attribute("tool", tool_name)
     try:
         if tool_name == "delegate_to_data_analyst":
             query = tool_input.get("query", "")
             log_message("DELEGATION", f"Coordinator → Data Analyst: {query}", "coordinator")
+            DELEGATIONS.inc(target="data_analyst")
+            intent_router.learn(query, "data_analyst")
             result = await agents["data_analyst"].process(query)
             return result
             
         elif tool_name == "delegate_to_financial_expert":
             query = tool_input.get("query", "")
             log_message("DELEGATION", f"Coordinator → Financial Expert: {query}", "coordinator")
+            DELEGATIONS.inc(target="financial_expert")
+            intent_router.learn(query, "financial_expert")
             result = await agents["financial_expert"].process(query)
             return result
         else:
@@ -772,13 +1716,21 @@ async def execute_coordinator_tool(tool_name: str, tool_input: Dict[str, Any], a
         return f"❌ Erro na delegação: {str(e)}"
 
 
+# Roteador local: treinado em background com as delegações do log
+intent_router = IntentRouter(Config.INTENT_ROUTER_THRESHOLD, Config.INTENT_ROUTER_MIN_EXAMPLES)
+if Config.INTENT_ROUTER_ENABLED:
+    threading.Thread(target=intent_router.train_from_log, args=(Config.LOG_FILE,),
+                     name="intent-router-train", daemon=True).start()
+
+
 # ==================== CRIAÇÃO DE AGENTES ====================
 
-def create_agents():
-    """Factory de agentes com prompts personalizáveis"""
+@lru_cache(maxsize=1)
+def get_agent_definitions() -> Dict[str, AgentDefinition]:
+    """Definições dos agentes, montadas uma vez por processo"""
     
     # Prompts podem ser customizados via arquivo externo
-    coordinator = Agent(
+    coordinator = AgentDefinition.create(
         AgentType.COORDINATOR,
         "Gabi.",
         """Você é Gabi., uma assistente inteligente especializada em análise de carteiras imobiliárias e acesso a bases de dados.
@@ -822,7 +1774,7 @@ IMPORTANTE: Sempre responda em português de forma profissional e objetiva.""",
         create_delegation_tools()  # Tools de delegação
     )
     
-    financial_expert = Agent(
+    financial_expert = AgentDefinition.create(
         AgentType.FINANCIAL_EXPERT,
         "Especialista Financeiro",
         f"""Você é um Especialista Financeiro com expertise em investimentos imobiliários.
@@ -832,17 +1784,28 @@ EXPERTISE:
 - Avaliação de risco
 - Estratégias de diversificação
 - Valuation
+- Fluxo de caixa, TIR/VPL, DSCR e amortização (Price/SAC)
 
 THRESHOLDS CONFIGURADOS:
 - ROI Excelente: >{Config.ROI_EXCELLENT_THRESHOLD}%
 - ROI Bom: >{Config.ROI_GOOD_THRESHOLD}%
 - Cap Rate Excelente: >{Config.CAP_RATE_EXCELLENT_THRESHOLD}%
 
+Para perguntas sobre a carteira inteira ou grupos de imóveis use analyze_portfolio
+(lê o banco e calcula tudo em uma chamada) em vez de calcular imóvel a imóvel.
+Para TIR, VPL, DSCR e financiamentos use cash_flow_projection e loan_schedule; para
+muitos imóveis ou empréstimos de uma vez use irr_npv_batch e loan_portfolio_analysis
+(uma chamada para a carteira inteira, nunca uma por imóvel).
+Para perguntas "e se" (juros, vacância, crescimento, cap rate) use scenario_grid com
+todos os valores de uma vez e apresente a tabela de sensibilidade.
+Para valuation use valuation_analysis (imóveis informados) ou portfolio_valuation
+(carteira do banco): apresente percentis (p5/p50/p95), não um valor único.
+
 Forneça análises baseadas em dados concretos e recomendações acionáveis.""",
-        FINANCIAL_TOOLS
+        FINANCIAL_TOOLS + (PORTFOLIO_TOOLS if portfolio_engine else [])
     )
     
-    data_analyst = Agent(
+    data_analyst = AgentDefinition.create(
         AgentType.DATA_ANALYST,
         "Analista de Dados",
         f"""Você é um Analista de Dados especializado em SQL e carteiras imobiliárias.
@@ -852,8 +1815,10 @@ LIMITE DE QUERY: {Config.QUERY_LIMIT} registros
 Sempre:
 1. Valide conexão antes de consultar
 2. Use queries eficientes
-3. Apresente dados estruturados
-4. Identifique padrões relevantes""",
+3. Se a ferramenta aggregate estiver disponível (servidor MCP de banco), use-a para totais, médias, contagens e rankings (calcula no banco) em vez de buscar linhas
+4. Se a ferramenta profile_table estiver disponível, use-a para explorar colunas (nulos, distintos, mín/máx, valores frequentes) em vez de várias queries
+5. Apresente dados estruturados
+6. Identifique padrões relevantes""",
         SQL_TOOLS
     )
     
@@ -864,6 +1829,33 @@ Sempre:
     }
 
 
+def create_agents() -> Dict[str, Agent]:
+    """Agentes da sessão: só histórico próprio sobre as definições compartilhadas"""
+    return {key: Agent(definition) for key, definition in get_agent_definitions().items()}
+
+
+def persist_agent_histories(agents: Dict[str, Agent]):
+    """Salva os históricos compactados no user_session (metadata da thread)"""
+    cl.user_session.set("agent_histories", {
+        key: history for key, agent in agents.items() if (history := agent.export_history())
+    })
+
+
+def restore_agent_histories(agents: Dict[str, Agent], thread: Dict[str, Any]):
+    """Restaura históricos salvos por persist_agent_histories na retomada"""
+    histories = cl.user_session.get("agent_histories")
+    if histories is None:
+        metadata = thread.get("metadata") or {}
+        if isinstance(metadata, str):
+            metadata = loads(metadata)
+        histories = metadata.get("agent_histories") or {}
+
+    for key, history in histories.items():
+        if key in agents:
+            agents[key].restore_history(history)
+    return len(histories)
+
+
 # ==================== CHAINLIT HANDLERS ====================
 
 @cl.password_auth_callback
@@ -931,6 +1923,262 @@ async def set_starters():
 
 # ==================== MCP HANDLERS ====================
 
+# Requests MCP em andamento por sessão (cancelados ao parar/encerrar o chat)
+mcp_inflight: Dict[str, Dict[int, ClientSession]] = {}
+# Código do McpError levantado pelo ClientSession ao estourar read_timeout_seconds
+MCP_REQUEST_TIMEOUT = 408
+
+
+async def cancel_mcp_request(mcp_session: ClientSession, request_id: int, reason: str):
+    """Envia notifications/cancelled para o servidor MCP interromper o statement"""
+    try:
+        await mcp_session.send_notification(
+            mcp_types.ClientNotification(
+                mcp_types.CancelledNotification(
+                    method="notifications/cancelled",
+                    params=mcp_types.CancelledNotificationParams(requestId=request_id, reason=reason)
+                )
+            )
+        )
+    except Exception as e:
+        log_message("WARNING", f"Falha ao cancelar request MCP {request_id}: {str(e)}")
+
+
+async def call_mcp_tool(mcp_session: ClientSession, tool_name: str, tool_input: Dict[str, Any]):
+    """Chama tool MCP com timeout e propaga cancelamento para o servidor"""
+    session_id = cl.user_session.get("id", "unknown")
+    inflight = mcp_inflight.setdefault(session_id, {})
+
+    # Propaga o trace no _meta da request: os argumentos seguem intactos para
+    # servidores MCP de terceiros (que podem validar o schema estritamente)
+    trace_context = tracing.inject()
+    request = mcp_types.ClientRequest(mcp_types.CallToolRequest(
+        params=mcp_types.CallToolRequestParams(
+            name=tool_name,
+            arguments=tool_input,
+            _meta=mcp_types.RequestParams.Meta(trace=trace_context) if trace_context else None
+        )
+    ))
+
+    # O ClientSession não devolve o ID da request: send_request o reserva antes do
+    # primeiro await, então o próximo ID é lido logo antes da chamada, sem ponto de
+    # suspensão no meio; nenhuma outra request da sessão (list_tools, outra tool)
+    # roda nesse intervalo. send_request direto (sem call_tool) também evita o
+    # list_tools que o SDK dispara ao validar structuredContent.
+    request_id = getattr(mcp_session, "_request_id", None)
+    if request_id is not None:
+        inflight[request_id] = mcp_session
+
+    if tool_name == "connect_database" and portfolio_cache:
+        # O servidor MCP troca de banco: a carteira em cache não vale mais
+        portfolio_cache.invalidate(session_id)
+
+    try:
+        return await mcp_session.send_request(
+            request,
+            mcp_types.CallToolResult,
+            request_read_timeout_seconds=timedelta(seconds=Config.MCP_TOOL_TIMEOUT)
+        )
+    except asyncio.CancelledError:
+        if request_id is not None:
+            await asyncio.shield(cancel_mcp_request(mcp_session, request_id, "Interrompido pelo usuário"))
+        raise
+    except McpError as e:
+        # Só o timeout no cliente deixa o servidor executando; demais erros já encerraram a request
+        if e.error.code == MCP_REQUEST_TIMEOUT and request_id is not None:
+            await cancel_mcp_request(mcp_session, request_id, "Timeout no cliente")
+        raise
+    finally:
+        inflight.pop(request_id, None)
+
+
+async def cancel_session_mcp_requests(session_id: str, reason: str):
+    """Cancela todas as requests MCP pendentes de uma sessão"""
+    for request_id, mcp_session in list(mcp_inflight.pop(session_id, {}).items()):
+        await cancel_mcp_request(mcp_session, request_id, reason)
+
+
+def qualified_tool_name(connection_name: str, tool_name: str) -> str:
+    """Nome único da tool: <connection>__<tool> (charset aceito pela OpenAI)"""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", f"{connection_name}__{tool_name}")
+
+
+def index_mcp_tools(connection_name: str, tools: List[Dict[str, Any]]):
+    """Registra as tools da connection no índice nome → [(connection, tool)]
+
+    Nomes repetidos entre servidores (ex: execute_query no MSSQL e no
+    PostgreSQL) resolvem para a connection registrada primeiro; o nome
+    qualificado <connection>__<tool> sempre aponta para a connection exata.
+    """
+    session_id = cl.user_session.get("id", "unknown")
+    index = cl.user_session.get("mcp_tool_index", {})
+
+    for tool in tools:
+        routes = index.setdefault(tool["name"], [])
+        routes.append([connection_name, tool["name"]])
+        if len(routes) > 1:
+            log_message(
+                "WARNING",
+                f"Tool '{tool['name']}' existe em {[route[0] for route in routes]}; "
+                f"usando '{routes[0][0]}' (use {qualified_tool_name(connection_name, tool['name'])})",
+                session_id
+            )
+        index[qualified_tool_name(connection_name, tool["name"])] = [[connection_name, tool["name"]]]
+
+    cl.user_session.set("mcp_tool_index", index)
+
+
+def unindex_mcp_tools(connection_name: str, tools: List[Dict[str, Any]]):
+    """Remove do índice as rotas da connection desconectada"""
+    index = cl.user_session.get("mcp_tool_index", {})
+
+    for tool in tools:
+        index.pop(qualified_tool_name(connection_name, tool["name"]), None)
+        routes = [route for route in index.get(tool["name"], []) if route[0] != connection_name]
+        if routes:
+            index[tool["name"]] = routes
+        else:
+            index.pop(tool["name"], None)
+
+    cl.user_session.set("mcp_tool_index", index)
+
+
+def resolve_mcp_tool(tool_name: str) -> Optional[tuple]:
+    """Resolve nome (simples ou qualificado) para (connection, tool) em O(1)"""
+    routes = cl.user_session.get("mcp_tool_index", {}).get(tool_name)
+    return tuple(routes[0]) if routes else None
+
+
+def build_mcp_function_schemas() -> List[Dict]:
+    """Converte as tools MCP da sessão em function schemas da OpenAI
+
+    Tools com nome repetido entre connections são expostas com o nome
+    qualificado (<connection>__<tool>) para o modelo escolher o banco.
+    """
+    index = cl.user_session.get("mcp_tool_index", {})
+    schemas = []
+
+    for connection_name, tools in cl.user_session.get("mcp_tools", {}).items():
+        for tool in tools:
+            name = tool["name"]
+            if len(index.get(name, [])) > 1 or not re.fullmatch(r"[A-Za-z0-9_-]+", name):
+                name = qualified_tool_name(connection_name, name)
+
+            schemas.append({
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": f"[{connection_name}] {tool['description'] or ''}",
+                    "parameters": tool["input_schema"] or {"type": "object", "properties": {}}
+                }
+            })
+
+    return schemas
+
+
+def refresh_analyst_tools():
+    """Atualiza as tools do analista com as tools MCP da sessão
+
+    SQL_TOOLS (conexão pyodbc direta) só é substituído quando um servidor MCP
+    de banco (que expõe execute_query) está conectado; tools de outros
+    servidores MCP são somadas a SQL_TOOLS. Sem connection volta ao padrão.
+    """
+    agents = cl.user_session.get("agents")
+    if not agents:
+        return
+    schemas = build_mcp_function_schemas()
+    if not schemas:
+        agents["data_analyst"].tools = None
+        return
+
+    database_connected = any(
+        tool["name"] == "execute_query"
+        for tools in cl.user_session.get("mcp_tools", {}).values()
+        for tool in tools
+    )
+    if not database_connected:
+        # Nomes MCP têm precedência (resolve_mcp_tool roteia antes de execute_sql_tool)
+        names = {schema["function"]["name"] for schema in schemas}
+        schemas = [tool for tool in SQL_TOOLS if tool["function"]["name"] not in names] + schemas
+    agents["data_analyst"].tools = schemas
+
+
+async def execute_mcp_tool(tool_name: str, tool_input: Dict[str, Any]) -> str:
+    """Executa tool MCP via call_tool e devolve o texto para o histórico do agente"""
+    result = await call_tool(SimpleNamespace(name=tool_name, input=tool_input))
+    if isinstance(result, dict):
+        return dumps(result)
+    text = "\n".join(content.text for content in result.content if getattr(content, "text", None) is not None)
+
+    route = resolve_mcp_tool(tool_name)
+    if route and route[1] == "export_query":
+        await attach_export_file(text)
+    return text
+
+
+async def attach_export_file(result_text: str):
+    """Anexa o arquivo gerado pelo export_query como download no chat"""
+    try:
+        export = loads(result_text)
+    except ValueError:
+        return
+    if not export.get("success") or not os.path.exists(export.get("path", "")):
+        return
+
+    size_mb = export["bytes"] / (1024 * 1024)
+    await cl.Message(
+        content=f"📎 Exportação pronta: {export['rows']:,} linhas em {export['format'].upper()} ({size_mb:.1f} MB)",
+        elements=[cl.File(name=export["file_name"], path=export["path"], display="inline")]
+    ).send()
+
+
+async def warm_up_mcp(previous: Optional[asyncio.Task] = None):
+    """Conecta os bancos default e carrega o schema enquanto o usuário digita"""
+    if previous:
+        await asyncio.wait([previous])
+
+    session_id = cl.user_session.get("id", "unknown")
+    warmed = cl.user_session.get("mcp_warmed", [])
+
+    with tracing.span("mcp.warmup"):
+        for kind, connect in (("mssql", connect_to_default_mssql), ("postgres", connect_to_default_postgres)):
+            if kind in warmed:
+                continue
+            ok, detail = await connect()
+            if ok:
+                warmed.append(kind)
+                log_message("SUCCESS", f"Warm-up MCP {kind}: {detail}", session_id)
+
+    cl.user_session.set("mcp_warmed", warmed)
+
+
+def schedule_mcp_warmup():
+    """Dispara o warm-up em background (uma task por vez por sessão)
+
+    Chamado por on_mcp_connect: no on_chat_start as connections MCP da
+    sessão ainda não existem.
+    """
+    if not Config.MCP_WARMUP_ENABLED or not cl.context.session.mcp_sessions:
+        return
+
+    # Connection nova durante um warm-up: encadeia outra rodada ao final
+    previous = cl.user_session.get("mcp_warmup_task")
+    if previous and previous.done():
+        previous = None
+    cl.user_session.set("mcp_warmup_task", asyncio.create_task(warm_up_mcp(previous)))
+    # Connection nova: main() volta a ter direito a uma nova tentativa se falhar
+    cl.user_session.set("mcp_warmup_retried", False)
+
+
+async def wait_mcp_warmup():
+    """Aguarda o warm-up só quando uma tool MCP realmente vai ser usada"""
+    task = cl.user_session.get("mcp_warmup_task")
+    if task and not task.done():
+        with tracing.span("mcp.warmup.wait"):
+            # asyncio.wait: interromper a resposta não cancela o warm-up
+            await asyncio.wait([task])
+
+
 @cl.on_mcp_connect
 async def on_mcp_connect(connection, session: ClientSession):
     """Handler MCP nativo - Discovery automático de tools"""
@@ -947,8 +2195,14 @@ async def on_mcp_connect(connection, session: ClientSession):
         
         # Armazenar tools para uso posterior
         mcp_tools = cl.user_session.get("mcp_tools", {})
+        if connection.name in mcp_tools:
+            # Reconexão: descarta as rotas antigas antes de reindexar
+            unindex_mcp_tools(connection.name, mcp_tools[connection.name])
         mcp_tools[connection.name] = tools
         cl.user_session.set("mcp_tools", mcp_tools)
+        index_mcp_tools(connection.name, tools)
+        refresh_analyst_tools()
+        schedule_mcp_warmup()
         
         session_id = cl.user_session.get("id", "unknown")
         log_message("SUCCESS", f"MCP conectado: {connection.name} ({len(tools)} tools)", session_id)
@@ -970,8 +2224,9 @@ async def on_mcp_disconnect(name: str, session: ClientSession):
         # Remover tools da sessão
         mcp_tools = cl.user_session.get("mcp_tools", {})
         if name in mcp_tools:
-            del mcp_tools[name]
+            unindex_mcp_tools(name, mcp_tools.pop(name))
             cl.user_session.set("mcp_tools", mcp_tools)
+            refresh_analyst_tools()
         
         session_id = cl.user_session.get("id", "unknown")
         log_message("INFO", f"MCP desconectado: {name}", session_id)
@@ -986,32 +2241,52 @@ async def on_mcp_disconnect(name: str, session: ClientSession):
         log_message("ERROR", f"Erro no MCP disconnect: {str(e)}", session_id)
 
 
+def record_statement_cache(tool_name: str, result):
+    """Contabiliza hit/miss do cache de prepared statements do servidor MCP"""
+    if tool_name != "execute_query" or result.isError or not result.content:
+        return
+    text = getattr(result.content[0], "text", "")
+    if '"statement_cache"' not in text:
+        return
+    try:
+        statement_cache = loads(text).get("statement_cache")
+    except ValueError:
+        return
+    if statement_cache and "hit" in statement_cache:
+        CACHE_REQUESTS.inc(cache="mcp_statement", result="hit" if statement_cache["hit"] else "miss")
+
+
 @cl.step(type="tool")
+@tracing.traced("mcp.call_tool")
 async def call_tool(tool_use):
     """Handler MCP nativo - Execução de tools"""
     tool_name = tool_use.name
     tool_input = tool_use.input
+    tracing.current_span().set_attribute("tool", tool_name)
     
     try:
-        # Obter sessões MCP ativas
-        mcp_sessions = cl.context.session.mcp_sessions
-        
-        # Encontrar qual MCP connection possui esta tool
-        mcp_name = None
-        for name, (session, _) in mcp_sessions.items():
-            tools = cl.user_session.get("mcp_tools", {}).get(name, [])
-            if any(t["name"] == tool_name for t in tools):
-                mcp_name = name
-                break
-        
-        if not mcp_name:
+        await wait_mcp_warmup()
+
+        # Índice tool → connection (mantido em on_mcp_connect/disconnect)
+        route = resolve_mcp_tool(tool_name)
+        if not route:
             return {"error": f"Tool '{tool_name}' não encontrada em nenhuma connection MCP"}
+        mcp_name, tool_name = route
         
         # Obter a sessão MCP
-        mcp_session, _ = mcp_sessions.get(mcp_name)
+        mcp_entry = cl.context.session.mcp_sessions.get(mcp_name)
+        if not mcp_entry:
+            return {"error": f"Connection MCP '{mcp_name}' não está ativa"}
+        mcp_session, _ = mcp_entry
         
-        # Chamar a tool
-        result = await mcp_session.call_tool(tool_name, tool_input)
+        # Chamar a tool (com timeout e cancelamento)
+        with TOOL_LATENCY.time(tool=tool_name, source=f"mcp:{mcp_name}"):
+            result = await call_mcp_tool(mcp_session, tool_name, tool_input)
+        record_statement_cache(tool_name, result)
+        tracing.current_span().set_attributes(
+            connection=mcp_name,
+            bytes=sum(len(getattr(c, "text", "") or "") for c in result.content)
+        )
         
         session_id = cl.user_session.get("id", "unknown")
         log_message("INFO", f"Tool {tool_name} executada via MCP {mcp_name}", session_id)
@@ -1032,9 +2307,12 @@ async def on_resume(thread):
     # - Elementos anexados
     # - User session (campos JSON-serializáveis)
     
-    # Recriar agentes (não serializáveis, precisam ser recriados)
+    # Recriar agentes (não serializáveis) e restaurar os históricos persistidos
     agents = create_agents()
+    restored = restore_agent_histories(agents, thread)
     cl.user_session.set("agents", agents)
+    refresh_analyst_tools()
+    ACTIVE_SESSIONS.inc()
     
     # Restaurar conversation_count se existir no user_session
     # (persistido automaticamente se for JSON-serializável)
@@ -1046,7 +2324,7 @@ async def on_resume(thread):
     selected_profile = cl.user_session.get("chat_profile", "Completo")
     
     thread_name = thread.get("name", "Conversação anterior")
-    log_message("INFO", f"Conversação retomada para {user_name}: {thread_name} (Perfil: {selected_profile})", app_user.identifier if app_user else "unknown")
+    log_message("INFO", f"Conversação retomada para {user_name}: {thread_name} (Perfil: {selected_profile}, {restored} históricos)", app_user.identifier if app_user else "unknown")
 
     # Mensagem do arquivo JSON (editável sem rebuild!)
     titulo = Messages.get('chat_retomado', 'titulo')
@@ -1060,6 +2338,7 @@ async def start():
     agents = create_agents()
     cl.user_session.set("agents", agents)
     cl.user_session.set("conversation_count", 0)
+    ACTIVE_SESSIONS.inc()
     
     session_id = cl.user_session.get("id")
     app_user = cl.user_session.get("user")
@@ -1103,10 +2382,18 @@ Acesso total aos especialistas Financeiro e Dados."""
 
 
 @cl.on_message
+@tracing.traced("chat.turn")
 async def main(message: cl.Message):
     """Processa mensagens com orquestrador dinâmico automático"""
+    with TURN_LATENCY.time():
+        await process_turn(message)
+
+
+async def process_turn(message: cl.Message):
+    """Executa um turno do chat (medido em main)"""
     agents = cl.user_session.get("agents")
     session_id = cl.user_session.get("id")
+    tracing.current_span().set_attributes(session_id=session_id, message_length=len(message.content))
     count = cl.user_session.get("conversation_count", 0) + 1
     cl.user_session.set("conversation_count", count)
 
@@ -1124,31 +2411,60 @@ async def main(message: cl.Message):
                                           "database", "lista", "mostra", "extrai",
                                           "schema", "consulta", "quantos", "postgres", "mssql"]
         if any(kw in content_lower for kw in data_keywords_for_auto_connect):
-            # Tentar auto-conectar se não estiver conectado
-            mcp_tools = cl.user_session.get("mcp_tools", {})
-            if not mcp_tools:
-                auto_connected = await auto_connect_mssql_mcp()
+            # Decide pelo resultado do warm-up (mcp_warmed), não pela existência da task
+            await wait_mcp_warmup()
+            if not cl.user_session.get("mcp_warmed"):
+                if cl.user_session.get("mcp_warmup_task"):
+                    # Warm-up não conectou nenhum banco: uma única nova tentativa em primeiro
+                    # plano (repetir a cada mensagem pagaria o timeout de conexão todo turno)
+                    auto_connected = False
+                    if not cl.user_session.get("mcp_warmup_retried"):
+                        cl.user_session.set("mcp_warmup_retried", True)
+                        await warm_up_mcp()
+                        auto_connected = bool(cl.user_session.get("mcp_warmed"))
+                else:
+                    # Tentar auto-conectar se não estiver conectado
+                    auto_connected = not cl.user_session.get("mcp_tools") and await auto_connect_mssql_mcp()
                 if auto_connected:
                     # Mensagem do arquivo JSON (editável sem rebuild!)
                     msg_auto_conectado = Messages.get('mcp', 'auto_conectado', 'mensagem')
                     await cl.Message(content=msg_auto_conectado).send()
 
-        # ORQUESTRADOR DINÂMICO
-        # Sempre usa o Coordinator que decide automaticamente qual agente usar
-        # baseado no contexto da mensagem via OpenAI Function Calling
-        agent = agents["coordinator"]
-        emoji = "🎯" if Config.INCLUDE_EMOJIS else ""
+        # ROTEAMENTO LOCAL
+        # Casos claros vão direto ao especialista (sem a chamada do Coordinator ao modelo)
+        route, reason = intent_router.route(message.content) if Config.INTENT_ROUTER_ENABLED else (None, "disabled")
+        INTENT_ROUTES.inc(route=route or "coordinator")
+        tracing.current_span().set_attributes(route=route or "coordinator", route_reason=reason)
+
+        if route:
+            agent = agents[route]
+            emoji = ("📊" if route == "data_analyst" else "👔") if Config.INCLUDE_EMOJIS else ""
+            log_message("DELEGATION", f"Router → {agent.name} ({reason})", session_id)
+
+            response = await agent.process(message.content)
+
+            # Coordinator continua ciente da conversa para os próximos turnos
+            agents["coordinator"].append_exchange(message.content, response, agent.name)
+        else:
+            # ORQUESTRADOR DINÂMICO
+            # Coordinator decide automaticamente qual agente usar
+            # baseado no contexto da mensagem via OpenAI Function Calling
+            agent = agents["coordinator"]
+            emoji = "🎯" if Config.INCLUDE_EMOJIS else ""
 
-        # Processa com o coordenador (orquestrador)
-        # O Coordinator automaticamente delega para o agente apropriado
-        response = await agent.process(message.content, agents_ref=agents)
+            # Processa com o coordenador (orquestrador)
+            # O Coordinator automaticamente delega para o agente apropriado
+            response = await agent.process(message.content, agents_ref=agents)
 
         # Formata resposta
         formatted_response = f"{emoji} **{agent.name}**\n\n{response}"
         msg.content = formatted_response
         await msg.update()
 
-        log_message("AGENT_RESPONSE", f"Coordinator (orchestrator), Length: {len(response)}", session_id)
+        log_message("AGENT_RESPONSE", f"{agent.name} ({route or 'orchestrator'}), Length: {len(response)}", session_id)
+
+        # Persistido com a thread pelo data layer do Chainlit
+        persist_agent_histories(agents)
 
     except Exception as e:
         # Mensagem de erro do arquivo JSON
@@ -1159,11 +2475,28 @@ async def main(message: cl.Message):
         log_message("ERROR", str(e), session_id)
 
 
+@cl.on_stop
+async def on_stop():
+    """Usuário interrompeu a resposta: cancela queries MCP em andamento"""
+    session_id = cl.user_session.get("id")
+    log_message("INFO", "Execução interrompida pelo usuário", session_id)
+    await cancel_session_mcp_requests(session_id, "Interrompido pelo usuário")
+
+
 @cl.on_chat_end
 async def end():
     """Limpa recursos ao encerrar"""
     session_id = cl.user_session.get("id")
     log_message("INFO", "Sessão encerrada", session_id)
+    ACTIVE_SESSIONS.dec()
+
+    # Libera statements ainda em execução nos servidores MCP
+    warmup_task = cl.user_session.get("mcp_warmup_task")
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    await cancel_session_mcp_requests(session_id, "Chat encerrado")
+    if portfolio_cache:
+        portfolio_cache.invalidate(session_id)
     
     if session_id in connections_store:
         for conn_info in connections_store[session_id]["connections"].values():
@@ -1207,7 +2540,7 @@ async def auto_connect_mssql_mcp():
                     }
                     
                     # Chamar connect_database via MCP
-                    result = await session.call_tool("connect_database", connection_params)
+                    result = await call_mcp_tool(session, "connect_database", connection_params)
                     
                     session_id = cl.user_session.get("id", "unknown")
                     log_message("SUCCESS", f"Auto-conectado ao MCP SQL: {name}", session_id)
@@ -1328,7 +2661,7 @@ async def on_conectar_mcp_automatico(action):
         msg = await cl.Message(content=msg_conectando).send()
         
         # Chamar connect_database via MCP
-        result = await session.call_tool("connect_database", connection_params)
+        result = await call_mcp_tool(session, "connect_database", connection_params)
         
         # Atualizar mensagem com sucesso
         success_msg = f"""✅ **Conexão bem-sucedida!**
@@ -1435,12 +2768,13 @@ async def connect_to_default_mssql():
         }
 
         # Conectar
-        result = await session.call_tool("connect_database", connection_params)
+        result = await call_mcp_tool(session, "connect_database", connection_params)
+        result = getattr(result, "content", result)  # CallToolResult → lista de contents
 
         # Processar resultado
         if isinstance(result, list) and len(result) > 0:
             content = result[0].text if hasattr(result[0], 'text') else str(result[0])
-            result_data = json.loads(content) if isinstance(content, str) else content
+            result_data = loads(content) if isinstance(content, str) else content
 
             if result_data.get("success"):
                 tables_count = result_data.get("tables_discovered", 0)
@@ -1485,12 +2819,13 @@ async def connect_to_default_postgres():
         }
 
         # Conectar
-        result = await session.call_tool("connect_database", connection_params)
+        result = await call_mcp_tool(session, "connect_database", connection_params)
+        result = getattr(result, "content", result)  # CallToolResult → lista de contents
 
         # Processar resultado
         if isinstance(result, list) and len(result) > 0:
             content = result[0].text if hasattr(result[0], 'text') else str(result[0])
-            result_data = json.loads(content) if isinstance(content, str) else content
+            result_data = loads(content) if isinstance(content, str) else content
 
             if result_data.get("success"):
                 tables_count = result_data.get("tables_discovered", 0)
@@ -0,0 +1,580 @@
+"""
+Projeção de fluxo de caixa, TIR/VPL, DSCR e amortização
+Desenvolvido por ness.
+
+Tudo opera em matrizes imóvel/empréstimo × período (numpy): a TIR de
+milhares de fluxos é resolvida de uma vez (Newton vetorizado com bisseção
+para as linhas que não convergem) e os cronogramas Price/SAC de milhares de
+empréstimos saem em fórmulas fechadas, sem loops por item.
+"""
+
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+import valuation_engine
+
+AMORTIZATION_METHODS = ("price", "sac")
+IRR_BOUNDS = (-0.99, 10.0)    # intervalo da bisseção (taxa por período)
+
+
+def pad_cash_flows(rows: Sequence[Sequence[float]]) -> np.ndarray:
+    """Lista de fluxos (tamanhos diferentes) → matriz completada com zeros no fim
+
+    Zeros finais não alteram TIR nem VPL.
+    """
+    width = max((len(row) for row in rows), default=0)
+    flows = np.zeros((len(rows), width))
+    for index, row in enumerate(rows):
+        flows[index, :len(row)] = row
+    return np.nan_to_num(flows)
+
+
+# ==================== TIR / VPL ====================
+
+def npv(rate, cash_flows) -> np.ndarray:
+    """VPL de cada linha (fluxo do período 0 na primeira coluna)"""
+    flows = np.atleast_2d(np.asarray(cash_flows, dtype=np.float64))
+    rate = np.broadcast_to(np.asarray(rate, dtype=np.float64), (len(flows),))
+    discount = (1 + rate)[:, None] ** -np.arange(flows.shape[1])
+    return (flows * discount).sum(axis=1)
+
+
+def _npv_and_derivative(rate: np.ndarray, flows: np.ndarray):
+    periods = np.arange(flows.shape[1])
+    discount = (1 + rate)[:, None] ** -periods
+    value = (flows * discount).sum(axis=1)
+    derivative = -(flows * periods * discount).sum(axis=1) / (1 + rate)
+    return value, derivative
+
+
+def irr(cash_flows, guess: float = 0.1, tol: float = 1e-10, max_iter: int = 50) -> np.ndarray:
+    """TIR por período de cada linha; NaN quando o fluxo não troca de sinal
+
+    Newton roda sobre todas as linhas ativas ao mesmo tempo; as que
+    divergem ou não convergem em max_iter vão para a bisseção em
+    IRR_BOUNDS (também vetorizada).
+    """
+    flows = np.atleast_2d(np.asarray(cash_flows, dtype=np.float64))
+    size = len(flows)
+    result = np.full(size, np.nan)
+    has_root = (flows > 0).any(axis=1) & (flows < 0).any(axis=1)
+
+    rate = np.full(size, guess)
+    active = np.flatnonzero(has_root)
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        value, derivative = _npv_and_derivative(rate[active], flows[active])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = value / derivative
+        updated = rate[active] - step
+        valid = np.isfinite(updated) & (updated > IRR_BOUNDS[0]) & (updated < IRR_BOUNDS[1])
+        converged = valid & (np.abs(step) <= tol * (1 + np.abs(updated)))
+        rate[active] = np.where(valid, updated, rate[active])
+        result[active[converged]] = updated[converged]
+        active = active[valid & ~converged]
+
+    pending = np.flatnonzero(has_root & np.isnan(result))
+    if pending.size:
+        result[pending] = _bisect(flows[pending], tol)
+    return result
+
+
+def _bisect(flows: np.ndarray, tol: float, max_iter: int = 200) -> np.ndarray:
+    low = np.full(len(flows), IRR_BOUNDS[0])
+    high = np.full(len(flows), IRR_BOUNDS[1])
+    low_value = npv(low, flows)
+    high_value = npv(high, flows)
+    bracketed = np.sign(low_value) != np.sign(high_value)
+
+    for _ in range(max_iter):
+        middle = (low + high) / 2
+        middle_value = npv(middle, flows)
+        same_side = np.sign(middle_value) == np.sign(low_value)
+        low = np.where(same_side, middle, low)
+        low_value = np.where(same_side, middle_value, low_value)
+        high = np.where(same_side, high, middle)
+        if np.all(high - low <= tol * (1 + np.abs(low))):
+            break
+
+    return np.where(bracketed, (low + high) / 2, np.nan)
+
+
+def annualize(rate, periods_per_year: int):
+    """Taxa por período → taxa efetiva anual"""
+    return (1 + np.asarray(rate)) ** periods_per_year - 1
+
+
+# ==================== AMORTIZAÇÃO ====================
+
+def _loan_arrays(principal, annual_rate, years, payments_per_year: int):
+    principal, annual_rate, years = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(principal, dtype=np.float64)),
+        np.atleast_1d(np.asarray(annual_rate, dtype=np.float64)),
+        np.atleast_1d(np.asarray(years, dtype=np.float64)),
+    )
+    if (principal < 0).any() or (annual_rate < 0).any() or (years <= 0).any():
+        raise ValueError("Principal e taxa não podem ser negativos e o prazo deve ser positivo")
+    # Taxa nominal anual dividida pelo número de parcelas no ano
+    return principal, annual_rate / payments_per_year, np.rint(years * payments_per_year).astype(np.int64)
+
+
+def schedule(principal, annual_rate, years, payments_per_year: int = 12, method: str = "price",
+             periods: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Cronograma de vários empréstimos: matrizes empréstimo × parcela
+
+    Colunas além do prazo de cada empréstimo ficam zeradas. periods limita
+    as colunas calculadas (ex: só o primeiro ano para DSCR).
+    """
+    if method not in AMORTIZATION_METHODS:
+        raise ValueError(f"Método de amortização inválido: {method} (use {', '.join(AMORTIZATION_METHODS)})")
+    principal, rate, terms = _loan_arrays(principal, annual_rate, years, payments_per_year)
+    periods = int(terms.max()) if periods is None else int(periods)
+    k = np.arange(1, periods + 1)
+    in_term = k <= terms[:, None]
+    principal, rate, terms = principal[:, None], rate[:, None], terms[:, None]
+
+    if method == "price":
+        growth = (1 + rate) ** k
+        with np.errstate(divide="ignore", invalid="ignore"):
+            payment = np.where(rate > 0, principal * rate / (1 - (1 + rate) ** -terms), principal / terms)
+            balance = np.where(rate > 0, principal * growth - payment * (growth - 1) / rate,
+                               principal - payment * k)
+    else:
+        amortization = principal / terms
+        balance = principal - amortization * k
+
+    balance = np.where(in_term, np.maximum(balance, 0), 0)
+    previous = np.hstack([principal, balance[:, :-1]]) if periods else balance
+    interest = np.where(in_term, previous * rate, 0)
+    if method == "price":
+        amortization = np.where(in_term, np.broadcast_to(payment, balance.shape) - interest, 0)
+    else:
+        amortization = np.where(in_term, np.broadcast_to(amortization, balance.shape), 0)
+
+    return {
+        "payment": amortization + interest,
+        "interest": interest,
+        "amortization": amortization,
+        "balance": balance,
+    }
+
+
+def loan_summary(principal, annual_rate, years, payments_per_year: int = 12,
+                 method: str = "price") -> Dict[str, np.ndarray]:
+    """Totais de cada empréstimo sem montar o cronograma completo
+
+    Serviço da dívida do primeiro ano (base do DSCR), primeira/última
+    parcela e juros totais em fórmulas fechadas.
+    """
+    first_year = schedule(principal, annual_rate, years, payments_per_year, method, periods=payments_per_year)
+    principal, rate, terms = _loan_arrays(principal, annual_rate, years, payments_per_year)
+
+    if method == "price":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            payment = np.where(rate > 0, principal * rate / (1 - (1 + rate) ** -terms), principal / terms)
+        total_interest = payment * terms - principal
+        last_payment = payment
+    else:
+        amortization = principal / terms
+        # Juros sobre os saldos P, P - A, ..., A
+        total_interest = rate * (terms * principal - amortization * terms * (terms - 1) / 2)
+        last_payment = amortization * (1 + rate)
+
+    return {
+        "annual_debt_service": first_year["payment"].sum(axis=1),
+        "first_payment": first_year["payment"][:, 0],
+        "last_payment": last_payment,
+        "total_interest": total_interest,
+        "total_paid": principal + total_interest,
+        "payments": terms,
+    }
+
+
+def annual_debt_service(principal, annual_rate, years, horizon: int, payments_per_year: int = 12,
+                        method: str = "price") -> tuple:
+    """Serviço da dívida por ano (empréstimo × ano) e saldo ao fim do horizonte
+
+    Fórmulas fechadas por ano, sem as colunas mensais do schedule: usado
+    quando há muitos empréstimos × cenários.
+    """
+    if method not in AMORTIZATION_METHODS:
+        raise ValueError(f"Método de amortização inválido: {method} (use {', '.join(AMORTIZATION_METHODS)})")
+    principal, rate, terms = _loan_arrays(principal, annual_rate, years, payments_per_year)
+    principal, rate, terms = principal[:, None], rate[:, None], terms[:, None]
+    # Parcelas já pagas no início e no fim de cada ano (limitadas ao prazo)
+    end = np.minimum(np.arange(1, horizon + 1) * payments_per_year, terms)
+    start = np.minimum(np.arange(horizon) * payments_per_year, terms)
+    count = end - start
+
+    if method == "price":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            payment = np.where(rate > 0, principal * rate / (1 - (1 + rate) ** -terms), principal / terms)
+            growth = (1 + rate) ** end[:, -1:]
+            balance = np.where(rate > 0, principal * growth - payment * (growth - 1) / rate,
+                               principal - payment * end[:, -1:])
+        debt_service = payment * count
+    else:
+        amortization = principal / terms
+        # Juros das parcelas start+1..end: saldos P - A·j para j = start..end-1
+        paid_before = (start + end - 1) * count / 2
+        debt_service = amortization * count + rate * (principal * count - amortization * paid_before)
+        balance = principal - amortization * end[:, -1:]
+
+    return debt_service, np.maximum(balance[:, 0], 0)
+
+
+def yearly(values: np.ndarray, payments_per_year: int) -> np.ndarray:
+    """Soma parcelas por ano (colunas múltiplas de payments_per_year)"""
+    rows, periods = values.shape
+    return values.reshape(rows, periods // payments_per_year, payments_per_year).sum(axis=2)
+
+
+def dscr(annual_noi, annual_debt_service) -> np.ndarray:
+    """Índice de cobertura do serviço da dívida (NaN sem dívida)"""
+    debt_service = np.asarray(annual_debt_service, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(debt_service > 0, np.asarray(annual_noi, dtype=np.float64) / debt_service, np.nan)
+
+
+# ==================== PROJEÇÃO ====================
+
+def project(purchase_price, annual_noi, years: int, noi_growth=0.0, exit_cap_rate=None, selling_cost=0.0,
+            loan_amount=0.0, annual_rate=0.0, loan_years=30, payments_per_year: int = 12,
+            method: str = "price") -> Dict[str, Any]:
+    """Fluxos anuais de vários imóveis (colunas 0..years)
+
+    Parâmetros aceitam escalar ou um valor por imóvel. Sem exit_cap_rate,
+    o imóvel é vendido pelo cap rate de entrada (NOI / preço). Retorna as
+    matrizes de NOI, serviço da dívida, DSCR e fluxos desalavancado e
+    alavancado (período 0 = aquisição, último ano inclui a venda).
+    """
+    years = int(years)
+    if years < 1:
+        raise ValueError("Horizonte deve ser de pelo menos 1 ano")
+    price, noi, growth, selling_cost, loan = np.broadcast_arrays(*(
+        np.atleast_1d(np.asarray(value, dtype=np.float64))
+        for value in (purchase_price, annual_noi, noi_growth, selling_cost, loan_amount)
+    ))
+    if exit_cap_rate is None:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            exit_cap_rate = noi / price
+    exit_cap_rate = np.broadcast_to(np.asarray(exit_cap_rate, dtype=np.float64), price.shape)
+
+    noi_paths = noi[:, None] * (1 + growth[:, None]) ** np.arange(years)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sale_value = noi_paths[:, -1] * (1 + growth) / exit_cap_rate * (1 - selling_cost)
+
+    debt_service, balance = annual_debt_service(loan, annual_rate, loan_years, years, payments_per_year, method)
+
+    unlevered = np.zeros((len(price), years + 1))
+    unlevered[:, 0] = -price
+    unlevered[:, 1:] = noi_paths
+    unlevered[:, -1] += sale_value
+
+    levered = np.zeros_like(unlevered)
+    levered[:, 0] = loan - price
+    levered[:, 1:] = noi_paths - debt_service
+    levered[:, -1] += sale_value - balance
+
+    return {
+        "noi": noi_paths,
+        "debt_service": debt_service,
+        "dscr": dscr(noi_paths, debt_service),
+        "sale_value": sale_value,
+        "loan_balance": balance,
+        "unlevered": unlevered,
+        "levered": levered,
+    }
+
+
+# ==================== LOTE ====================
+
+def _percent(value) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value) * 100, 2)
+
+
+def _percentiles(values: np.ndarray, scale: float = 1, digits: int = 2) -> Dict[str, Optional[float]]:
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return {}
+    return {f"p{q}": round(float(np.percentile(values, q)) * scale, digits) for q in (10, 50, 90)}
+
+
+def evaluate_cash_flows(cash_flows: Sequence[Sequence[float]], discount_rate: float, periods_per_year: int = 1,
+                        ids: Optional[Sequence[Any]] = None, top: int = 10) -> Dict[str, Any]:
+    """TIR e VPL de muitos fluxos em uma chamada: distribuição e melhores/piores"""
+    flows = pad_cash_flows(cash_flows)
+    if ids is not None and len(ids) != len(flows):
+        raise ValueError("ids com tamanho diferente de cash_flows")
+    period_rate = (1 + discount_rate) ** (1 / periods_per_year) - 1
+    rates = annualize(irr(flows), periods_per_year)
+    values = npv(period_rate, flows)
+
+    solved = np.flatnonzero(~np.isnan(rates))
+    ranked = solved[np.argsort(-rates[solved], kind="stable")]
+    k = max(int(top), 0)
+
+    def rows(indexes):
+        return [{"id": ids[i] if ids is not None else int(i), "irr": _percent(rates[i]),
+                 "npv": round(float(values[i]), 2)} for i in indexes.tolist()]
+
+    return {
+        "count": len(flows),
+        "without_irr": len(flows) - len(solved),
+        "discount_rate": discount_rate,
+        "irr_percentiles": _percentiles(rates, 100),
+        "npv_total": round(float(values.sum()), 2),
+        "npv_percentiles": _percentiles(values),
+        "above_discount_rate": int(np.count_nonzero(rates[solved] > discount_rate)),
+        "negative_npv": int(np.count_nonzero(values < 0)),
+        "results": rows(np.arange(len(flows))) if len(flows) <= k else None,
+        "best": rows(ranked[:k]) if len(flows) > k else None,
+        "worst": rows(ranked[::-1][:k]) if len(flows) > k else None,
+    }
+
+
+def evaluate_loans(principal, annual_rate, years, annual_noi=None, method: str = "price",
+                   payments_per_year: int = 12, dscr_min: float = 1.2, ids: Optional[Sequence[Any]] = None,
+                   top: int = 10) -> Dict[str, Any]:
+    """Carteira de empréstimos: serviço da dívida, juros, DSCR e empréstimos abaixo do mínimo"""
+    summary = loan_summary(principal, annual_rate, years, payments_per_year, method)
+    principal, rate, terms = _loan_arrays(principal, annual_rate, years, payments_per_year)
+    size = len(principal)
+    if ids is not None and len(ids) != size:
+        raise ValueError("ids com tamanho diferente dos empréstimos")
+    noi = None if annual_noi is None else np.broadcast_to(np.asarray(annual_noi, dtype=np.float64), (size,))
+    coverage = None if noi is None else dscr(noi, summary["annual_debt_service"])
+
+    total = float(principal.sum())
+    result = {
+        "loans": size,
+        "method": method,
+        "total_principal": round(total, 2),
+        "weighted_rate": round(float((rate * principal).sum() / total * payments_per_year * 100), 4) if total else None,
+        "annual_debt_service": round(float(summary["annual_debt_service"].sum()), 2),
+        "total_interest": round(float(summary["total_interest"].sum()), 2),
+        "weighted_term_years": round(float((terms * principal).sum() / total / payments_per_year), 2) if total else None,
+    }
+    if coverage is not None:
+        below = np.flatnonzero(coverage < dscr_min)
+        worst = below[np.argsort(coverage[below], kind="stable")][:max(int(top), 0)]
+        result.update({
+            "portfolio_dscr": round(float(noi.sum() / summary["annual_debt_service"].sum()), 4)
+            if summary["annual_debt_service"].sum() else None,
+            "dscr_percentiles": _percentiles(coverage, digits=4),
+            "dscr_min": dscr_min,
+            "below_dscr_min": len(below),
+            "below_dscr_min_principal": round(float(principal[below].sum()), 2),
+            "worst_dscr": [{
+                "id": ids[i] if ids is not None else int(i),
+                "dscr": round(float(coverage[i]), 4),
+                "principal": round(float(principal[i]), 2),
+                "annual_debt_service": round(float(summary["annual_debt_service"][i]), 2),
+                "annual_noi": round(float(noi[i]), 2),
+            } for i in worst.tolist()],
+        })
+    if size == 1:
+        result["loan"] = {key: round(float(values[0]), 2) for key, values in summary.items()}
+    return result
+
+
+# ==================== RELATÓRIOS (UM ITEM) ====================
+
+def _round(value, digits: int = 2) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def project_property(purchase_price: float, annual_noi: float, years: int, discount_rate: float,
+                     dscr_min: float = 1.2, **options) -> Dict[str, Any]:
+    """Projeção anual de um imóvel com TIR/VPL desalavancados e alavancados
+
+    options são repassadas para project (crescimento, saída, financiamento).
+    """
+    projection = project(purchase_price, annual_noi, years, **options)
+    flows = np.vstack([projection["unlevered"], projection["levered"]])
+    rates = irr(flows)
+    values = npv(discount_rate, flows)
+    leveraged = bool(options.get("loan_amount"))
+    coverage = projection["dscr"][0]
+
+    return {
+        "years": [{
+            "year": year + 1,
+            "noi": _round(projection["noi"][0, year]),
+            "debt_service": _round(projection["debt_service"][0, year]),
+            "cash_flow": _round(projection["levered"][0, year + 1]),
+            "dscr": _round(coverage[year], 4),
+        } for year in range(int(years))],
+        "sale_value": _round(projection["sale_value"][0]),
+        "loan_balance_at_sale": _round(projection["loan_balance"][0]),
+        "unlevered": {"irr": _percent(rates[0]), "npv": _round(values[0])},
+        "levered": {"irr": _percent(rates[1]), "npv": _round(values[1])} if leveraged else None,
+        "dscr_lowest": _round(np.nanmin(coverage), 4) if leveraged else None,
+        "dscr_below_min_years": int(np.count_nonzero(coverage < dscr_min)),
+        "dscr_min": dscr_min,
+        "discount_rate": discount_rate,
+        "amortization": options.get("method", "price"),
+    }
+
+
+def loan_report(principal: float, annual_rate: float, years: float, payments_per_year: int = 12,
+                method: str = "price") -> Dict[str, Any]:
+    """Cronograma de um empréstimo consolidado por ano, com os totais"""
+    loan = schedule(principal, annual_rate, years, payments_per_year, method)
+    summary = loan_summary(principal, annual_rate, years, payments_per_year, method)
+    periods = loan["payment"].shape[1]
+    # Completa o último ano com zeros para consolidar as parcelas por ano
+    padding = -periods % payments_per_year
+    columns = {key: np.pad(values, ((0, 0), (0, padding))) for key, values in loan.items()}
+    by_year = {key: yearly(columns[key], payments_per_year)[0] for key in ("payment", "interest", "amortization")}
+    balances = columns["balance"][0, payments_per_year - 1::payments_per_year]
+    if padding:
+        balances[-1] = 0.0
+
+    return {
+        "amortization": method,
+        "payments": periods,
+        "first_payment": _round(summary["first_payment"][0]),
+        "last_payment": _round(summary["last_payment"][0]),
+        "total_interest": _round(summary["total_interest"][0]),
+        "total_paid": _round(summary["total_paid"][0]),
+        "years": [{
+            "year": year + 1,
+            "payments": _round(by_year["payment"][year]),
+            "interest": _round(by_year["interest"][year]),
+            "amortization": _round(by_year["amortization"][year]),
+            "balance": _round(balances[year]),
+        } for year in range(len(balances))],
+    }
+
+
+# ==================== CENÁRIOS ====================
+
+SCENARIO_AXES = ("interest_rate", "vacancy", "noi_growth", "cap_rate_shift")
+SCENARIO_COLUMNS = ("noi", "value", "debt_service", "dscr", "below_dscr_min", "cash_flow",
+                    "levered_irr_p50", "npv")
+SCENARIO_CHUNK_CELLS = 2_000_000    # imóveis × cenários × anos por bloco (limita memória)
+
+
+def scenario_grid(current_value, annual_noi, vacancy, debt, axes: Dict[str, Sequence[float]],
+                  base: Dict[str, float], years: int = 10, loan_years: float = 20, method: str = "price",
+                  discount_rate: float = 0.10, dscr_min: float = 1.2) -> Dict[str, Any]:
+    """Produto cartesiano das premissas avaliado sobre todos os imóveis
+
+    axes: valores de cada eixo de SCENARIO_AXES (fração); eixos ausentes
+    usam base. vacancy por imóvel é a vacância atual (fração, NaN = usa a
+    base) e o NOI potencial é o NOI atual / (1 - vacância atual). Cada
+    cenário projeta o fluxo alavancado de todos os imóveis (matriz
+    cenário·imóvel × ano) e resume a carteira em uma linha da tabela.
+    """
+    unknown = [name for name in axes if name not in SCENARIO_AXES]
+    if unknown:
+        raise ValueError(f"Eixos desconhecidos: {', '.join(unknown)} (use {', '.join(SCENARIO_AXES)})")
+    value, noi, current_vacancy, debt = np.broadcast_arrays(*(
+        np.atleast_1d(np.asarray(column, dtype=np.float64)) for column in (current_value, annual_noi, vacancy, debt)
+    ))
+    valid = (value > 0) & (noi > 0)
+    value, noi, debt = value[valid], noi[valid], np.nan_to_num(debt[valid])
+    current_vacancy = np.clip(np.where(np.isnan(current_vacancy[valid]), base["vacancy"], current_vacancy[valid]),
+                              0, 0.95)
+    potential = noi / (1 - current_vacancy)
+    entry_cap_rate = noi / value
+    size = len(value)
+
+    names = [name for name in SCENARIO_AXES if name in axes]
+    mesh = np.meshgrid(*(np.asarray(axes[name], dtype=np.float64) for name in names), indexing="ij")
+    scenarios = {name: grid.ravel() for name, grid in zip(names, mesh)}
+    count = len(next(iter(scenarios.values()))) if scenarios else 1
+    for name in SCENARIO_AXES:
+        if name not in scenarios:
+            scenarios[name] = np.full(count, float(base[name]))
+
+    table = np.full((count, len(SCENARIO_COLUMNS)), np.nan)
+    chunk = max(1, SCENARIO_CHUNK_CELLS // max(size * (years + 1), 1))
+    for first in range(0, count if size else 0, chunk):
+        rows = slice(first, min(first + chunk, count))
+        table[rows] = _evaluate_scenarios(
+            {name: values[rows] for name, values in scenarios.items()}, value, potential, entry_cap_rate,
+            current_vacancy if "vacancy" not in axes else None, debt, years, loan_years, method,
+            discount_rate, dscr_min)
+
+    npv_column = SCENARIO_COLUMNS.index("npv")
+    ordered = np.argsort(table[:, npv_column], kind="stable") if size else np.arange(0)
+    digits = {"dscr": 4, "levered_irr_p50": 4, "below_dscr_min": 0}
+    rows = [[round(float(scenarios[name][i]), 6) for name in names]
+            + [None if np.isnan(cell) else int(cell) if column == "below_dscr_min"
+               else round(float(cell), digits.get(column, 2))
+               for column, cell in zip(SCENARIO_COLUMNS, table[i])]
+            for i in range(count)]
+    fixed = {name: base[name] for name in SCENARIO_AXES if name not in axes}
+    if "vacancy" not in axes:
+        fixed["vacancy"] = "atual de cada imóvel"
+
+    return {
+        "properties": size,
+        "skipped": int(np.count_nonzero(~valid)),
+        "scenarios": count,
+        "axes": {name: [float(v) for v in axes[name]] for name in names},
+        "base": fixed,
+        "columns": names + list(SCENARIO_COLUMNS),
+        "rows": rows,
+        "worst": rows[ordered[0]] if len(ordered) else None,
+        "best": rows[ordered[-1]] if len(ordered) else None,
+        "years": years,
+        "loan_years": loan_years,
+        "amortization": method,
+        "discount_rate": discount_rate,
+        "dscr_min": dscr_min,
+    }
+
+
+def _evaluate_scenarios(scenarios: Dict[str, np.ndarray], value: np.ndarray, potential: np.ndarray,
+                        entry_cap_rate: np.ndarray, current_vacancy: Optional[np.ndarray], debt: np.ndarray,
+                        years: int, loan_years: float, method: str, discount_rate: float,
+                        dscr_min: float) -> np.ndarray:
+    """Métricas de carteira por cenário (linhas) para um bloco de cenários"""
+    count, size = len(scenarios["interest_rate"]), len(value)
+    column = {name: values[:, None] for name, values in scenarios.items()}
+
+    vacancy = current_vacancy[None, :] if current_vacancy is not None else np.clip(column["vacancy"], 0, 0.95)
+    noi = potential * (1 - vacancy)                                        # cenário × imóvel
+    noi = np.broadcast_to(noi, (count, size))
+    noi_paths = noi[:, :, None] * (1 + column["noi_growth"][:, :, None]) ** np.arange(years)
+    exit_cap_rate = np.maximum(entry_cap_rate + column["cap_rate_shift"], valuation_engine.CAP_RATE_FLOOR)
+    sale_value = noi_paths[:, :, -1] * (1 + column["noi_growth"]) / exit_cap_rate
+
+    loans = np.broadcast_to(debt, (count, size)).ravel()
+    rates = np.broadcast_to(column["interest_rate"], (count, size)).ravel()
+    debt_service, balance = annual_debt_service(loans, rates, loan_years, years, 12, method)
+    debt_service = debt_service.reshape(count, size, years)
+    balance = balance.reshape(count, size)
+
+    flows = np.empty((count, size, years + 1))
+    flows[:, :, 0] = debt - value
+    flows[:, :, 1:] = noi_paths - debt_service
+    flows[:, :, -1] += sale_value - balance
+    flows = flows.reshape(count * size, years + 1)
+    levered_irr = irr(flows).reshape(count, size)
+    levered_npv = npv(discount_rate, flows).reshape(count, size)
+
+    first_debt_service = debt_service[:, :, 0]
+    coverage = dscr(noi, first_debt_service)
+    total_debt_service = first_debt_service.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        portfolio_dscr = np.where(total_debt_service > 0, noi.sum(axis=1) / total_debt_service, np.nan)
+        irr_p50 = np.full(count, np.nan)
+        solved = ~np.isnan(levered_irr).all(axis=1)
+        irr_p50[solved] = np.nanmedian(levered_irr[solved], axis=1) * 100
+
+    return np.column_stack([
+        noi.sum(axis=1),
+        (noi / np.maximum(entry_cap_rate + column["cap_rate_shift"], valuation_engine.CAP_RATE_FLOOR)).sum(axis=1),
+        total_debt_service,
+        portfolio_dscr,
+        np.count_nonzero(coverage < dscr_min, axis=1),
+        (noi - first_debt_service).sum(axis=1),
+        irr_p50,
+        levered_npv.sum(axis=1),
+    ])
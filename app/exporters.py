@@ -0,0 +1,192 @@
+"""
+Exportação de resultados grandes para arquivo
+Desenvolvido por ness.
+
+Lê o cursor em lotes (fetchmany) e grava em Parquet (pyarrow, opcional) ou
+CSV. Só o lote atual fica em memória, então o consumo é constante mesmo para
+milhões de linhas. Usado pela ferramenta export_query dos servidores MCP.
+"""
+
+import os
+import re
+import csv
+import json
+import time
+import uuid
+import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # opcional: sem pyarrow a exportação sai em CSV
+    pa = None
+    pq = None
+
+EXPORT_FORMATS = ("parquet", "csv")
+
+# type_code do cursor.description: OID no psycopg2, tipo Python no pyodbc
+POSTGRES_TYPE_KINDS = {
+    16: "bool", 20: "int", 21: "int", 23: "int", 26: "int",
+    700: "float", 701: "float", 1700: "decimal", 17: "binary",
+    1082: "date", 1083: "time", 1114: "timestamp", 1184: "timestamptz",
+}
+PYTHON_TYPE_KINDS = {
+    bool: "bool", int: "int", float: "float", Decimal: "decimal",
+    bytes: "binary", bytearray: "binary", datetime.datetime: "timestamp",
+    datetime.date: "date", datetime.time: "time",
+}
+
+
+class CsvExportWriter:
+    """CSV UTF-8 com cabeçalho (abre no Excel via BOM)"""
+
+    extension = "csv"
+
+    def __init__(self, path: str, description: Sequence[Sequence[Any]]):
+        self._file = open(path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([desc[0] for desc in description])
+
+    def write_batch(self, rows: Sequence[Sequence[Any]]):
+        self._writer.writerows(
+            [value.hex() if isinstance(value, (bytes, bytearray)) else value for value in row]
+            for row in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+
+def _to_text(value: Any) -> Any:
+    """Valores sem tipo Arrow próprio (UUID, JSON, intervalos...) viram texto"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def arrow_field(desc: Sequence[Any]):
+    """Campo Arrow de uma coluna a partir do cursor.description
+
+    O tipo vem do banco (type_code, precision, scale), não dos valores do
+    primeiro lote: NUMERIC com escalas diferentes e colunas esparsas não
+    mudam de tipo no meio da exportação. Retorna (campo, conversor de valor).
+    """
+    name, type_code = desc[0], desc[1]
+    scale = desc[5] if len(desc) > 5 else None
+    kind = PYTHON_TYPE_KINDS.get(type_code) if isinstance(type_code, type) else POSTGRES_TYPE_KINDS.get(type_code)
+
+    if kind == "decimal":
+        # decimal128 largo na escala declarada; NUMERIC sem escala vira float64
+        if scale is not None and 0 <= scale <= 38:
+            return pa.field(name, pa.decimal128(38, scale)), None
+        return pa.field(name, pa.float64()), float
+    if kind == "float":
+        return pa.field(name, pa.float64()), float
+    if kind is not None:
+        return pa.field(name, {
+            "bool": pa.bool_(),
+            "int": pa.int64(),
+            "binary": pa.binary(),
+            "date": pa.date32(),
+            "time": pa.time64("us"),
+            "timestamp": pa.timestamp("us"),
+            "timestamptz": pa.timestamp("us", tz="UTC"),
+        }[kind]), None
+    return pa.field(name, pa.string()), _to_text
+
+
+class ParquetExportWriter:
+    """Parquet (zstd) com schema derivado do cursor.description"""
+
+    extension = "parquet"
+
+    def __init__(self, path: str, description: Sequence[Sequence[Any]]):
+        fields = [arrow_field(desc) for desc in description]
+        self._schema = pa.schema([field for field, _ in fields])
+        self._converters: List[Optional[Callable]] = [converter for _, converter in fields]
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def _column(self, values: Sequence[Any], field, converter: Optional[Callable]):
+        if converter is not None:
+            values = [None if value is None else converter(value) for value in values]
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Tipo do driver diferente do declarado (ex: float em coluna decimal)
+            return pa.array(values).cast(field.type, safe=False)
+
+    def write_batch(self, rows: Sequence[Sequence[Any]]):
+        values = list(zip(*rows)) if rows else [[] for _ in self._schema]
+        self._writer.write_table(pa.Table.from_arrays(
+            [self._column(column, field, converter)
+             for column, field, converter in zip(values, self._schema, self._converters)],
+            schema=self._schema
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def export_path(directory: str, prefix: str, extension: str) -> str:
+    """Caminho único em directory (prefixo sanitizado)"""
+    prefix = re.sub(r"[^A-Za-z0-9_-]+", "_", prefix or "export").strip("_")[:50] or "export"
+    name = f"{prefix}_{datetime.datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}.{extension}"
+    return os.path.abspath(os.path.join(directory, name))
+
+
+def export_cursor(cursor, export_format: str, directory: str, prefix: str = "export",
+                  batch_size: int = 10000, max_rows: int = 0) -> Dict[str, Any]:
+    """Grava o resultado do cursor já executado em arquivo e devolve as estatísticas"""
+    notes = []
+    if export_format == "parquet" and pa is None:
+        export_format = "csv"
+        notes.append("pyarrow não instalado: exportado em CSV")
+    writer_class = ParquetExportWriter if export_format == "parquet" else CsvExportWriter
+
+    start = time.perf_counter()
+    # Cursores nomeados (PostgreSQL) só expõem description após o primeiro fetch
+    batch = cursor.fetchmany(batch_size if not max_rows else min(batch_size, max_rows))
+    columns = [desc[0] for desc in cursor.description]
+
+    os.makedirs(directory, exist_ok=True)
+    path = export_path(directory, prefix, writer_class.extension)
+    writer = writer_class(path, cursor.description)
+
+    rows = batches = 0
+    try:
+        while batch:
+            writer.write_batch(batch)
+            rows += len(batch)
+            batches += 1
+            size = batch_size if not max_rows else min(batch_size, max_rows - rows)
+            if size <= 0:
+                break
+            batch = cursor.fetchmany(size)
+    except BaseException:
+        try:
+            writer.close()
+        finally:
+            os.remove(path)
+        raise
+    writer.close()
+
+    truncated = bool(max_rows) and rows >= max_rows and cursor.fetchone() is not None
+    if truncated:
+        notes.append(f"Exportação limitada a {max_rows} linhas")
+
+    return {
+        "path": path,
+        "file_name": os.path.basename(path),
+        "format": export_format,
+        "columns": columns,
+        "rows": rows,
+        "batches": batches,
+        "bytes": os.path.getsize(path),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        "truncated": truncated,
+        "notes": notes,
+    }
@@ -0,0 +1,159 @@
+"""
+Roteador de intenção local (evita a chamada do Coordinator ao modelo)
+Desenvolvido por ness.
+
+Combina regras de palavras-chave com um Naive Bayes multinomial treinado
+a partir das delegações registradas no log (DELEGATION) e atualizado a cada
+nova delegação do Coordinator. Só roteia quando a decisão é clara; casos
+ambíguos continuam indo para o Coordinator.
+"""
+
+import re
+import json
+import math
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+DATA_ANALYST = "data_analyst"
+FINANCIAL_EXPERT = "financial_expert"
+
+# Palavras-chave (sem acento) que indicam cada especialista
+KEYWORDS = {
+    DATA_ANALYST: {
+        "sql", "query", "tabela", "tabelas", "banco", "database", "schema", "consulta",
+        "consultar", "registros", "coluna", "colunas", "lista", "listar", "quantos",
+        "quantas", "postgres", "mssql", "select", "extrai", "extrair",
+    },
+    FINANCIAL_EXPERT: {
+        "roi", "cap", "rate", "retorno", "risco", "riscos", "investimento", "valuation",
+        "diversificacao", "cash", "rentabilidade", "yield", "payback", "avaliacao",
+        "estrategia", "noi", "tir", "vpl",
+    },
+}
+
+# Prefixos das mensagens DELEGATION gravadas por execute_coordinator_tool
+DELEGATION_LABELS = {
+    "Coordinator → Data Analyst:": DATA_ANALYST,
+    "Coordinator → Financial Expert:": FINANCIAL_EXPERT,
+}
+
+TEXT_LOG_RE = re.compile(r"^\[[^\]]*\] \[(?P<level>[^\]]*)\] \[[^\]]*\] (?P<message>.*)$")
+
+
+def tokenize(text: str) -> list:
+    """Minúsculas, sem acentos, palavras com 3+ caracteres"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return [word for word in re.findall(r"[a-z0-9]+", normalized) if len(word) >= 3]
+
+
+class IntentRouter:
+    """Decide o especialista para uma mensagem ou devolve None (Coordinator)"""
+
+    def __init__(self, threshold: float = 0.85, min_examples: int = 20):
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.word_counts: Dict[str, Counter] = {DATA_ANALYST: Counter(), FINANCIAL_EXPERT: Counter()}
+        self.word_totals: Dict[str, int] = {DATA_ANALYST: 0, FINANCIAL_EXPERT: 0}
+        self.doc_counts: Dict[str, int] = {DATA_ANALYST: 0, FINANCIAL_EXPERT: 0}
+        self.vocabulary: set = set()
+        self._lock = threading.Lock()
+
+    # ---------- treino ----------
+
+    def learn(self, text: str, label: str):
+        """Atualiza o classificador com um exemplo rotulado (incremental)"""
+        if label not in self.word_counts:
+            return
+        words = tokenize(text)
+        if not words:
+            return
+        with self._lock:
+            self.word_counts[label].update(words)
+            self.word_totals[label] += len(words)
+            self.doc_counts[label] += 1
+            self.vocabulary.update(words)
+
+    def train_from_log(self, path: str) -> int:
+        """Treina com as delegações do log (JSON lines ou formato texto)"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                return self.train(self._read_delegations(f))
+        except FileNotFoundError:
+            return 0
+
+    def train(self, examples: Iterable[Tuple[str, str]]) -> int:
+        count = 0
+        for text, label in examples:
+            self.learn(text, label)
+            count += 1
+        return count
+
+    @staticmethod
+    def _read_delegations(lines: Iterable[str]):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                level, message = event.get("level"), event.get("message", "")
+            else:
+                match = TEXT_LOG_RE.match(line)
+                if not match:
+                    continue
+                level, message = match.group("level"), match.group("message")
+
+            if level != "DELEGATION":
+                continue
+            for prefix, label in DELEGATION_LABELS.items():
+                if message.startswith(prefix):
+                    yield message[len(prefix):].strip(), label
+
+    # ---------- classificação ----------
+
+    @property
+    def trained(self) -> bool:
+        return sum(self.doc_counts.values()) >= self.min_examples and all(self.doc_counts.values())
+
+    def classify(self, text: str) -> Tuple[Optional[str], float]:
+        """Naive Bayes com suavização de Laplace: (rótulo, probabilidade)"""
+        words = tokenize(text)
+        if not words or not self.trained:
+            return None, 0.0
+
+        with self._lock:
+            total_docs = sum(self.doc_counts.values())
+            vocabulary_size = len(self.vocabulary) + 1
+            scores = {}
+            for label, counts in self.word_counts.items():
+                denominator = self.word_totals[label] + vocabulary_size
+                score = math.log(self.doc_counts[label] / total_docs)
+                for word in words:
+                    score += math.log((counts[word] + 1) / denominator)
+                scores[label] = score
+
+        best = max(scores, key=scores.get)
+        # Softmax dos log-scores
+        top = scores[best]
+        probability = 1 / sum(math.exp(score - top) for score in scores.values())
+        return best, probability
+
+    def route(self, text: str) -> Tuple[Optional[str], str]:
+        """Especialista + motivo, ou (None, motivo) quando ambíguo"""
+        words = set(tokenize(text))
+        hits = [label for label, keywords in KEYWORDS.items() if words & keywords]
+        label, probability = self.classify(text)
+
+        # Regra: palavras-chave de um único especialista, sem o classificador discordar com confiança
+        if len(hits) == 1 and (label in (None, hits[0]) or probability < self.threshold):
+            return hits[0], "keywords"
+        # Sem palavras-chave: decide o classificador, se confiante
+        if not hits and label and probability >= self.threshold:
+            return label, f"classifier:{probability:.2f}"
+        return None, "ambiguous"
@@ -0,0 +1,420 @@
+"""
+Motor de análise de carteira imobiliária
+Desenvolvido por ness.
+
+Carrega a tabela de imóveis uma vez em um DataFrame colunar (cache por
+sessão com TTL) e calcula ROI, cap rate, cash-on-cash, risco e
+diversificação para todos os imóveis e para agrupamentos arbitrários em
+operações vetorizadas (pandas/numpy), sem loops por imóvel. O valuation de
+Monte Carlo (valuation_engine) usa as mesmas colunas normalizadas.
+"""
+
+import time
+import threading
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import risk_engine
+import cashflow_engine
+import valuation_engine
+
+# Nome canônico → nomes aceitos na tabela de origem (comparação sem maiúsculas)
+COLUMN_ALIASES = {
+    "id": ["id", "property_id", "imovel_id", "codigo"],
+    "name": ["name", "nome", "descricao", "description", "title"],
+    "property_type": ["property_type", "type", "tipo", "tipo_imovel"],
+    "location": ["location", "city", "cidade", "localizacao", "region", "regiao"],
+    "status": ["status", "situacao"],
+    "purchase_price": ["purchase_price", "acquisition_price", "valor_compra", "preco_compra"],
+    "current_value": ["current_value", "market_value", "valor_atual", "valor_mercado"],
+    "annual_noi": ["annual_noi", "noi", "noi_anual"],
+    "rental_yield": ["rental_yield", "yield", "rentabilidade"],
+    "annual_cash_flow": ["annual_cash_flow", "cash_flow", "fluxo_caixa_anual"],
+    "debt": ["debt", "loan_balance", "outstanding_debt", "divida", "saldo_devedor"],
+    "debt_ratio": ["debt_ratio", "ltv", "alavancagem"],
+    "occupancy_rate": ["occupancy_rate", "occupancy", "taxa_ocupacao", "ocupacao"],
+    "purchase_date": ["purchase_date", "acquisition_date", "data_aquisicao", "data_compra"],
+}
+
+NUMERIC_COLUMNS = [
+    "purchase_price", "current_value", "annual_noi", "rental_yield", "annual_cash_flow",
+    "debt", "debt_ratio", "occupancy_rate",
+]
+CATEGORY_COLUMNS = ["property_type", "location", "status"]
+# Mediana acima disto: coluna debt_ratio de origem está em percentual (LTV típico < 1 em fração)
+DEBT_RATIO_PERCENT_MEDIAN = 1.5
+# Máximo até isto: coluna occupancy_rate de origem está em fração (0.95), não em % (95)
+OCCUPANCY_FRACTION_MAX = 1.0
+
+
+@dataclass(frozen=True)
+class Thresholds:
+    """Limites de interpretação (espelho dos thresholds do Config do app)"""
+
+    roi_excellent: float = 12
+    roi_good: float = 8
+    cap_rate_excellent: float = 8
+    cap_rate_good: float = 5
+    risk_high: int = 50
+    risk_medium: int = 25
+
+
+# ==================== CARGA ====================
+
+def normalize_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """Renomeia colunas para os nomes canônicos e converte tipos
+
+    Colunas desconhecidas são mantidas (podem ser usadas em group_by).
+    Valores monetários viram float64; tipo, localização e status viram
+    category (groupby e contagens vetorizados).
+    """
+    lookup = {column.lower(): column for column in frame.columns}
+    renames = {}
+    for canonical, aliases in COLUMN_ALIASES.items():
+        source = next((lookup[alias] for alias in aliases if alias in lookup), None)
+        if source is not None and source not in renames:
+            renames[source] = canonical
+    frame = frame.rename(columns=renames)
+
+    for column in NUMERIC_COLUMNS:
+        if column in frame:
+            frame[column] = pd.to_numeric(frame[column], errors="coerce").astype("float64")
+    for column in CATEGORY_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].fillna("Não informado").astype(str).str.strip().astype("category")
+    if "purchase_date" in frame:
+        frame["purchase_date"] = pd.to_datetime(frame["purchase_date"], errors="coerce")
+
+    return frame.reset_index(drop=True)
+
+
+def from_records(rows: Sequence[Dict[str, Any]]) -> pd.DataFrame:
+    """DataFrame a partir de linhas já serializadas (ex: execute_query do MCP)"""
+    return normalize_frame(pd.DataFrame.from_records(list(rows)))
+
+
+def read_sql(connection, query: str, max_rows: int = 0) -> pd.DataFrame:
+    """Executa a query na conexão DB-API e carrega o resultado de uma vez"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchmany(max_rows) if max_rows else cursor.fetchall()
+    finally:
+        cursor.close()
+    return normalize_frame(pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns))
+
+
+class PortfolioCache:
+    """Frames carregados por sessão, válidos por `ttl` segundos"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, source: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        loaded_at, entry_source, frame = entry
+        if entry_source != source or time.monotonic() - loaded_at > self.ttl:
+            self.invalidate(session_id)
+            return None
+        return frame
+
+    def set(self, session_id: str, source: str, frame: pd.DataFrame):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic(), source, frame)
+
+    def age(self, session_id: str) -> Optional[float]:
+        entry = self._entries.get(session_id)
+        return time.monotonic() - entry[0] if entry else None
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+# ==================== MÉTRICAS POR IMÓVEL ====================
+
+def _column(frame: pd.DataFrame, name: str) -> pd.Series:
+    """Coluna numérica ou NaN quando a origem não tem o dado"""
+    if name in frame:
+        return frame[name]
+    return pd.Series(np.nan, index=frame.index, dtype="float64")
+
+
+def _rate(numerator: pd.Series, denominator: pd.Series) -> pd.Series:
+    """numerator / denominator * 100, NaN onde o denominador é 0 ou ausente"""
+    return numerator.div(denominator.where(denominator != 0)) * 100
+
+
+def _rating(values: pd.Series, excellent: float, good: float, low_label: str) -> pd.Categorical:
+    labels = np.select([values > excellent, values > good], ["Excelente", "Bom"], default=low_label)
+    return pd.Categorical(np.where(values.isna(), "Sem dados", labels),
+                          categories=["Excelente", "Bom", low_label, "Sem dados"])
+
+
+def compute_metrics(frame: pd.DataFrame, thresholds: Thresholds,
+                    now: Optional[datetime] = None) -> tuple[pd.DataFrame, List[str]]:
+    """Adiciona as métricas por imóvel; retorna (frame, premissas usadas)
+
+    Dados ausentes são derivados quando possível (e a premissa é
+    registrada): NOI a partir do rental_yield, alavancagem a partir do saldo
+    devedor, cash-on-cash sobre o NOI quando não há fluxo de caixa.
+    """
+    frame = frame.copy()
+    assumptions = []
+
+    purchase = _column(frame, "purchase_price")
+    current = _column(frame, "current_value")
+    if current.isna().all() and not purchase.isna().all():
+        current = purchase
+        assumptions.append("current_value ausente: usado purchase_price")
+    frame["current_value"] = current
+
+    noi = _column(frame, "annual_noi")
+    if noi.isna().all() and "rental_yield" in frame:
+        noi = frame["rental_yield"] / 100 * current
+        assumptions.append("annual_noi estimado como rental_yield × current_value")
+    frame["annual_noi"] = noi
+
+    debt_ratio = _column(frame, "debt_ratio")
+    if debt_ratio.isna().all() and "debt" in frame:
+        # Razão derivada já é fração: acima de 1 = dívida maior que o valor (nunca reescalar)
+        debt_ratio = frame["debt"].div(current.where(current != 0))
+        assumptions.append("debt_ratio calculado como debt / current_value")
+    elif debt_ratio.median() > DEBT_RATIO_PERCENT_MEDIAN:
+        # Coluna de origem em percentual (ex: 65): decidido uma vez para a coluna inteira
+        debt_ratio = debt_ratio / 100
+        assumptions.append("debt_ratio de origem em percentual: convertido para fração")
+    frame["debt_ratio"] = debt_ratio
+
+    # Risco, valuation e cenários usam ocupação em % (0-100)
+    if "occupancy_rate" in frame and frame["occupancy_rate"].max() <= OCCUPANCY_FRACTION_MAX:
+        # Coluna de origem em fração (ex: 0.95): decidido uma vez para a coluna inteira
+        frame["occupancy_rate"] = frame["occupancy_rate"] * 100
+        assumptions.append("occupancy_rate de origem em fração: convertido para percentual")
+
+    cash_flow = _column(frame, "annual_cash_flow")
+    if cash_flow.isna().all():
+        cash_flow = noi
+        assumptions.append("annual_cash_flow ausente: cash-on-cash calculado sobre o NOI")
+    cash_invested = purchase * (1 - debt_ratio.fillna(0))
+
+    if "purchase_date" in frame:
+        reference = pd.Timestamp(now or datetime.now())
+        months = (reference - frame["purchase_date"]).dt.days / 30.4375
+        holding_months = months.where(months >= 1)
+    else:
+        holding_months = pd.Series(np.nan, index=frame.index)
+    if holding_months.isna().any():
+        assumptions.append("período de posse desconhecido: ROI anualizado sobre 12 meses")
+    holding_months = holding_months.fillna(12)
+
+    frame["roi"] = _rate(current - purchase, purchase)
+    frame["annual_roi"] = frame["roi"] / holding_months * 12
+    frame["cap_rate"] = _rate(noi, current)
+    frame["cash_on_cash"] = _rate(cash_flow, cash_invested)
+    missing_risk = [column for column in ("occupancy_rate", "property_type") if column not in frame]
+    if missing_risk:
+        assumptions.append(f"risco sem os fatores {', '.join(missing_risk)} (não pontuados)")
+    frame["risk_score"] = risk_scores(frame)
+    frame["risk_level"] = risk_levels(frame["risk_score"], thresholds)
+    frame["roi_rating"] = _rating(frame["annual_roi"], thresholds.roi_excellent, thresholds.roi_good, "Regular")
+    frame["cap_rate_rating"] = _rating(frame["cap_rate"], thresholds.cap_rate_excellent,
+                                       thresholds.cap_rate_good, "Baixo")
+    return frame, assumptions
+
+
+def _risk_columns(frame: pd.DataFrame) -> Dict[str, Any]:
+    return {
+        "occupancy_rate": frame["occupancy_rate"].to_numpy() if "occupancy_rate" in frame else None,
+        "debt_ratio": frame["debt_ratio"].to_numpy() if "debt_ratio" in frame else None,
+        "property_type": frame["property_type"].to_numpy() if "property_type" in frame else None,
+    }
+
+
+def risk_scores(frame: pd.DataFrame) -> pd.Series:
+    """Score de risco por imóvel (mesmas regras do risk_assessment)"""
+    return pd.Series(risk_engine.score_batch(**_risk_columns(frame), size=len(frame)), index=frame.index)
+
+
+def risk_levels(scores: pd.Series, thresholds: Thresholds) -> pd.Categorical:
+    labels = risk_engine.level_batch(scores.to_numpy(), thresholds.risk_high, thresholds.risk_medium)
+    return pd.Categorical(labels, categories=list(risk_engine.LEVELS))
+
+
+def assess_risk(frame: pd.DataFrame, thresholds: Thresholds, top: int = 10,
+                status: Optional[str] = None) -> Dict[str, Any]:
+    """Risco da carteira carregada: distribuições e imóveis de maior risco"""
+    if status is not None and "status" in frame:
+        frame = frame[frame["status"].astype(str).str.lower() == status.lower()]
+    frame, assumptions = compute_metrics(frame, thresholds)
+    ids = (frame["id"] if "id" in frame else frame.index.to_series()).tolist()
+    assessment = risk_engine.assess_batch(**_risk_columns(frame), high=thresholds.risk_high,
+                                          medium=thresholds.risk_medium, ids=ids, top=top)
+    return {**assessment, "assumptions": [text for text in assumptions
+                                          if "risco" in text or text.startswith(("debt", "occupancy_rate"))]}
+
+
+def valuation(frame: pd.DataFrame, thresholds: Thresholds, top: int = 10, status: Optional[str] = None,
+              **options) -> Dict[str, Any]:
+    """Valuation de Monte Carlo dos imóveis do frame (opções de valuation_engine.simulate)"""
+    if status is not None and "status" in frame:
+        frame = frame[frame["status"].astype(str).str.lower() == status.lower()]
+    frame, assumptions = compute_metrics(frame, thresholds)
+    debt = frame["debt"] if "debt" in frame else frame["debt_ratio"] * frame["current_value"]
+    ids = (frame["id"] if "id" in frame else frame.index.to_series()).tolist()
+
+    result = valuation_engine.simulate(
+        frame["current_value"].to_numpy(), frame["annual_noi"].to_numpy(),
+        occupancy_rate=_column(frame, "occupancy_rate").to_numpy(), debt=debt.fillna(0).to_numpy(),
+        ids=ids, top=top, **options
+    )
+    used = [text for text in assumptions
+            if text.startswith(("current_value", "annual_noi", "debt_ratio", "occupancy_rate"))]
+    if "occupancy_rate" not in frame:
+        used.append(f"ocupação ausente: vacância de {valuation_engine.DEFAULT_VACANCY:.0%}")
+    return {**result, "assumptions": used}
+
+
+def scenario_grid(frame: pd.DataFrame, thresholds: Thresholds, axes: Dict[str, Sequence[float]],
+                  base: Dict[str, float], status: Optional[str] = None, **options) -> Dict[str, Any]:
+    """Tabela de sensibilidade da carteira (opções de cashflow_engine.scenario_grid)"""
+    if status is not None and "status" in frame:
+        frame = frame[frame["status"].astype(str).str.lower() == status.lower()]
+    frame, assumptions = compute_metrics(frame, thresholds)
+    debt = frame["debt"] if "debt" in frame else frame["debt_ratio"] * frame["current_value"]
+
+    result = cashflow_engine.scenario_grid(
+        frame["current_value"].to_numpy(), frame["annual_noi"].to_numpy(),
+        1 - _column(frame, "occupancy_rate").to_numpy() / 100, debt.fillna(0).to_numpy(),
+        axes, base, **options
+    )
+    used = [text for text in assumptions
+            if text.startswith(("current_value", "annual_noi", "debt_ratio", "occupancy_rate"))]
+    if "occupancy_rate" not in frame:
+        used.append(f"ocupação ausente: vacância base de {base['vacancy']:.0%}")
+    return {**result, "assumptions": used}
+
+
+# ==================== AGREGAÇÕES ====================
+
+def summarize(frame: pd.DataFrame, group_by: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Totais e métricas ponderadas da carteira ou de cada grupo
+
+    Cap rate, ROI e cash-on-cash agregados são ponderados por valor (razão
+    das somas), não médias simples das razões.
+    """
+    columns = {
+        "properties": ("current_value", "size"),
+        "total_invested": ("purchase_price", "sum"),
+        "current_value": ("current_value", "sum"),
+        "annual_noi": ("annual_noi", "sum"),
+        "noi_count": ("annual_noi", "count"),
+        "avg_risk_score": ("risk_score", "mean"),
+        "high_risk": ("is_high_risk", "sum"),
+    }
+    data = frame.assign(
+        purchase_price=_column(frame, "purchase_price"),
+        is_high_risk=(frame["risk_level"] == "Alto").astype(np.int64),
+    )
+    if group_by:
+        grouped = data.groupby(group_by, observed=True, sort=False).agg(**columns).reset_index()
+    else:
+        grouped = pd.DataFrame([{name: data[source].agg(how) for name, (source, how) in columns.items()}])
+
+    # Soma de NaN é 0: grupo sem nenhum NOI fica sem cap rate
+    grouped["annual_noi"] = grouped["annual_noi"].where(grouped.pop("noi_count") > 0)
+    grouped["roi"] = _rate(grouped["current_value"] - grouped["total_invested"], grouped["total_invested"])
+    grouped["cap_rate"] = _rate(grouped["annual_noi"], grouped["current_value"])
+    total_value = grouped["current_value"].sum()
+    grouped["value_share"] = grouped["current_value"] / total_value * 100 if total_value else np.nan
+    grouped = grouped.sort_values("current_value", ascending=False)
+    return _records(grouped)
+
+
+def diversification(frame: pd.DataFrame) -> Dict[str, Any]:
+    """Concentração por tipo e localização (HHI sobre a participação em valor)"""
+    result: Dict[str, Any] = {}
+    total_value = frame["current_value"].sum()
+    counts = {}
+    for column in ("property_type", "location"):
+        if column not in frame:
+            continue
+        values = frame.groupby(column, observed=True)["current_value"].sum()
+        shares = values / total_value if total_value else values * np.nan
+        hhi = float((shares ** 2).sum()) if total_value else None
+        counts[column] = len(values)
+        result[f"by_{column}"] = {
+            str(key): {"properties": int(count), "value_share": round(float(share) * 100, 2)}
+            for key, count, share in zip(values.index, frame[column].value_counts().reindex(values.index), shares)
+        }
+        result[f"hhi_{column}"] = round(hhi, 4) if hhi is not None else None
+        result[f"effective_{column}_count"] = round(1 / hhi, 2) if hhi else None
+
+    types, locations = counts.get("property_type", 0), counts.get("location", 0)
+    result["diversification_score"] = types * 10 + locations * 5
+    result["recommendation"] = "Bem diversificada" if types >= 3 and locations >= 3 else "Considerar diversificar"
+    return result
+
+
+def distribution(values: pd.Series) -> Dict[str, int]:
+    return {str(key): int(count) for key, count in values.value_counts(sort=False).items()}
+
+
+def analyze(frame: pd.DataFrame, thresholds: Thresholds, group_by: Optional[List[str]] = None,
+            top: int = 10, status: Optional[str] = None) -> Dict[str, Any]:
+    """Análise completa da carteira em uma chamada"""
+    if status is not None and "status" in frame:
+        frame = frame[frame["status"].astype(str).str.lower() == status.lower()]
+
+    unknown = [column for column in group_by or [] if column not in frame]
+    if unknown:
+        raise ValueError(f"Colunas de agrupamento não encontradas: {', '.join(unknown)} "
+                         f"(disponíveis: {', '.join(map(str, frame.columns))})")
+
+    frame, assumptions = compute_metrics(frame, thresholds)
+    ranked = frame.dropna(subset=["annual_roi"]).sort_values("annual_roi", ascending=False)
+    detail = [column for column in ("id", "name", "property_type", "location", "current_value",
+                                    "annual_roi", "cap_rate", "cash_on_cash", "risk_score", "risk_level")
+              if column in frame]
+
+    return {
+        "properties": len(frame),
+        "portfolio": summarize(frame)[0] if len(frame) else {},
+        "groups": summarize(frame, group_by) if group_by else None,
+        "distributions": {
+            "roi_rating": distribution(frame["roi_rating"]),
+            "cap_rate_rating": distribution(frame["cap_rate_rating"]),
+            "risk_level": distribution(frame["risk_level"]),
+        },
+        "percentiles": {
+            column: {f"p{q}": round(float(frame[column].quantile(q / 100)), 2) for q in (10, 50, 90)}
+            for column in ("annual_roi", "cap_rate", "cash_on_cash") if frame[column].notna().any()
+        },
+        "top_properties": _records(ranked.head(top)[detail]),
+        "bottom_properties": _records(ranked.tail(top).iloc[::-1][detail]),
+        "diversification": diversification(frame),
+        "assumptions": assumptions,
+        "missing_columns": [column for column in NUMERIC_COLUMNS if column not in frame],
+    }
+
+
+def _records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Linhas como dicts compactos (floats arredondados, NaN → None)"""
+    frame = frame.copy()
+    for column in frame.columns:
+        if pd.api.types.is_float_dtype(frame[column]):
+            frame[column] = frame[column].round(2)
+        elif isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype(str)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient="records")
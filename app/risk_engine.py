@@ -0,0 +1,179 @@
+"""
+Motor de risco de imóveis (unitário e em lote)
+Desenvolvido por ness.
+
+Regras únicas de pontuação usadas pelo risk_assessment (um imóvel, Python
+puro) e pelo cálculo em lote (numpy, máscaras vetorizadas sobre colunas
+de ocupação, alavancagem e tipo). Os níveis seguem os thresholds
+RISK_HIGH / RISK_MEDIUM do Config, recebidos como parâmetro.
+"""
+
+from typing import Any, Dict, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # opcional: só o cálculo em lote precisa de numpy
+    np = None
+
+# Fatores de risco: (limite, pontos)
+OCCUPANCY_MIN = 80          # ocupação (%) abaixo do limite
+OCCUPANCY_POINTS = 30
+DEBT_RATIO_MAX = 0.7        # alavancagem acima do limite
+DEBT_POINTS = 25
+COMMERCIAL_TYPES = ("comercial", "retail", "commercial")
+COMMERCIAL_POINTS = 15
+
+LEVELS = ("Alto", "Médio", "Baixo")
+RECOMMENDATIONS = {
+    "Alto": "Considerar venda ou reestruturação",
+    "Médio": "Monitorar de perto e avaliar melhorias",
+    "Baixo": "Manter",
+}
+
+
+def risk_level(score: float, high: float, medium: float) -> str:
+    if score > high:
+        return "Alto"
+    if score > medium:
+        return "Médio"
+    return "Baixo"
+
+
+def score_property(property_type: str, occupancy_rate: float, debt_ratio: float = 0) -> tuple[int, Dict[str, str]]:
+    """Score e fatores de um imóvel"""
+    score = 0
+    factors = {}
+
+    if occupancy_rate < OCCUPANCY_MIN:
+        score += OCCUPANCY_POINTS
+        factors["occupancy"] = f"Risco - Taxa abaixo de {OCCUPANCY_MIN}%"
+    else:
+        factors["occupancy"] = "OK"
+
+    if debt_ratio > DEBT_RATIO_MAX:
+        score += DEBT_POINTS
+        factors["debt"] = f"Alto - Alavancagem acima de {DEBT_RATIO_MAX:.0%}"
+    else:
+        factors["debt"] = "OK"
+
+    if property_type.lower() in COMMERCIAL_TYPES:
+        score += COMMERCIAL_POINTS
+        factors["type"] = "Risco elevado - Setor comercial"
+    else:
+        factors["type"] = "OK"
+
+    return score, factors
+
+
+# ==================== LOTE (NUMPY) ====================
+
+def factor_masks(occupancy_rate=None, debt_ratio=None, property_type=None, size: int = None) -> Dict[str, Any]:
+    """Máscaras booleanas de cada fator (colunas ausentes não pontuam)
+
+    NaN em ocupação ou alavancagem não dispara o fator (comparação falsa).
+    """
+    sizes = {len(column) for column in (occupancy_rate, debt_ratio, property_type) if column is not None}
+    if len(sizes) > 1:
+        raise ValueError("Colunas de ocupação, alavancagem e tipo com tamanhos diferentes")
+    if size is None:
+        if not sizes:
+            raise ValueError("Informe ao menos uma coluna (ocupação, alavancagem ou tipo)")
+        size = sizes.pop()
+    masks = {}
+
+    if occupancy_rate is not None:
+        masks["occupancy"] = np.asarray(occupancy_rate, dtype=np.float64) < OCCUPANCY_MIN
+    else:
+        masks["occupancy"] = np.zeros(size, dtype=bool)
+
+    if debt_ratio is not None:
+        masks["debt"] = np.asarray(debt_ratio, dtype=np.float64) > DEBT_RATIO_MAX
+    else:
+        masks["debt"] = np.zeros(size, dtype=bool)
+
+    if property_type is not None:
+        # Normaliza só os tipos distintos; a expansão é um lookup em set por item
+        commercial = {value for value in set(property_type)
+                      if str(value).strip().lower() in COMMERCIAL_TYPES}
+        masks["type"] = np.fromiter(map(commercial.__contains__, property_type), dtype=bool, count=size)
+    else:
+        masks["type"] = np.zeros(size, dtype=bool)
+
+    return masks
+
+
+def _scores(masks: Dict[str, Any]):
+    return (masks["occupancy"] * OCCUPANCY_POINTS
+            + masks["debt"] * DEBT_POINTS
+            + masks["type"] * COMMERCIAL_POINTS).astype(np.int64)
+
+
+def score_batch(occupancy_rate=None, debt_ratio=None, property_type=None, size: int = None):
+    """Scores de risco (int64) para colunas inteiras"""
+    return _scores(factor_masks(occupancy_rate, debt_ratio, property_type, size))
+
+
+def level_batch(scores, high: float, medium: float):
+    """Nível de risco por score (array de strings)"""
+    return np.select([scores > high, scores > medium], ["Alto", "Médio"], default="Baixo")
+
+
+def assess_batch(occupancy_rate=None, debt_ratio=None, property_type=None, high: float = 50,
+                 medium: float = 25, ids: Optional[Sequence[Any]] = None, top: int = 10) -> Dict[str, Any]:
+    """Risco de uma carteira inteira: distribuições, fatores e imóveis de maior risco"""
+    masks = factor_masks(occupancy_rate, debt_ratio, property_type)
+    scores = _scores(masks)
+    size = len(scores)
+    if not size:
+        return {"properties": 0}
+    if ids is not None and len(ids) != size:
+        raise ValueError("ids com tamanho diferente das colunas")
+    values, counts = np.unique(scores, return_counts=True)
+    high_count = int(np.count_nonzero(scores > high))
+    medium_count = int(np.count_nonzero(scores > medium)) - high_count
+    level_counts = {"Alto": high_count, "Médio": medium_count, "Baixo": size - high_count - medium_count}
+
+    # Top-k sem ordenar tudo: argpartition e ordenação só dos k escolhidos
+    k = min(max(int(top), 0), size)
+    if k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+    else:
+        candidates = np.array([], dtype=np.int64)
+
+    columns = {
+        "occupancy_rate": None if occupancy_rate is None else np.asarray(occupancy_rate, dtype=np.float64),
+        "debt_ratio": None if debt_ratio is None else np.asarray(debt_ratio, dtype=np.float64),
+        "property_type": None if property_type is None else np.asarray(property_type, dtype=object),
+    }
+    top_risk = []
+    for index in candidates.tolist():
+        entry = {"id": ids[index] if ids is not None else index, "risk_score": int(scores[index]),
+                 "risk_level": risk_level(scores[index], high, medium)}
+        for name, column in columns.items():
+            if column is None:
+                continue
+            value = column[index]
+            if name != "property_type":
+                value = None if np.isnan(value) else round(float(value), 4)
+            entry[name] = value
+        entry["factors"] = [name for name, mask in masks.items() if mask[index]]
+        top_risk.append(entry)
+
+    return {
+        "properties": size,
+        "mean_score": round(float(scores.mean()), 2),
+        "percentiles": {f"p{q}": float(np.percentile(scores, q)) for q in (50, 90, 99)},
+        "score_distribution": {str(int(value)): int(count) for value, count in zip(values, counts)},
+        "levels": level_counts,
+        "level_shares": {level: round(count / size * 100, 2) for level, count in level_counts.items()},
+        "factors": {name: int(np.count_nonzero(mask)) for name, mask in masks.items()},
+        "top_risk": top_risk,
+        "recommendations": {level: RECOMMENDATIONS[level] for level in LEVELS if level_counts[level]},
+        "rules": {
+            "occupancy": f"< {OCCUPANCY_MIN}% → +{OCCUPANCY_POINTS}",
+            "debt": f"> {DEBT_RATIO_MAX} → +{DEBT_POINTS}",
+            "type": f"{'/'.join(COMMERCIAL_TYPES)} → +{COMMERCIAL_POINTS}",
+            "levels": f"Alto > {high}, Médio > {medium}",
+        },
+    }
@@ -0,0 +1,82 @@
+"""
+Serialização JSON dos resultados de tools
+Desenvolvido por ness.
+
+Caminho rápido com orjson (quando instalado) e fallback na stdlib, com
+handlers por tipo para os valores que os drivers devolvem (Decimal,
+datetime, UUID, bytes...). Saída compacta e UTF-8: menos bytes e menos
+tokens no histórico dos agentes.
+"""
+
+import json
+import base64
+import datetime
+from decimal import Decimal
+from uuid import UUID
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # opcional: stdlib como fallback
+    orjson = None
+
+
+def _encode_decimal(value: Decimal):
+    # Inteiros exatos continuam inteiros (ex: COUNT/SUM em NUMERIC); os demais
+    # viram string exata, pois float perde precisão em NUMERIC monetário (0.10)
+    if value.is_finite() and value == value.to_integral_value() and abs(value) < 2 ** 63:
+        return int(value)
+    return str(value)
+
+
+def _encode_bytes(value) -> str:
+    return base64.b64encode(bytes(value)).decode("ascii")
+
+
+TYPE_HANDLERS = {
+    Decimal: _encode_decimal,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_bytes,
+    set: list,
+    frozenset: list,
+    datetime.timedelta: lambda value: value.total_seconds(),
+    # Usados só pelo fallback (orjson serializa nativamente)
+    datetime.datetime: lambda value: value.isoformat(),
+    datetime.date: lambda value: value.isoformat(),
+    datetime.time: lambda value: value.isoformat(),
+    UUID: str,
+}
+
+
+def _default(value: Any):
+    handler = TYPE_HANDLERS.get(type(value))
+    if handler is not None:
+        return handler(value)
+    for value_type, handler in TYPE_HANDLERS.items():
+        if isinstance(value, value_type):
+            return handler(value)
+    if hasattr(value, "tolist"):  # numpy/pandas
+        return value.tolist()
+    raise TypeError(f"Tipo não serializável em JSON: {type(value).__name__}")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serializa para JSON (compacto por padrão)"""
+        option = _OPTIONS | orjson.OPT_INDENT_2 if pretty else _OPTIONS
+        return orjson.dumps(obj, default=_default, option=option).decode("utf-8")
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any, pretty: bool = False) -> str:
+        """Serializa para JSON (compacto por padrão)"""
+        if pretty:
+            return json.dumps(obj, default=_default, ensure_ascii=False, indent=2)
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
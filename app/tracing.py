@@ -0,0 +1,206 @@
+"""
+Tracing de latência (spans no estilo OpenTelemetry)
+Desenvolvido por ness.
+
+Spans aninhados via contextvars, exportados como linhas JSON em arquivo
+(TRACE_FILE) ou mantidos em memória (testes/benchmarks). Os servidores MCP
+usam o mesmo módulo e recebem o contexto do trace no `_meta` da request
+(chave "trace"), de forma que um único trace mostra o turno inteiro do chat.
+"""
+
+import os
+import json
+import time
+import asyncio
+import secrets
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+
+class Span:
+    """Intervalo de tempo nomeado com atributos"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float = 1):
+        """Incrementa um atributo numérico (ex: tokens, cache_hits)"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+            "pid": os.getpid(),
+        }
+
+
+class _NoopSpan:
+    """Span usado com tracing desativado (custo zero nos hot paths)"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add(self, key: str, amount: float = 1):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# ==================== EXPORTERS ====================
+
+class FileSpanExporter:
+    """Grava spans finalizados como linhas JSON (append, seguro entre processos)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+            except Exception as e:
+                print(f"Erro ao gravar trace: {e}")
+
+
+class InMemorySpanExporter:
+    """Mantém spans em memória (testes e benchmarks)"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def by_name(self, name: str) -> List[Span]:
+        return [s for s in self.spans if s.name == name]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+_exporter = None
+if os.getenv("TRACING_ENABLED", "false").lower() == "true":
+    _exporter = FileSpanExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def set_exporter(exporter):
+    """Troca o exporter (None desativa o tracing)"""
+    global _exporter
+    _exporter = exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+# ==================== API ====================
+
+@contextmanager
+def span(name: str, parent: Optional[Dict[str, str]] = None, **attributes):
+    """Abre um span filho do span atual (ou do contexto remoto em `parent`)"""
+    if _exporter is None:
+        yield NOOP_SPAN
+        return
+
+    current = _current_span.get()
+    if parent and parent.get("trace_id"):
+        trace_id, parent_id = parent["trace_id"], parent.get("span_id")
+    elif current is not None:
+        trace_id, parent_id = current.trace_id, current.span_id
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+
+    new_span = Span(name, trace_id, parent_id, attributes)
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        new_span.end_ns = time.time_ns()
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(new_span)
+
+
+def traced(name: str, **attributes):
+    """Decorator: executa a função (sync ou async) dentro de um span"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    """Span ativo no contexto (ou no-op)"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def inject() -> Optional[Dict[str, str]]:
+    """Contexto do span atual para propagar a outro processo (servidor MCP)"""
+    current = _current_span.get()
+    if current is None:
+        return None
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
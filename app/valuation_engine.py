@@ -0,0 +1,238 @@
+"""
+Motor de valuation por simulação de Monte Carlo
+Desenvolvido por ness.
+
+Simula milhares de trajetórias por imóvel (numpy, matrizes trajetória ×
+ano) para crescimento de aluguel, vacância, deriva do cap rate de saída e
+custo do financiamento, e devolve o valor presente em percentis. Choques de
+mercado são comuns a todos os imóveis (carteira correlacionada); choques
+próprios vêm de uma semente filha por imóvel (SeedSequence.spawn), então o
+resultado depende só da semente, nunca da divisão em lotes ou do número de
+processos. Carteiras grandes são distribuídas em um ProcessPoolExecutor.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+PERCENTILES = (5, 25, 50, 75, 95)
+CAP_RATE_FLOOR = 0.02       # cap rate de saída mínimo (evita valores explosivos)
+VACANCY_MAX = 0.95
+DEFAULT_VACANCY = 0.08      # quando o imóvel não informa ocupação
+
+
+@dataclass(frozen=True)
+class Assumptions:
+    """Premissas anuais da simulação (frações, ex: 0.03 = 3% a.a.)
+
+    vacancy_mean None usa a vacância atual de cada imóvel (100 - ocupação).
+    market_correlation é o peso do choque de mercado comum na variância de
+    crescimento e cap rate (0 = imóveis independentes).
+    """
+
+    rent_growth_mean: float = 0.04
+    rent_growth_vol: float = 0.03
+    vacancy_mean: Optional[float] = None
+    vacancy_vol: float = 0.04
+    cap_rate_drift_mean: float = 0.001
+    cap_rate_drift_vol: float = 0.003
+    financing_rate_mean: float = 0.11
+    financing_rate_vol: float = 0.02
+    discount_rate: float = 0.10
+    market_correlation: float = 0.5
+
+
+# ==================== SIMULAÇÃO ====================
+
+def _market_shocks(seed_sequence: np.random.SeedSequence, paths: int, years: int) -> Dict[str, np.ndarray]:
+    """Choques normais padronizados comuns a toda a carteira"""
+    rng = np.random.default_rng(seed_sequence)
+    return {
+        "growth": rng.standard_normal((paths, years)),
+        "cap_rate": rng.standard_normal(paths),
+        "financing": rng.standard_normal((paths, years)),
+    }
+
+
+def _market_terms(market: Dict[str, np.ndarray], assumptions: Assumptions, years: int) -> Dict[str, np.ndarray]:
+    """Parcelas comuns a todos os imóveis, calculadas uma vez por lote"""
+    common = np.sqrt(assumptions.market_correlation)
+    return {
+        "growth": 1 + assumptions.rent_growth_mean + assumptions.rent_growth_vol * common * market["growth"],
+        "drift": assumptions.cap_rate_drift_mean * years
+        + assumptions.cap_rate_drift_vol * np.sqrt(years) * common * market["cap_rate"],
+        # Dívida interest-only refinanciada à taxa do ano (choque de juros comum)
+        "rates": np.maximum(assumptions.financing_rate_mean
+                            + assumptions.financing_rate_vol * market["financing"], 0),
+    }
+
+
+def _simulate_property(rng: np.random.Generator, value: float, noi: float, vacancy: float, debt: float,
+                       terms: Dict[str, np.ndarray], assumptions: Assumptions, discount: np.ndarray):
+    """Valor presente e valor do equity de cada trajetória de um imóvel"""
+    paths, years = terms["growth"].shape
+    own = np.sqrt(1 - assumptions.market_correlation)
+
+    # Operações in-place: dois buffers trajetória × ano por imóvel
+    growth_index = rng.standard_normal((paths, years))
+    growth_index *= assumptions.rent_growth_vol * own
+    growth_index += terms["growth"]
+    np.cumprod(growth_index, axis=1, out=growth_index)
+
+    occupancy = rng.standard_normal((paths, years))
+    occupancy *= assumptions.vacancy_vol
+    occupancy += vacancy if assumptions.vacancy_mean is None else assumptions.vacancy_mean
+    np.clip(occupancy, 0, VACANCY_MAX, out=occupancy)
+    np.subtract(1, occupancy, out=occupancy)
+
+    # NOI potencial (100% ocupado) cresce com o aluguel; vacância é aplicada por ano
+    noi_paths = growth_index
+    noi_paths *= occupancy
+    noi_paths *= noi / (1 - min(vacancy, VACANCY_MAX))
+
+    exit_cap_rate = rng.standard_normal(paths)
+    exit_cap_rate *= assumptions.cap_rate_drift_vol * np.sqrt(years) * own
+    exit_cap_rate += terms["drift"] + noi / value
+    np.maximum(exit_cap_rate, CAP_RATE_FLOOR, out=exit_cap_rate)
+    # Valor de saída sobre o NOI do ano seguinte ao horizonte
+    exit_value = noi_paths[:, -1] * (1 + assumptions.rent_growth_mean) / exit_cap_rate
+
+    present_value = noi_paths @ discount + exit_value * discount[-1]
+    if not debt:
+        return present_value, present_value, np.zeros(paths, dtype=bool)
+
+    cash_flow = occupancy
+    np.multiply(terms["rates"], debt, out=cash_flow)
+    np.subtract(noi_paths, cash_flow, out=cash_flow)
+    equity_value = cash_flow @ discount + (exit_value - debt) * discount[-1]
+    return present_value, equity_value, (cash_flow < 0).any(axis=1)
+
+
+def _simulate_chunk(values: np.ndarray, nois: np.ndarray, vacancies: np.ndarray, debts: np.ndarray,
+                    seeds: Sequence[np.random.SeedSequence], market: Dict[str, np.ndarray],
+                    assumptions: Assumptions) -> tuple:
+    """Simula um lote de imóveis (executado no processo local ou em um worker)
+
+    Retorna (estatísticas por imóvel, soma dos valores por trajetória).
+    """
+    paths, years = market["growth"].shape
+    discount = (1 + assumptions.discount_rate) ** -np.arange(1, years + 1, dtype=np.float64)
+    terms = _market_terms(market, assumptions, years)
+    stats = np.empty((len(values), len(PERCENTILES) * 2 + 4))
+    portfolio_paths = np.zeros(paths)
+
+    for index, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        present_value, equity_value, negative_cash_flow = _simulate_property(
+            rng, values[index], nois[index], vacancies[index], debts[index], terms, assumptions, discount)
+        portfolio_paths += present_value
+        stats[index] = np.concatenate([
+            np.percentile(present_value, PERCENTILES),
+            np.percentile(equity_value, PERCENTILES),
+            [present_value.mean(), equity_value.mean(),
+             np.count_nonzero(present_value < values[index]) / paths,
+             np.count_nonzero(negative_cash_flow) / paths],
+        ])
+
+    return stats, portfolio_paths
+
+
+def _percentiles(values) -> Dict[str, float]:
+    return {f"p{q}": round(float(value), 2) for q, value in zip(PERCENTILES, values)}
+
+
+def simulate(current_value: Sequence[float], annual_noi: Sequence[float], occupancy_rate=None, debt=None,
+             ids: Optional[Sequence[Any]] = None, assumptions: Assumptions = Assumptions(),
+             paths: int = 10000, years: int = 10, seed: int = 42, workers: int = 0,
+             parallel_min_paths: int = 5_000_000, top: int = 10) -> Dict[str, Any]:
+    """Valuation de Monte Carlo de um ou mais imóveis
+
+    occupancy_rate em % (0-100); debt é o saldo devedor. Imóveis sem valor
+    ou NOI positivos são ignorados (contados em skipped). A carteira é
+    paralelizada quando imóveis × trajetórias ≥ parallel_min_paths e há mais
+    de um worker (workers 0 = os.cpu_count()).
+    """
+    start = time.perf_counter()
+    values = np.asarray(current_value, dtype=np.float64)
+    nois = np.asarray(annual_noi, dtype=np.float64)
+    size = len(values)
+    occupancy = (np.full(size, np.nan) if occupancy_rate is None
+                 else np.asarray(occupancy_rate, dtype=np.float64))
+    debts = np.zeros(size) if debt is None else np.nan_to_num(np.asarray(debt, dtype=np.float64))
+    if not (len(nois) == len(occupancy) == len(debts) == size):
+        raise ValueError("Colunas de valor, NOI, ocupação e dívida com tamanhos diferentes")
+    if ids is not None and len(ids) != size:
+        raise ValueError("ids com tamanho diferente das colunas")
+    if paths < 1 or years < 1:
+        raise ValueError("paths e years devem ser positivos")
+
+    valid = np.flatnonzero((values > 0) & (nois > 0))
+    vacancies = np.where(np.isnan(occupancy), DEFAULT_VACANCY, 1 - np.clip(occupancy, 0, 100) / 100)
+
+    # Sementes: mercado + uma filha por imóvel (independente de lotes/processos)
+    market_seed, property_seed = np.random.SeedSequence(seed).spawn(2)
+    market = _market_shocks(market_seed, paths, years)
+    seeds = property_seed.spawn(size)
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(valid)) if len(valid) * paths >= parallel_min_paths else 1
+    chunks = [chunk for chunk in np.array_split(valid, workers) if len(chunk)]
+    arguments = [(values[chunk], nois[chunk], vacancies[chunk], debts[chunk],
+                  [seeds[i] for i in chunk], market, assumptions) for chunk in chunks]
+
+    results = None
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_simulate_chunk, *zip(*arguments)))
+        except (OSError, BrokenProcessPool):
+            workers = 1  # sem processos disponíveis: segue no processo atual
+    if results is None:
+        results = [_simulate_chunk(*args) for args in arguments]
+
+    stats = np.vstack([chunk_stats for chunk_stats, _ in results]) if results else np.empty((0, 14))
+    portfolio_paths = sum((chunk_paths for _, chunk_paths in results), np.zeros(paths))
+
+    count = len(PERCENTILES)
+    properties = []
+    for row, index in zip(stats, valid.tolist()):
+        properties.append({
+            "id": ids[index] if ids is not None else index,
+            "current_value": round(float(values[index]), 2),
+            "value": _percentiles(row[:count]),
+            "equity_value": _percentiles(row[count:count * 2]) if debts[index] else None,
+            "mean_value": round(float(row[count * 2]), 2),
+            "upside_p50": round(float(row[2] / values[index] - 1) * 100, 2),
+            "prob_below_current": round(float(row[count * 2 + 2]), 4),
+            "prob_negative_cash_flow": round(float(row[count * 2 + 3]), 4) if debts[index] else None,
+        })
+    # Maior probabilidade de perda primeiro
+    properties.sort(key=lambda item: (-item["prob_below_current"], item["upside_p50"]))
+
+    total = float(values[valid].sum())
+    portfolio = {}
+    if len(valid):
+        portfolio = {
+            "current_value": round(total, 2),
+            "value": _percentiles(np.percentile(portfolio_paths, PERCENTILES)),
+            "mean_value": round(float(portfolio_paths.mean()), 2),
+            "prob_below_current": round(float(np.count_nonzero(portfolio_paths < total) / paths), 4),
+        }
+
+    return {
+        "properties_simulated": len(valid),
+        "skipped": size - len(valid),
+        "paths": paths,
+        "years": years,
+        "seed": seed,
+        "workers": workers,
+        "portfolio": portfolio,
+        "properties": properties[:max(int(top), 0)] if size > 1 else properties,
+        "parameters": asdict(assumptions),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
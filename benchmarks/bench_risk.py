@@ -0,0 +1,64 @@
+"""
+Benchmark: risk_assessment unitário vs. motor de risco em lote
+Desenvolvido por ness.
+
+Compara o score imóvel a imóvel (risk_engine.score_property, o mesmo do
+risk_assessment) com as máscaras vetorizadas de risk_engine.assess_batch
+em uma carteira sintética, e confere que os scores são idênticos.
+
+Uso:
+    python benchmarks/bench_risk.py --properties 100000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import risk_engine  # noqa: E402
+
+PROPERTY_TYPES = ["Residencial", "Comercial", "Galpão", "Retail", "Lajes Corporativas", "commercial"]
+
+
+def synthetic_portfolio(size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    occupancy = rng.uniform(40, 100, size)
+    debt = rng.uniform(0, 0.95, size)
+    types = rng.choice(np.array(PROPERTY_TYPES, dtype=object), size)
+    return occupancy, debt, types
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--properties", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    occupancy, debt, types = synthetic_portfolio(args.properties, args.seed)
+    occupancy_list, debt_list, types_list = occupancy.tolist(), debt.tolist(), types.tolist()
+
+    start = time.perf_counter()
+    scalar = [risk_engine.score_property(t, o, d)[0] for t, o, d in zip(types_list, occupancy_list, debt_list)]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = risk_engine.assess_batch(occupancy, debt, types, high=50, medium=25, top=args.top)
+    batch_seconds = time.perf_counter() - start
+
+    batch = risk_engine.score_batch(occupancy, debt, types)
+    assert np.array_equal(batch, np.array(scalar)), "scores do lote divergem do cálculo unitário"
+
+    print(f"imóveis: {args.properties:,}")
+    print(f"  unitário (loop Python)   {scalar_seconds * 1000:>9.1f} ms")
+    print(f"  assess_batch (numpy)     {batch_seconds * 1000:>9.1f} ms   speedup {scalar_seconds / batch_seconds:.1f}x")
+    print(f"  níveis: {result['levels']}")
+    print(f"  distribuição: {result['score_distribution']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: search_data com e sem índice pg_trgm
+Desenvolvido por ness.
+
+Cria uma tabela sintética (padrão: 10M linhas) no PostgreSQL, mede o
+search_data do servidor MCP em sequential scan, cria os índices GIN pg_trgm
+via create_search_index e mede novamente.
+
+Uso:
+    python benchmarks/bench_search_index.py --rows 10000000
+
+Conexão via POSTGRES_DEFAULT_* (mesmas variáveis do .env da aplicação).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mcp_postgres_stdio as server  # noqa: E402
+
+TABLE = "bench_search_data"
+TERMS = ["cliente-4242", "zzz-inexistente", "imovel-777777"]
+
+
+def call(name: str, arguments: dict) -> dict:
+    """Chama a ferramenta do servidor MCP e decodifica o JSON"""
+    result = server.run_tool(name, arguments)
+    return json.loads(result[0].text)
+
+
+def create_table(rows: int):
+    """Cria a tabela sintética com colunas de texto"""
+    conn = server.state.connection
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS public.{TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE public.{TABLE} AS
+        SELECT g AS id,
+               'cliente-' || (g % 100000) AS cliente,
+               'imovel-' || g AS descricao,
+               md5(g::text) AS codigo
+        FROM generate_series(1, %s) AS g
+    """, (rows,))
+    cursor.execute(f"ALTER TABLE public.{TABLE} ADD PRIMARY KEY (id)")
+    cursor.execute(f"ANALYZE public.{TABLE}")
+    conn.commit()
+
+
+def measure(label: str, repeat: int):
+    """Executa cada termo N vezes e imprime mediana"""
+    for term in TERMS:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = call("search_data", {"table": f"public.{TABLE}", "search_term": term})
+            timings.append((time.perf_counter() - start) * 1000)
+        plan = data.get("search_plan", {}).get("strategy")
+        print(f"{label:<12} {term:<18} {statistics.median(timings):>10.1f} ms  "
+              f"hits={data.get('count')} strategy={plan}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keep", action="store_true", help="Não remove a tabela ao final")
+    args = parser.parse_args()
+
+    # Busca sequencial em 10M linhas excede o timeout padrão
+    server.Config.TOOL_TIMEOUTS["search_data"] = 0
+    server.Config.ALLOW_SEARCH_INDEX_CREATION = True
+
+    connected = call("connect_database", {
+        "host": os.getenv("POSTGRES_DEFAULT_HOST", "localhost"),
+        "port": int(os.getenv("POSTGRES_DEFAULT_PORT", "5432")),
+        "database": os.getenv("POSTGRES_DEFAULT_DATABASE", "chainlit"),
+        "user": os.getenv("POSTGRES_DEFAULT_USERNAME", "chainlit"),
+        "password": os.getenv("POSTGRES_DEFAULT_PASSWORD", "chainlit"),
+    })
+    if not connected.get("success"):
+        sys.exit(f"Falha ao conectar: {connected.get('error')}")
+
+    print(f"Criando {TABLE} com {args.rows:,} linhas...")
+    start = time.perf_counter()
+    create_table(args.rows)
+    print(f"Tabela criada em {time.perf_counter() - start:.1f}s")
+
+    # Redescobre o schema para incluir a tabela nova
+    server.state.discover_schema()
+    server.state.end_tool()
+
+    measure("seq_scan", args.repeat)
+
+    start = time.perf_counter()
+    created = call("create_search_index", {"table": f"public.{TABLE}"})
+    print(f"create_search_index: {created.get('indexes') or created.get('error')} "
+          f"({time.perf_counter() - start:.1f}s)")
+
+    measure("trigram", args.repeat)
+
+    if not args.keep:
+        cursor = server.state.connection.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS public.{TABLE}")
+        server.state.connection.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark: serialização dos resultados de tools
+Desenvolvido por ness.
+
+Compara o formato antigo (json.dumps com indent=2 e default=str) com
+app/serialization.py (orjson quando instalado, stdlib compacta no fallback)
+nos formatos típicos de resultado: execute_query, get_database_schema e
+tool calls do modelo (loads).
+
+Uso:
+    python benchmarks/bench_serialization.py --rows 1000
+"""
+
+import os
+import sys
+import json
+import uuid
+import timeit
+import argparse
+import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import serialization  # noqa: E402
+
+
+def query_result(rows: int) -> dict:
+    """Formato do execute_query: linhas com Decimal, datetime, UUID e texto"""
+    return {
+        "success": True,
+        "columns": ["id", "codigo", "descricao", "valor_compra", "valor_atual", "data_aquisicao", "ativo"],
+        "rows": [{
+            "id": i,
+            "codigo": uuid.UUID(int=i),
+            "descricao": f"Imóvel comercial {i} - São Paulo",
+            "valor_compra": Decimal("1250000.50") + i,
+            "valor_atual": Decimal("1480000.75") + i,
+            "data_aquisicao": datetime.datetime(2020, 1, 1) + datetime.timedelta(days=i % 1500),
+            "ativo": i % 3 != 0,
+        } for i in range(rows)],
+        "count": rows,
+        "limited": False,
+    }
+
+
+def schema_result(tables: int) -> dict:
+    """Formato do get_database_schema"""
+    return {
+        "tables": [{
+            "schema": "dbo",
+            "name": f"tabela_{t}",
+            "columns": [{"name": f"coluna_{c}", "type": "nvarchar", "nullable": True, "max_length": 255}
+                        for c in range(20)],
+            "row_count": t * 1000,
+        } for t in range(tables)],
+        "relationships": [],
+    }
+
+
+def legacy_dumps(obj) -> str:
+    return json.dumps(obj, indent=2, ensure_ascii=False, default=str)
+
+
+def bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"  {label:<28} {seconds * 1e6:>10.1f} µs")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--tables", type=int, default=50)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    backend = "orjson" if serialization.orjson is not None else "stdlib"
+    print(f"backend: {backend}")
+
+    shapes = {
+        f"execute_query ({args.rows} linhas)": query_result(args.rows),
+        f"get_database_schema ({args.tables} tabelas)": schema_result(args.tables),
+    }
+    for name, payload in shapes.items():
+        print(name)
+        old = bench("json.dumps indent=2", lambda: legacy_dumps(payload), args.number)
+        new = bench("serialization.dumps", lambda: serialization.dumps(payload), args.number)
+        print(f"  speedup {old / new:.1f}x  tamanho {len(legacy_dumps(payload)):,} → "
+              f"{len(serialization.dumps(payload)):,} caracteres")
+
+    arguments = json.dumps({"query": "SELECT TOP 100 * FROM dbo.imoveis WHERE cidade = 'São Paulo'", "limit": 100})
+    print("tool call arguments (loads)")
+    old = bench("json.loads", lambda: json.loads(arguments), args.number * 1000)
+    new = bench("serialization.loads", lambda: serialization.loads(arguments), args.number * 1000)
+    print(f"  speedup {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Load test: usuários Chainlit simultâneos contra os handlers do app
+Desenvolvido por ness.
+
+Sobe um servidor OpenAI falso (determinístico, sem rede) e simula N usuários
+chamando os handlers reais do app/app.py (start, main e action callbacks),
+cada um com seu próprio contexto HTTP do Chainlit. Mede latência por turno
+(p50/p95/p99), throughput e memória por sessão (tracemalloc).
+
+Bancos:
+    --db none     só perguntas financeiras (sem SQL)
+    --db sqlite   tabela properties em SQLite em memória por sessão (offline)
+    --db mssql    banco MSSQL default do docker-compose (MSSQL_DEFAULT_*)
+    --db postgres PostgreSQL do docker-compose (POSTGRES_DEFAULT_*), tabela
+                  properties em TEMP TABLE por sessão (requer psycopg2)
+
+Uso:
+    python benchmarks/load_test.py --users 50 --turns 5 --llm-latency-ms 300
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+FINANCIAL_QUESTIONS = [
+    "Qual o ROI de um imóvel comprado por 500 mil que hoje vale 620 mil?",
+    "Calcule o cap rate de um galpão com NOI de 80 mil e valor de 1 milhão",
+    "Vale a pena investir em um imóvel com retorno de 7% ao ano?",
+]
+DATA_QUESTIONS = [
+    "Mostre o resumo da carteira no banco",
+    "Quantos imóveis ativos existem na tabela properties?",
+]
+
+DATA_WORDS = ("banco", "tabela", "quantos", "carteira")
+
+
+# ==================== SERVIDOR OPENAI FALSO ====================
+
+def completion(model: str, content: str = None, tool_call: tuple = None) -> dict:
+    """Resposta no formato de /v1/chat/completions"""
+    message = {"role": "assistant", "content": content}
+    if tool_call:
+        name, arguments = tool_call
+        message["tool_calls"] = [{
+            "id": f"call_{random.getrandbits(32):08x}",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments)},
+        }]
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message,
+                     "finish_reason": "tool_calls" if tool_call else "stop"}],
+        "usage": {"prompt_tokens": 500, "completion_tokens": 60, "total_tokens": 560},
+    }
+
+
+def decide(request: dict) -> dict:
+    """Roteiro determinístico: delega → chama uma tool → responde"""
+    messages = request["messages"]
+    tools = {t["function"]["name"] for t in request.get("tools") or []}
+    last = messages[-1]
+    model = request.get("model", "stub")
+
+    if last["role"] == "tool":
+        return completion(model, content=f"Resposta simulada com base em {len(messages)} mensagens.")
+
+    question = last.get("content") or ""
+    if "delegate_to_data_analyst" in tools:
+        target = "delegate_to_data_analyst" if any(w in question.lower() for w in DATA_WORDS) \
+            else "delegate_to_financial_expert"
+        return completion(model, tool_call=(target, {"query": question}))
+    if "calculate_roi" in tools:
+        return completion(model, tool_call=("calculate_roi", {
+            "initial_investment": 500000, "current_value": 620000, "period_months": 24}))
+    if "get_portfolio_summary" in tools:
+        return completion(model, tool_call=("get_portfolio_summary", {}))
+    return completion(model, content="Resposta simulada.")
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        payload = json.dumps(decide(json.loads(body))).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency_ms: float) -> ThreadingHTTPServer:
+    StubOpenAIHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ==================== BANCO ====================
+
+def property_rows(count: int = 1000) -> list:
+    """Linhas determinísticas da tabela properties (mesmas em todos os bancos)"""
+    rng = random.Random(42)
+    return [(rng.uniform(2e5, 2e6), rng.uniform(2e5, 2.5e6), rng.uniform(3, 10),
+             rng.choice(["Ativo", "Ativo", "Vendido"])) for _ in range(count)]
+
+
+def sqlite_connection() -> sqlite3.Connection:
+    """Stand-in da tabela properties (mesmas colunas do get_portfolio_summary)"""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("""CREATE TABLE properties (
+        id INTEGER PRIMARY KEY, purchase_price REAL, current_value REAL,
+        rental_yield REAL, status TEXT)""")
+    conn.executemany(
+        "INSERT INTO properties (purchase_price, current_value, rental_yield, status) VALUES (?, ?, ?, ?)",
+        property_rows()
+    )
+    return conn
+
+
+def postgres_connection(Config):
+    """PostgreSQL do docker-compose com a tabela properties em TEMP TABLE da sessão
+
+    A tabela temporária some ao fechar a conexão: o banco de persistência
+    (db-persist) não é alterado.
+    """
+    import psycopg2  # opcional: só no modo postgres
+
+    conn = psycopg2.connect(
+        host=Config.POSTGRES_DEFAULT_HOST, port=Config.POSTGRES_DEFAULT_PORT,
+        dbname=Config.POSTGRES_DEFAULT_DATABASE, user=Config.POSTGRES_DEFAULT_USERNAME,
+        password=Config.POSTGRES_DEFAULT_PASSWORD, connect_timeout=10
+    )
+    # Autocommit: um erro de query não deixa a transação da sessão abortada
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("""CREATE TEMP TABLE properties (
+            id SERIAL PRIMARY KEY, purchase_price DOUBLE PRECISION, current_value DOUBLE PRECISION,
+            rental_yield DOUBLE PRECISION, status TEXT)""")
+        cursor.executemany(
+            "INSERT INTO properties (purchase_price, current_value, rental_yield, status) VALUES (%s, %s, %s, %s)",
+            property_rows()
+        )
+    return conn
+
+
+def attach_database(chat_app, mode: str):
+    """Registra a conexão da sessão em connections_store (como connect_database faria)"""
+    if mode == "none":
+        return
+    if mode == "sqlite":
+        conn = sqlite_connection()
+    elif mode == "postgres":
+        conn = postgres_connection(chat_app.Config)
+    else:
+        Config = chat_app.Config
+        conn = chat_app.pyodbc.connect(
+            "DRIVER={ODBC Driver 18 for SQL Server};"
+            f"SERVER={Config.MSSQL_DEFAULT_SERVER},{Config.MSSQL_DEFAULT_PORT};"
+            f"DATABASE={Config.MSSQL_DEFAULT_DATABASE};UID={Config.MSSQL_DEFAULT_USERNAME};"
+            f"PWD={Config.MSSQL_DEFAULT_PASSWORD};TrustServerCertificate=yes;",
+            timeout=10
+        )
+    session_id = chat_app.cl.user_session.get("id")
+    chat_app.connections_store[session_id] = {
+        "connections": {"main": {"connection": conn, "server": mode, "database": mode}},
+        "current": "main",
+    }
+
+
+# ==================== USUÁRIOS SIMULADOS ====================
+
+async def simulate_user(chat_app, user_index: int, args, latencies: list, errors: list):
+    from chainlit.context import init_http_context
+    from chainlit.user import User
+
+    init_http_context(user=User(identifier=f"load-user-{user_index}"))
+    rng = random.Random(user_index)
+    questions = FINANCIAL_QUESTIONS + (DATA_QUESTIONS if args.db != "none" else [])
+
+    await chat_app.start()
+    attach_database(chat_app, args.db)
+
+    if args.actions:
+        await chat_app.on_help_mcp(chat_app.cl.Action(name="help_mcp", payload={}))
+
+    for _ in range(args.turns):
+        message = chat_app.cl.Message(content=rng.choice(questions))
+        start = time.perf_counter()
+        try:
+            await chat_app.main(message)
+        except Exception as e:
+            errors.append(repr(e))
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(args.think_time_ms / 1000)
+
+    await chat_app.end()
+
+
+def percentile(values: list, p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+async def run(chat_app, args):
+    latencies, errors = [], []
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+
+    tasks = []
+    for index in range(args.users):
+        tasks.append(asyncio.create_task(simulate_user(chat_app, index, args, latencies, errors)))
+        if args.ramp_ms:
+            await asyncio.sleep(args.ramp_ms / 1000)
+    await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"usuários={args.users} turnos/usuário={args.turns} db={args.db} "
+          f"latência LLM={args.llm_latency_ms}ms router={'on' if chat_app.Config.INTENT_ROUTER_ENABLED else 'off'}")
+    print(f"turnos: {len(latencies)}  erros: {len(errors)}  duração: {elapsed:.1f}s")
+    print(f"latência por turno (ms): p50={percentile(latencies, 50) * 1000:.1f} "
+          f"p95={percentile(latencies, 95) * 1000:.1f} p99={percentile(latencies, 99) * 1000:.1f}")
+    print(f"throughput: {len(latencies) / elapsed:.2f} turnos/s")
+    print(f"memória: pico {(peak - baseline) / 1024 / args.users:.1f} KiB/sessão, "
+          f"retida {(current - baseline) / 1024 / args.users:.1f} KiB/sessão")
+    for error in errors[:5]:
+        print(f"  erro: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--think-time-ms", type=float, default=0)
+    parser.add_argument("--ramp-ms", type=float, default=0, help="Intervalo entre a entrada de cada usuário")
+    parser.add_argument("--db", choices=["none", "sqlite", "mssql", "postgres"], default="sqlite")
+    parser.add_argument("--actions", action="store_true", help="Dispara o action callback help_mcp por usuário")
+    parser.add_argument("--no-router", action="store_true", help="Desliga o roteador de intenção local")
+    args = parser.parse_args()
+
+    stub = start_stub_server(args.llm_latency_ms)
+
+    # Ambiente do app antes do import (Config lê as variáveis na carga do módulo)
+    log_dir = tempfile.mkdtemp(prefix="load_test_")
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub.server_address[1]}/v1",
+        "LOG_FILE": os.path.join(log_dir, "agent_logs.txt"),
+        "METRICS_ENABLED": "false",
+        "MCP_WARMUP_ENABLED": "false",
+        "INTENT_ROUTER_ENABLED": "false" if args.no_router else "true",
+    })
+
+    os.chdir(ROOT)
+    sys.path.insert(0, os.path.join(ROOT, "app"))
+    import app as chat_app  # noqa: E402  (app/app.py)
+
+    asyncio.run(run(chat_app, args))
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,27 @@ Desenvolvido por ness.
 Implementação nativa de MCP server via stdio para acesso ao PostgreSQL
 """
 
+import os
+import re
 import sys
-import json
+import time
 import asyncio
+from collections import OrderedDict
+from decimal import Decimal
 from typing import Any, Sequence
 
+import anyio
 import mcp.types as types
 from mcp.server import NotificationOptions, Server
 from mcp.server.models import InitializationOptions
 from mcp.server.stdio import stdio_server
 
+from app import tracing
+from app.serialization import dumps, loads
+from app.exporters import EXPORT_FORMATS, export_cursor
+
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 from datetime import datetime
 
@@ -24,6 +34,63 @@ from datetime import datetime
 app = Server("postgres-mcp")
 
 
+class Config:
+    """Configurações do servidor (variáveis de ambiente)"""
+
+    # Cost guard: EXPLAIN antes de executar queries do agente
+    # Modos: reject (recusa), rewrite (aplica LIMIT e reavalia), off (desligado)
+    COST_GUARD_MODE = os.getenv("COST_GUARD_MODE", "reject").lower()
+    COST_GUARD_MAX_ROWS = int(os.getenv("COST_GUARD_MAX_ROWS", "1000000"))
+    COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST_POSTGRES", "1000000"))
+
+    # statement_timeout por ferramenta (segundos, 0 = sem limite)
+    STATEMENT_TIMEOUT = float(os.getenv("STATEMENT_TIMEOUT", "30"))
+    TOOL_TIMEOUTS = {
+        "connect_database": float(os.getenv("TIMEOUT_CONNECT_DATABASE", "120")),
+        "execute_query": float(os.getenv("TIMEOUT_EXECUTE_QUERY", "30")),
+        "preview_table": float(os.getenv("TIMEOUT_PREVIEW_TABLE", "10")),
+        "search_data": float(os.getenv("TIMEOUT_SEARCH_DATA", "15")),
+        "export_query": float(os.getenv("TIMEOUT_EXPORT_QUERY", "600")),
+        "aggregate": float(os.getenv("TIMEOUT_AGGREGATE", "60")),
+        "profile_table": float(os.getenv("TIMEOUT_PROFILE_TABLE", "60")),
+        "create_search_index": float(os.getenv("TIMEOUT_CREATE_SEARCH_INDEX", "300")),
+    }
+
+    # Ferramenta opt-in que cria índices de busca (pg_trgm) em tabelas quentes
+    ALLOW_SEARCH_INDEX_CREATION = os.getenv("ALLOW_SEARCH_INDEX_CREATION", "false").lower() == "true"
+    # Configuração de text search das colunas tsvector (search_data com match=full_text)
+    TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "simple")
+
+    # search_data progressivo (TABLESAMPLE crescente) para tabelas grandes
+    PROGRESSIVE_SEARCH_MIN_ROWS = int(os.getenv("PROGRESSIVE_SEARCH_MIN_ROWS", "1000000"))
+    SEARCH_TIME_BUDGET_MS = int(os.getenv("SEARCH_TIME_BUDGET_MS", "5000"))
+    SEARCH_SAMPLE_STEPS = [float(p) for p in os.getenv("SEARCH_SAMPLE_STEPS", "0.1,1,10,100").split(",")]
+    SEARCH_SAMPLE_SEED = int(os.getenv("SEARCH_SAMPLE_SEED", "42"))
+
+    # Normalização de literais + cache de prepared statements no execute_query
+    PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "false").lower() == "true"
+    PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "64"))
+
+    # export_query: arquivos Parquet/CSV gerados em lotes no disco local
+    EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+    EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "5000000"))
+
+    # aggregate: máximo de grupos devolvidos ao agente
+    AGGREGATE_MAX_GROUPS = int(os.getenv("AGGREGATE_MAX_GROUPS", "1000"))
+
+    # profile_table: tabelas acima de PROFILE_SAMPLE_MIN_ROWS são amostradas
+    # (TABLESAMPLE) para ler ~PROFILE_SAMPLE_ROWS linhas
+    PROFILE_SAMPLE_MIN_ROWS = int(os.getenv("PROFILE_SAMPLE_MIN_ROWS", "1000000"))
+    PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "100000"))
+    PROFILE_TOP_VALUES = int(os.getenv("PROFILE_TOP_VALUES", "5"))
+
+    @classmethod
+    def timeout_for(cls, tool_name: str) -> float:
+        """Timeout configurado para a ferramenta"""
+        return cls.TOOL_TIMEOUTS.get(tool_name, cls.STATEMENT_TIMEOUT)
+
+
 @app.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """Lista todas as ferramentas disponíveis"""
@@ -69,7 +136,7 @@ async def handle_list_tools() -> list[types.Tool]:
         ),
         types.Tool(
             name="execute_query",
-            description="Executa query SQL SELECT de forma segura",
+            description="Executa query SQL SELECT de forma segura (estimativa do planner é verificada antes da execução e devolvida no resultado)",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -130,14 +197,380 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "array",
                         "items": {"type": "string"},
                         "description": "Colunas específicas (opcional)"
+                    },
+                    "match": {
+                        "type": "string",
+                        "enum": ["substring", "full_text"],
+                        "description": "substring (ILIKE '%termo%' em todas as colunas, acelerado por índices trigram) ou full_text (palavras inteiras nas colunas tsvector; demais colunas seguem com ILIKE) (padrão: substring)"
+                    },
+                    "exhaustive": {
+                        "type": "boolean",
+                        "description": "Força ILIKE em todas as colunas, mesmo com match=full_text (padrão: false)"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["auto", "full", "progressive"],
+                        "description": "auto (amostragem progressiva em tabelas grandes sem índice), full ou progressive (padrão: auto)"
+                    },
+                    "time_budget_ms": {
+                        "type": "integer",
+                        "description": "Orçamento de tempo do modo progressivo em ms (padrão: 5000)"
                     }
                 },
                 "required": ["table", "search_term"]
             }
+        ),
+        types.Tool(
+            name="create_search_index",
+            description="Cria índices GIN pg_trgm nas colunas de texto de uma tabela para acelerar search_data (opt-in, requer ALLOW_SEARCH_INDEX_CREATION=true)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas a indexar (padrão: todas as colunas de texto)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="aggregate",
+            description="Agrega uma tabela no banco (COUNT/SUM/AVG/MIN/MAX com GROUP BY e filtros) e retorna só os grupos. Use para totais, médias, contagens e rankings em vez de buscar linhas com execute_query.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "group_by": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas de agrupamento (vazio = um único total)"
+                    },
+                    "measures": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "function": {"type": "string", "enum": list(AGGREGATE_FUNCTIONS)},
+                                "column": {"type": "string", "description": "Coluna (opcional em count)"},
+                                "alias": {"type": "string", "description": "Nome da medida no resultado"}
+                            },
+                            "required": ["function"]
+                        },
+                        "description": "Medidas a calcular (padrão: count)"
+                    },
+                    "filters": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "column": {"type": "string"},
+                                "operator": {"type": "string", "enum": list(FILTER_OPERATORS)},
+                                "value": {"description": "Valor; lista em in/not_in, [mínimo, máximo] em between"}
+                            },
+                            "required": ["column", "operator"]
+                        },
+                        "description": "Filtros combinados com AND"
+                    },
+                    "order_by": {
+                        "type": "string",
+                        "description": "Medida (alias) ou coluna do group_by para ordenar (padrão: primeira medida)"
+                    },
+                    "ascending": {
+                        "type": "boolean",
+                        "description": "Ordem crescente (padrão: false, maiores primeiro)"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Máximo de grupos (padrão: 100)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="profile_table",
+            description="Perfil estatístico das colunas de uma tabela em uma passada: nulos, distintos, mín/máx, média, comprimento médio e valores mais frequentes (estatísticas do catálogo quando disponíveis, amostragem em tabelas grandes). Resultado fica em cache no schema.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas a perfilar (padrão: todas)"
+                    },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "Ignora o perfil em cache e recalcula (padrão: false)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="export_query",
+            description="Exporta o resultado completo de uma query SELECT para arquivo Parquet ou CSV (lido em lotes, memória constante) e retorna apenas o caminho do arquivo e estatísticas. Use para extrações grandes em vez de execute_query.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Query SELECT a exportar (sem limite de linhas)"
+                    },
+                    "format": {
+                        "type": "string",
+                        "enum": list(EXPORT_FORMATS),
+                        "description": "Formato do arquivo (padrão: parquet; CSV se pyarrow não estiver instalado)"
+                    },
+                    "file_name": {
+                        "type": "string",
+                        "description": "Prefixo do nome do arquivo"
+                    },
+                    "max_rows": {
+                        "type": "integer",
+                        "description": "Máximo de linhas exportadas (padrão: EXPORT_MAX_ROWS)"
+                    }
+                },
+                "required": ["query"]
+            }
         )
     ]
 
 
+# Tipos de texto pesquisáveis via ILIKE
+TEXT_TYPES = ["character varying", "text", "character", "varchar", "char"]
+
+# profile_table: estatísticas calculadas por tipo de coluna
+NUMERIC_TYPES = {"smallint", "integer", "bigint", "numeric", "decimal", "real", "double precision"}
+ORDERABLE_TYPES = NUMERIC_TYPES | set(TEXT_TYPES) | {
+    "date", "timestamp without time zone", "timestamp with time zone",
+    "time without time zone", "time with time zone", "interval",
+}
+DISTINCT_TYPES = ORDERABLE_TYPES | {"boolean", "uuid", "jsonb", "bytea"}
+
+
+def quote_ident(name: str) -> str:
+    """Quota identificador PostgreSQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+# aggregate: só funções e operadores conhecidos, valores sempre como parâmetros
+AGGREGATE_FUNCTIONS = {
+    "count": "COUNT({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+    "sum": "SUM({})",
+    "avg": "AVG({})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+}
+FILTER_OPERATORS = {
+    "=": "=", "!=": "<>", "<>": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<=",
+    "like": "LIKE", "ilike": "ILIKE", "in": "IN", "not_in": "NOT IN",
+    "between": "BETWEEN", "is_null": "IS NULL", "is_not_null": "IS NOT NULL",
+}
+
+
+# Literais precedidos destes tipos não podem virar parâmetro (ex.: INTERVAL '1 day')
+TYPED_LITERAL_KEYWORDS = {"DATE", "TIME", "TIMESTAMP", "INTERVAL"}
+COMPARISON_OPERATORS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+NUMBER_RE = re.compile(r"\d+(\.\d+)?([eE][+-]?\d+)?")
+WORD_RE = re.compile(r"[^\W\d][\w$]*")
+# Parâmetros sem tipo são inferidos pela coluna comparada (int_col = 5.5 viraria 6):
+# números levam o tipo que o literal teria; texto fica sem tipo, como o literal '...'
+PARAMETER_CASTS = {
+    "integer": "::integer",
+    "bigint": "::bigint",
+    "numeric": "::numeric",
+    "bpchar": "::bpchar",
+}
+
+
+def number_parameter(literal: str) -> tuple[Any, str]:
+    """Valor e tipo do literal numérico como o PostgreSQL tiparia
+
+    Inteiros viram integer/bigint conforme a faixa (senão numeric); com
+    ponto ou expoente o literal é numeric (Decimal, sem perda de precisão).
+    """
+    if any(c in literal for c in ".eE"):
+        return Decimal(literal), "numeric"
+    value = int(literal)
+    if value <= 2 ** 31 - 1:
+        return value, "integer"
+    if value <= 2 ** 63 - 1:
+        return value, "bigint"
+    return Decimal(literal), "numeric"
+
+
+def string_parameter(value: str, unicode: bool) -> str:
+    """Tipo do parâmetro de um literal de texto: N'...' é character, '...' fica sem tipo"""
+    return "bpchar" if unicode else "unknown"
+
+
+def normalize_query(query: str, placeholder) -> tuple[str, list]:
+    """Extrai literais da query para parâmetros (mesmo formato = mesmo plano)
+
+    Strings viram parâmetros, exceto literais tipados (DATE '...'); números
+    só quando comparados (ORDER BY 1 e LIMIT 10 continuam literais).
+    `placeholder(n, tipo)` gera o marcador do n-ésimo parâmetro preservando
+    o tipo que o literal teria (number_parameter / string_parameter).
+    """
+    out = []
+    params = []
+    last_token = ""
+    i, n = 0, len(query)
+
+    while i < n:
+        ch = query[i]
+
+        # Comentários e identificadores quotados são copiados sem alteração
+        if query.startswith("--", i):
+            end = query.find("\n", i)
+            end = n if end == -1 else end
+            out.append(query[i:end])
+            i = end
+            continue
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            out.append(query[i:end])
+            i = end
+            continue
+        if ch in '"[':
+            close = '"' if ch == '"' else "]"
+            end = i + 1
+            while end < n:
+                if query[end] == close:
+                    if end + 1 < n and query[end + 1] == close:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            out.append(query[i:end + 1])
+            last_token = "IDENT"
+            i = end + 1
+            continue
+
+        if ch == "'":
+            end = i + 1
+            value = []
+            while end < n:
+                if query[end] == "'":
+                    if end + 1 < n and query[end + 1] == "'":
+                        value.append("'")
+                        end += 2
+                        continue
+                    break
+                value.append(query[end])
+                end += 1
+            literal = query[i:end + 1]
+            i = end + 1
+
+            prefix = out[-1] if out else ""
+            unicode = False
+            if prefix and (prefix[-1:].isalnum() or prefix[-1:] == "_"):
+                # Prefixo colado (E'', B'', N''): N'' vira parâmetro unicode
+                if prefix[-1] in "Nn" and (len(prefix) == 1 or not (prefix[-2].isalnum() or prefix[-2] == "_")):
+                    out[-1] = prefix[:-1]
+                    unicode = True
+                else:
+                    out.append(literal)
+                    last_token = "LITERAL"
+                    continue
+            if last_token in TYPED_LITERAL_KEYWORDS or last_token == "AS":
+                out.append(literal)
+            else:
+                params.append("".join(value))
+                out.append(placeholder(len(params), string_parameter(params[-1], unicode)))
+            last_token = "LITERAL"
+            continue
+
+        if ch.isdigit() and not (out and (out[-1][-1:].isalnum() or out[-1][-1:] in "_$.")):
+            match = NUMBER_RE.match(query, i)
+            literal = match.group(0)
+            i = match.end()
+            if last_token in COMPARISON_OPERATORS:
+                value, kind = number_parameter(literal)
+                params.append(value)
+                out.append(placeholder(len(params), kind))
+            else:
+                out.append(literal)
+            last_token = "LITERAL"
+            continue
+
+        if ch.isalpha() or ch == "_":
+            word = WORD_RE.match(query, i).group(0)
+            out.append(word)
+            last_token = word.upper()
+            i += len(word)
+            continue
+
+        if ch in "<>!=":
+            op = query[i:i + 2] if query[i:i + 2] in COMPARISON_OPERATORS else ch
+            out.append(op)
+            last_token = op
+            i += len(op)
+            continue
+
+        out.append(ch)
+        if not ch.isspace():
+            last_token = ch
+        i += 1
+
+    return "".join(out), params
+
+
+class StatementCache:
+    """LRU de statements preparados por conexão, com contadores de reuso"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, shape: str):
+        """Statement preparado para o formato de query (None se ausente)"""
+        entry = self.entries.get(shape)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(shape)
+        self.hits += 1
+        return entry
+
+    def add(self, shape: str, entry):
+        """Registra statement; retorna o statement despejado pelo LRU (ou None)"""
+        self.entries[shape] = entry
+        if len(self.entries) > self.max_size:
+            self.evictions += 1
+            return self.entries.popitem(last=False)[1]
+        return None
+
+    def stats(self) -> dict:
+        """Contadores de reuso de plano"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "cached_statements": len(self.entries),
+            "evictions": self.evictions
+        }
+
+
 # Estado global do servidor
 class MCPState:
     def __init__(self):
@@ -145,6 +578,33 @@ class MCPState:
         self.schema_cache: dict = {}
         self.host_name: str = ""
         self.database_name: str = ""
+        # Serializa o uso da conexão entre requests concorrentes
+        self.lock = asyncio.Lock()
+        # Prepared statements da conexão atual (formato de query -> nome)
+        self.statement_cache = StatementCache(Config.PREPARED_STATEMENT_CACHE_SIZE)
+        self.statement_counter = 0
+
+    def begin_tool(self, tool_name: str):
+        """Abre a transação da ferramenta com statement_timeout próprio"""
+        timeout_ms = int(Config.timeout_for(tool_name) * 1000)
+        cursor = self.connection.cursor()
+        cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+
+    def end_tool(self):
+        """Encerra a transação da ferramenta (libera snapshot e locks)"""
+        if self.connection and not self.connection.closed:
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+
+    def cancel_running(self):
+        """Cancela o statement em execução (chamado de outra thread)"""
+        if self.connection and not self.connection.closed:
+            try:
+                self.connection.cancel()
+            except Exception:
+                pass
 
     def discover_schema(self):
         """Descobre schema completo do banco"""
@@ -273,14 +733,486 @@ class MCPState:
         except:
             return 0
 
+    def find_table(self, schema: str, table: str) -> dict | None:
+        """Busca tabela no schema cache"""
+        return next((t for t in self.schema_cache.get("tables", [])
+                     if t["schema"] == schema and t["name"] == table), None)
+
+    def get_search_indexes(self, table_info: dict) -> dict:
+        """Detecta aceleradores de busca textual da tabela (cache no schema)"""
+        if "search_indexes" in table_info:
+            return table_info["search_indexes"]
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT DISTINCT a.attname
+            FROM pg_index i
+            CROSS JOIN LATERAL unnest(i.indkey::int2[], i.indclass::oid[]) AS k(attnum, opclass)
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+            JOIN pg_opclass op ON op.oid = k.opclass
+            WHERE i.indrelid = %s::regclass
+              AND op.opcname IN ('gin_trgm_ops', 'gist_trgm_ops')
+        """, (f"{table_info['schema']}.{table_info['name']}",))
+
+        search_indexes = {
+            "trigram": [row[0] for row in cursor.fetchall()],
+            "tsvector": [col["name"] for col in table_info.get("columns", [])
+                         if col["type"].lower() == "tsvector"]
+        }
+        table_info["search_indexes"] = search_indexes
+        return search_indexes
+
+    def get_table_profile(self, table_info: dict, columns: list[str] = None,
+                          refresh: bool = False) -> tuple[dict, bool]:
+        """Perfil por coluna (cache no schema); retorna (perfil, veio do cache)
+
+        Só as colunas ainda sem perfil são calculadas, todas na mesma passada.
+        """
+        known = {col["name"]: col for col in table_info.get("columns", [])}
+        names = columns or list(known)
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"Colunas não encontradas: {', '.join(unknown)}")
+
+        profile = table_info.get("profile")
+        if refresh or not profile:
+            profile = {"columns": {}}
+        missing = [known[name] for name in names if name not in profile["columns"]]
+
+        if missing:
+            computed = self._profile_columns(table_info, missing)
+            profile["columns"].update(computed.pop("columns"))
+            profile.update(computed)
+            table_info["profile"] = profile
+
+        return {
+            **{key: value for key, value in profile.items() if key != "columns"},
+            "columns": {name: profile["columns"][name] for name in names}
+        }, not missing
+
+    def _profile_columns(self, table_info: dict, columns: list[dict]) -> dict:
+        """Uma única varredura (amostrada em tabelas grandes) com agregados por coluna"""
+        start = time.perf_counter()
+        schema, table = table_info["schema"], table_info["name"]
+        approx_rows = table_info.get("approx_rows", 0)
+        catalog = self._get_column_stats(schema, table, approx_rows)
+
+        table_ref = f"{quote_ident(schema)}.{quote_ident(table)}"
+        params = []
+        sample_percent = 100.0
+        if approx_rows >= Config.PROFILE_SAMPLE_MIN_ROWS:
+            sample_percent = max(round(Config.PROFILE_SAMPLE_ROWS * 100 / approx_rows, 4), 0.0001)
+            table_ref += " TABLESAMPLE SYSTEM (%s) REPEATABLE (%s)"
+            params = [sample_percent, Config.SEARCH_SAMPLE_SEED]
+
+        select = ["COUNT(*)"]
+        layout = []  # (coluna, estatística) na ordem do SELECT
+        for col in columns:
+            ident = quote_ident(col["name"])
+            data_type = col["type"].lower()
+            expressions = {"non_null": f"COUNT({ident})"}
+            if data_type in DISTINCT_TYPES and col["name"] not in catalog:
+                expressions["distinct"] = f"COUNT(DISTINCT {ident})"
+            if data_type in ORDERABLE_TYPES:
+                expressions["min"] = f"MIN({ident})"
+                expressions["max"] = f"MAX({ident})"
+            if data_type in NUMERIC_TYPES:
+                expressions["avg"] = f"AVG({ident})"
+            if data_type in TEXT_TYPES:
+                expressions["avg_length"] = f"AVG(LENGTH({ident}))"
+            for stat, expression in expressions.items():
+                select.append(expression)
+                layout.append((col["name"], stat))
+
+        cursor = self.connection.cursor()
+        cursor.execute(f"SELECT {', '.join(select)} FROM {table_ref}", params or None)
+        row = cursor.fetchone()
+        rows = row[0]
+
+        stats = {col["name"]: {"type": col["type"]} for col in columns}
+        for (name, stat), value in zip(layout, row[1:]):
+            stats[name][stat] = value
+
+        sampled = sample_percent < 100
+        for name, entry in stats.items():
+            nulls = rows - entry.pop("non_null")
+            entry["null_fraction"] = round(nulls / rows, 4) if rows else None
+            if "distinct" in entry:
+                entry["source"] = "sample" if sampled else "scan"
+            if name in catalog:
+                # pg_stats cobre a tabela toda (último ANALYZE)
+                entry.update(catalog[name])
+
+        return {
+            "rows_scanned": rows,
+            "approx_rows": approx_rows,
+            "sampled": sampled,
+            "sample_percent": sample_percent,
+            "profiled_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "columns": stats
+        }
+
+    def _get_column_stats(self, schema: str, table: str, approx_rows: int) -> dict:
+        """Nulos, distintos e valores frequentes do pg_stats (vazio sem ANALYZE)"""
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT attname, null_frac, n_distinct,
+                   most_common_vals::text::text[], most_common_freqs
+            FROM pg_stats
+            WHERE schemaname = %s AND tablename = %s AND NOT inherited
+        """, (schema, table))
+
+        approx_rows = max(approx_rows, 0)
+        stats = {}
+        for name, null_frac, n_distinct, common_values, common_freqs in cursor.fetchall():
+            # n_distinct negativo = fração das linhas
+            distinct = int(-n_distinct * approx_rows) if n_distinct < 0 else int(n_distinct)
+            stats[name] = {
+                "null_fraction": round(null_frac, 4),
+                "distinct": distinct,
+                "top_values": [
+                    {"value": value, "fraction": round(freq, 4)}
+                    for value, freq in zip(common_values or [], common_freqs or [])
+                ][:Config.PROFILE_TOP_VALUES],
+                "source": "pg_stats"
+            }
+        return stats
+
+    def explain_query(self, query: str, params: list = None) -> dict:
+        """Estimativa do planner via EXPLAIN (FORMAT JSON), sem executar a query"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+            plan = cursor.fetchone()[0]
+        except Exception:
+            # Transação abortada precisa de rollback antes do próximo comando
+            self.connection.rollback()
+            raise
+
+        if isinstance(plan, str):
+            plan = loads(plan)
+        root = plan[0]["Plan"]
+
+        return {
+            "estimated_rows": int(root.get("Plan Rows", 0)),
+            "estimated_cost": float(root.get("Total Cost", 0.0)),
+            "plan_root": root.get("Node Type")
+        }
+
 
 # Estado global
 state = MCPState()
 
 
+DANGEROUS_COMMANDS = ["DROP", "DELETE", "UPDATE", "INSERT", "TRUNCATE", "ALTER", "CREATE"]
+
+
+def check_read_only(query: str):
+    """Erro se a query não for um SELECT somente leitura (None se ok)"""
+    query_upper = query.strip().upper()
+    if not query_upper.startswith("SELECT"):
+        return "Apenas queries SELECT são permitidas"
+    for cmd in DANGEROUS_COMMANDS:
+        if cmd in query_upper:
+            return f"Comando '{cmd}' não permitido por segurança"
+    return None
+
+
+def check_query_cost(query: str, limit: int, params: list = None) -> tuple[str, dict, dict | None]:
+    """Pre-flight do planner antes de executar uma query do agente
+
+    Retorna (query a executar, estimativa, erro). Se erro não for None a query
+    foi recusada e o erro (com a estimativa) deve ser devolvido ao agente.
+    """
+    if Config.COST_GUARD_MODE == "off":
+        return query, {}, None
+
+    thresholds = {
+        "max_rows": Config.COST_GUARD_MAX_ROWS,
+        "max_cost": Config.COST_GUARD_MAX_COST
+    }
+    estimate = state.explain_query(query, params)
+    estimate["rewritten"] = False
+
+    if (estimate["estimated_rows"] > Config.COST_GUARD_MAX_ROWS
+            and Config.COST_GUARD_MODE == "rewrite"):
+        # Limita o resultado e reavalia: o custo do nó Limit é proporcional
+        query = f"SELECT * FROM ({query.rstrip(';')}) AS guarded_query LIMIT {int(limit)}"
+        estimate = state.explain_query(query, params)
+        estimate["rewritten"] = True
+
+    if (estimate["estimated_rows"] > Config.COST_GUARD_MAX_ROWS
+            or estimate["estimated_cost"] > Config.COST_GUARD_MAX_COST):
+        return query, estimate, {
+            "success": False,
+            "error": "Query recusada pelo cost guard: estimativa do planner acima dos limites configurados",
+            "cost_estimate": estimate,
+            "thresholds": thresholds,
+            "suggestion": "Adicione filtros (WHERE), agregue no banco (GROUP BY) ou evite JOINs sem condição e tente novamente"
+        }
+
+    return query, estimate, None
+
+
+def execute_prepared(cursor, query: str) -> dict:
+    """Executa via PREPARE/EXECUTE, reaproveitando o plano do mesmo formato de query
+
+    Retorna informações de reuso para o resultado da ferramenta.
+    """
+    cache = state.statement_cache
+
+    # Dollar quoting conflita com os placeholders $n: executa direto
+    if "$" in query:
+        cursor.execute(query)
+        return {"parameterized": False, **cache.stats()}
+
+    shape, params = normalize_query(query, lambda n, kind: f"${n}{PARAMETER_CASTS.get(kind, '')}")
+    name = cache.get(shape)
+    hit = name is not None
+
+    if not hit:
+        state.statement_counter += 1
+        name = f"mcp_stmt_{state.statement_counter}"
+        cursor.execute("SAVEPOINT prepare_stmt")
+        try:
+            cursor.execute(f"PREPARE {name} AS {shape}")
+            cursor.execute("RELEASE SAVEPOINT prepare_stmt")
+        except psycopg2.Error:
+            # Tipos dos parâmetros não inferíveis: executa a query original
+            cursor.execute("ROLLBACK TO SAVEPOINT prepare_stmt")
+            cursor.execute(query)
+            return {"parameterized": False, **cache.stats()}
+
+        # PREPARE não é transacional: sobrevive ao rollback do fim da ferramenta
+        evicted = cache.add(shape, name)
+        if evicted:
+            cursor.execute(f"DEALLOCATE {evicted}")
+
+    placeholders = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    cursor.execute(f"EXECUTE {name}{placeholders}", params)
+    return {"parameterized": True, "hit": hit, "parameters": len(params), **cache.stats()}
+
+
+def progressive_search(table_ref: str, where_clause: str, params: list, limit: int,
+                       approx_rows: int, budget_ms: int) -> tuple[list[dict], dict]:
+    """Busca em amostras TABLESAMPLE crescentes até achar `limit` linhas ou esgotar o tempo
+
+    Com a mesma semente (REPEATABLE) cada amostra contém a anterior, então o
+    resultado da última etapa concluída já inclui os acertos das anteriores.
+    """
+    start = time.monotonic()
+    tool_timeout_ms = Config.timeout_for("search_data") * 1000
+    results: list[dict] = []
+    steps = []
+    sample_percent = 0.0
+    budget_exhausted = False
+
+    cursor = state.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    for percent in Config.SEARCH_SAMPLE_STEPS:
+        remaining_ms = budget_ms - (time.monotonic() - start) * 1000
+        if tool_timeout_ms:
+            remaining_ms = min(remaining_ms, tool_timeout_ms - (time.monotonic() - start) * 1000)
+        if remaining_ms < 1:
+            budget_exhausted = True
+            break
+
+        step_start = time.monotonic()
+        cursor.execute("SAVEPOINT sample_step")
+        cursor.execute("SET LOCAL statement_timeout = %s", (int(remaining_ms),))
+        try:
+            cursor.execute(f"""
+                SELECT * FROM {table_ref}
+                TABLESAMPLE SYSTEM (%s) REPEATABLE (%s)
+                WHERE {where_clause}
+                LIMIT {int(limit)}
+            """, [min(percent, 100.0), Config.SEARCH_SAMPLE_SEED] + params)
+            rows = cursor.fetchall()
+            cursor.execute("RELEASE SAVEPOINT sample_step")
+        except psycopg2.errors.QueryCanceled:
+            # Etapa estourou o orçamento: fica com o resultado da anterior
+            cursor.execute("ROLLBACK TO SAVEPOINT sample_step")
+            budget_exhausted = True
+            break
+
+        results = [dict(row) for row in rows]
+        sample_percent = min(percent, 100.0)
+        steps.append({
+            "sample_percent": sample_percent,
+            "hits": len(results),
+            "elapsed_ms": round((time.monotonic() - step_start) * 1000, 1)
+        })
+        if len(results) >= limit:
+            break
+
+    return results, {
+        "mode": "progressive",
+        "sample_percent": sample_percent,
+        "approx_total_rows": approx_rows,
+        "approx_rows_scanned": int(approx_rows * sample_percent / 100),
+        "exhaustive": sample_percent >= 100,
+        "budget_exhausted": budget_exhausted,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "steps": steps
+    }
+
+
+def plan_text_search(columns: list[str], search_term: str, search_indexes: dict,
+                     exhaustive: bool = False, match: str = "substring") -> tuple[str, list, dict]:
+    """Escolhe a estratégia de busca textual conforme os índices disponíveis
+
+    O padrão (substring) mantém ILIKE '%termo%' em todas as colunas; índices
+    trigram aceleram sem mudar o resultado. tsvector só encontra palavras
+    inteiras, então é opt-in (full_text) e vale só para as colunas tsvector
+    pedidas; as demais continuam no OR com ILIKE.
+    Retorna (cláusula WHERE, parâmetros, descrição da estratégia).
+    """
+    tsvector = [col for col in columns if col in search_indexes.get("tsvector", [])]
+    text_columns = [col for col in columns if col not in tsvector]
+    pattern = f"%{search_term}%"
+
+    if match == "full_text" and tsvector and not exhaustive:
+        where = " OR ".join(
+            [f"{quote_ident(col)} @@ plainto_tsquery(%s::regconfig, %s)" for col in tsvector]
+            + [f"{quote_ident(col)} ILIKE %s" for col in text_columns]
+        )
+        params = [Config.TEXT_SEARCH_CONFIG, search_term] * len(tsvector) + [pattern] * len(text_columns)
+        return where, params, {
+            "strategy": "full_text" if not text_columns else "full_text_with_ilike",
+            "match": "full_text",
+            "columns_searched": columns,
+            "columns_full_text": tsvector,
+            "columns_skipped": []
+        }
+
+    # pg_trgm só ajuda com termos de 3+ caracteres; com todas as colunas
+    # indexadas o planner combina os índices (BitmapOr), senão é scan sequencial
+    trigram = [col for col in text_columns if col in search_indexes.get("trigram", [])]
+    indexed = bool(text_columns) and len(trigram) == len(text_columns) and len(search_term) >= 3
+    where = " OR ".join(f"{quote_ident(col)} ILIKE %s" for col in text_columns)
+    return where, [pattern] * len(text_columns), {
+        "strategy": "trigram_index" if indexed else "sequential_scan",
+        "match": "substring",
+        "columns_searched": text_columns,
+        "columns_indexed": trigram,
+        "columns_skipped": tsvector
+    }
+
+
+def build_aggregate_query(table_info: dict, arguments: dict, limit: int) -> tuple[str, list, list[str]]:
+    """Monta o SELECT ... GROUP BY do aggregate a partir da especificação do agente
+
+    Colunas validadas contra o schema cache, funções/operadores contra as
+    listas permitidas e valores sempre parametrizados. Retorna (query,
+    parâmetros, aliases das medidas); ValueError se a especificação for inválida.
+    """
+    table_ref = f"{table_info['schema']}.{table_info['name']}"
+    known_columns = {col["name"] for col in table_info.get("columns", [])}
+
+    def column(name) -> str:
+        if name not in known_columns:
+            raise ValueError(f"Coluna '{name}' não existe em {table_ref}")
+        return quote_ident(name)
+
+    group_by = arguments.get("group_by") or []
+    group_columns = [column(col) for col in group_by]
+    select = list(group_columns)
+
+    aliases = []
+    for measure in arguments.get("measures") or [{"function": "count"}]:
+        function = str(measure.get("function", "")).lower()
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Função '{function}' não permitida (use: {', '.join(AGGREGATE_FUNCTIONS)})")
+        col = measure.get("column")
+        if col in (None, "", "*"):
+            if function != "count":
+                raise ValueError(f"Função '{function}' exige uma coluna")
+            expression, default_alias = AGGREGATE_FUNCTIONS["count"].format("*"), "count"
+        else:
+            expression, default_alias = AGGREGATE_FUNCTIONS[function].format(column(col)), f"{function}_{col}"
+
+        alias = measure.get("alias") or default_alias
+        if alias in aliases or alias in group_by:
+            raise ValueError(f"Nome de medida duplicado: '{alias}'")
+        aliases.append(alias)
+        select.append(f"{expression} AS {quote_ident(alias)}")
+
+    where, params = [], []
+    for condition in arguments.get("filters") or []:
+        target = column(condition.get("column"))
+        operator = str(condition.get("operator", "=")).lower()
+        value = condition.get("value")
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Operador '{operator}' não permitido (use: {', '.join(FILTER_OPERATORS)})")
+        sql_operator = FILTER_OPERATORS[operator]
+
+        if operator in ("is_null", "is_not_null"):
+            where.append(f"{target} {sql_operator}")
+        elif operator in ("in", "not_in"):
+            values = value if isinstance(value, list) else [value]
+            if not values:
+                raise ValueError(f"Filtro '{operator}' exige ao menos um valor")
+            where.append(f"{target} {sql_operator} ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+        elif operator == "between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError("Filtro 'between' exige [mínimo, máximo]")
+            where.append(f"{target} BETWEEN %s AND %s")
+            params.extend(value)
+        else:
+            where.append(f"{target} {sql_operator} %s")
+            params.append(value)
+
+    query = f"SELECT {', '.join(select)} FROM {quote_ident(table_info['schema'])}.{quote_ident(table_info['name'])}"
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    if group_by:
+        order_by = arguments.get("order_by") or aliases[0]
+        if order_by not in aliases and order_by not in group_by:
+            raise ValueError("order_by deve ser uma medida ou coluna do group_by")
+        direction = "ASC" if arguments.get("ascending") else "DESC"
+        query += f" GROUP BY {', '.join(group_columns)} ORDER BY {quote_ident(order_by)} {direction} LIMIT {int(limit)}"
+
+    return query, params, aliases
+
+
 @app.call_tool()
 async def handle_call_tool(
     name: str, arguments: dict
+) -> list[types.TextContent]:
+    """Executa ferramentas em thread, com timeout e cancelamento via MCP"""
+    # Contexto do trace enviado pelo app no _meta da request (fora dos argumentos)
+    meta = app.request_context.meta
+    trace_context = (meta.model_extra or {}).get("trace") if meta else None
+
+    async with state.lock:
+        future = asyncio.get_running_loop().run_in_executor(None, run_tool, name, arguments, trace_context)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Request cancelada pelo cliente: interrompe o statement no servidor
+            state.cancel_running()
+            # Aguarda a thread soltar a conexão antes de liberar o lock
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait([future])
+            raise
+
+
+def run_tool(name: str, arguments: dict, trace_context: dict = None) -> list[types.TextContent]:
+    """Executa a ferramenta dentro de uma transação com statement_timeout"""
+    with tracing.span(f"mcp.tool.{name}", parent=trace_context, tool=name, database=state.database_name) as tool_span:
+        try:
+            if state.connection and name != "connect_database":
+                state.begin_tool(name)
+            result = dispatch_tool(name, arguments)
+            tool_span.set_attribute("bytes", sum(len(content.text) for content in result))
+            return result
+        finally:
+            state.end_tool()
+
+
+def dispatch_tool(
+    name: str, arguments: dict
 ) -> list[types.TextContent]:
     """Executa ferramentas"""
 
@@ -303,6 +1235,8 @@ async def handle_call_tool(
 
             state.host_name = host
             state.database_name = database
+            state.statement_cache = StatementCache(Config.PREPARED_STATEMENT_CACHE_SIZE)
+            state.begin_tool(name)
             state.discover_schema()
 
             tables_count = len(state.schema_cache.get("tables", []))
@@ -310,11 +1244,11 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "message": f"Conectado a {host}/{database}",
                         "tables_discovered": tables_count
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -322,10 +1256,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -333,7 +1267,7 @@ async def handle_call_tool(
         return [
             types.TextContent(
                 type="text",
-                text=json.dumps(state.schema_cache, indent=2, ensure_ascii=False, default=str)
+                text=dumps(state.schema_cache)
             )
         ]
 
@@ -344,54 +1278,60 @@ async def handle_call_tool(
 
             # Validação de segurança
             query_upper = query.strip().upper()
-
-            if not query_upper.startswith("SELECT"):
+            error = check_read_only(query)
+            if error:
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "success": False,
-                            "error": "Apenas queries SELECT são permitidas"
-                        }, indent=2, ensure_ascii=False)
+                            "error": error
+                        })
                     )
                 ]
 
-            dangerous = ["DROP", "DELETE", "UPDATE", "INSERT", "TRUNCATE", "ALTER", "CREATE"]
-            for cmd in dangerous:
-                if cmd in query_upper:
-                    return [
-                        types.TextContent(
-                            type="text",
-                            text=json.dumps({
-                                "success": False,
-                                "error": f"Comando '{cmd}' não permitido por segurança"
-                            }, indent=2, ensure_ascii=False)
-                        )
-                    ]
-
             cursor = state.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
             # Adiciona LIMIT se não houver
             if "LIMIT" not in query_upper:
                 query = f"{query.rstrip(';')} LIMIT {limit}"
 
-            cursor.execute(query)
+            # Cost guard: estimativa do planner antes de tocar nos dados
+            query, estimate, rejection = check_query_cost(query, limit)
+            if rejection:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps(rejection)
+                    )
+                ]
+
+            if Config.PREPARED_STATEMENTS:
+                statement_cache = execute_prepared(cursor, query)
+            else:
+                cursor.execute(query)
+                statement_cache = None
             rows = cursor.fetchall()
 
             # Converter para lista de dicts
             results = [dict(row) for row in rows]
             columns = list(results[0].keys()) if results else []
 
+            tracing.current_span().set_attribute("rows", len(results))
+            if statement_cache:
+                tracing.current_span().set_attribute("cache_hit", statement_cache.get("hit"))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns,
                         "rows": results,
                         "count": len(results),
-                        "limited": len(results) == limit
-                    }, indent=2, ensure_ascii=False, default=str)
+                        "limited": len(results) == limit,
+                        "cost_estimate": estimate,
+                        "statement_cache": statement_cache
+                    })
                 )
             ]
 
@@ -399,10 +1339,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -412,9 +1352,9 @@ async def handle_call_tool(
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "error": "Schema não descoberto"
-                        }, indent=2, ensure_ascii=False)
+                        })
                     )
                 ]
 
@@ -433,10 +1373,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "total_relationships": len(relationships),
                         "relationships": relationships
-                    }, indent=2, ensure_ascii=False, default=str)
+                    })
                 )
             ]
 
@@ -444,9 +1384,9 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -469,16 +1409,17 @@ async def handle_call_tool(
             results = [dict(row) for row in rows]
             columns = list(results[0].keys()) if results else []
 
+            tracing.current_span().set_attribute("rows", len(results))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns,
                         "rows": results,
                         "count": len(results),
                         "limited": len(results) == limit
-                    }, indent=2, ensure_ascii=False, default=str)
+                    })
                 )
             ]
 
@@ -486,10 +1427,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -498,63 +1439,391 @@ async def handle_call_tool(
             table = arguments.get("table")
             search_term = arguments.get("search_term")
             columns = arguments.get("columns")
+            exhaustive = arguments.get("exhaustive", False)
+            match = arguments.get("match", "substring")
+            mode = arguments.get("mode", "auto")
+            time_budget_ms = arguments.get("time_budget_ms", Config.SEARCH_TIME_BUDGET_MS)
 
             table_parts = table.split(".")
             schema = table_parts[0] if len(table_parts) > 1 else "public"
             table_name = table_parts[-1]
 
+            table_info = state.find_table(schema, table_name)
             if not columns:
-                table_info = next((t for t in state.schema_cache.get("tables", [])
-                                 if t["schema"] == schema and t["name"] == table_name), None)
                 if not table_info:
                     return [
                         types.TextContent(
                             type="text",
-                            text=json.dumps({
+                            text=dumps({
                                 "error": "Tabela não encontrada"
-                            }, indent=2, ensure_ascii=False)
+                            })
                         )
                     ]
 
-                text_types = ["character varying", "text", "character", "varchar", "char"]
+                # match=full_text inclui as colunas tsvector da tabela
+                searchable = TEXT_TYPES + (["tsvector"] if match == "full_text" else [])
                 columns = [col["name"] for col in table_info["columns"]
-                          if col["type"].lower() in text_types]
+                          if col["type"].lower() in searchable]
 
             if not columns:
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "error": "Nenhuma coluna de texto encontrada"
-                        }, indent=2, ensure_ascii=False)
+                        })
                     )
                 ]
 
-            like_clauses = [f"{col} ILIKE %s" for col in columns]
-            where_clause = " OR ".join(like_clauses)
-            params = [f"%{search_term}%"] * len(columns)
+            # Índices trigram aceleram o ILIKE; tsvector só com match=full_text
+            search_indexes = state.get_search_indexes(table_info) if table_info else {}
+            where_clause, params, search_plan = plan_text_search(
+                columns, search_term, search_indexes, exhaustive, match
+            )
+            if not where_clause:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "error": "Colunas tsvector só podem ser buscadas com match=full_text"
+                        })
+                    )
+                ]
 
-            cursor = state.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute(f"""
-                SELECT * FROM {schema}.{table_name}
-                WHERE {where_clause}
-                LIMIT 50
-            """, params)
+            # Tabelas grandes sem índice: amostragem progressiva com tempo limitado
+            approx_rows = table_info.get("approx_rows", 0) if table_info else 0
+            use_sampling = mode == "progressive" or (
+                mode == "auto"
+                and search_plan["strategy"] == "sequential_scan"
+                and approx_rows >= Config.PROGRESSIVE_SEARCH_MIN_ROWS
+            )
+
+            if use_sampling:
+                results, coverage = progressive_search(
+                    f"{schema}.{table_name}", where_clause, params, 50, approx_rows, time_budget_ms
+                )
+            else:
+                cursor = state.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute(f"""
+                    SELECT * FROM {schema}.{table_name}
+                    WHERE {where_clause}
+                    LIMIT 50
+                """, params)
+
+                rows = cursor.fetchall()
+                results = [dict(row) for row in rows]
+                coverage = {"mode": "full", "exhaustive": True}
 
-            rows = cursor.fetchall()
-            results = [dict(row) for row in rows]
             columns_result = list(results[0].keys()) if results else []
 
+            tracing.current_span().set_attribute("rows", len(results))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns_result,
                         "rows": results,
                         "count": len(results),
-                        "limited": len(results) == 50
-                    }, indent=2, ensure_ascii=False, default=str)
+                        "limited": len(results) == 50,
+                        "search_plan": search_plan,
+                        "coverage": coverage
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "create_search_index":
+        try:
+            if not Config.ALLOW_SEARCH_INDEX_CREATION:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Criação de índices desabilitada (ALLOW_SEARCH_INDEX_CREATION=false)"
+                        })
+                    )
+                ]
+
+            table = arguments.get("table")
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "public"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            text_columns = [col["name"] for col in table_info["columns"]
+                            if col["type"].lower() in TEXT_TYPES]
+            columns = [col for col in arguments.get("columns") or text_columns
+                       if col in text_columns]
+            if not columns:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "error": "Nenhuma coluna de texto encontrada"
+                        })
+                    )
+                ]
+
+            # CREATE INDEX CONCURRENTLY não roda dentro de transação: o SET LOCAL da
+            # ferramenta se perde no autocommit, então o timeout vale para a sessão
+            state.connection.rollback()
+            state.connection.autocommit = True
+            qualified_table = f"{quote_ident(schema)}.{quote_ident(table_name)}"
+            created = []
+            rebuilt = []
+            try:
+                cursor = state.connection.cursor()
+                cursor.execute("SET statement_timeout = %s",
+                               (int(Config.timeout_for("create_search_index") * 1000),))
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for col in columns:
+                    index_name = f"idx_{table_name}_{col}_trgm"[:63]
+                    qualified_index = f"{quote_ident(schema)}.{quote_ident(index_name)}"
+
+                    # Build CONCURRENTLY que falhou deixa o índice INVALID, e o
+                    # IF NOT EXISTS o manteria: remove para reconstruir
+                    cursor.execute("""
+                        SELECT i.indisvalid
+                        FROM pg_index i
+                        JOIN pg_class c ON c.oid = i.indexrelid
+                        JOIN pg_namespace n ON n.oid = c.relnamespace
+                        WHERE n.nspname = %s AND c.relname = %s
+                    """, (schema, index_name))
+                    row = cursor.fetchone()
+                    if row and not row[0]:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {qualified_index}")
+                        rebuilt.append(index_name)
+
+                    cursor.execute(f"""
+                        CREATE INDEX CONCURRENTLY IF NOT EXISTS {quote_ident(index_name)}
+                        ON {qualified_table} USING gin ({quote_ident(col)} gin_trgm_ops)
+                    """)
+                    created.append(index_name)
+            finally:
+                try:
+                    state.connection.cursor().execute("RESET statement_timeout")
+                finally:
+                    state.connection.autocommit = False
+
+            # Invalida cache para a próxima busca detectar os índices
+            table_info.pop("search_indexes", None)
+
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "indexes": created,
+                        "rebuilt_invalid": rebuilt,
+                        "columns": columns
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "aggregate":
+        try:
+            table = arguments.get("table")
+            limit = min(int(arguments.get("limit") or 100), Config.AGGREGATE_MAX_GROUPS)
+
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "public"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            try:
+                query, params, measures = build_aggregate_query(table_info, arguments, limit)
+            except ValueError as e:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": str(e)
+                        })
+                    )
+                ]
+
+            # Sem filtros: None evita interpolação de % em nomes de coluna
+            params = params or None
+
+            # Cost guard: o agregado ainda varre a tabela (custo do plano)
+            query, estimate, rejection = check_query_cost(query, limit, params)
+            if rejection:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps(rejection)
+                    )
+                ]
+
+            cursor = state.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(query, params)
+            results = [dict(row) for row in cursor.fetchall()]
+
+            tracing.current_span().set_attribute("rows", len(results))
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "group_by": arguments.get("group_by") or [],
+                        "measures": measures,
+                        "rows": results,
+                        "count": len(results),
+                        "limited": len(results) == limit,
+                        "sql": query,
+                        "cost_estimate": estimate
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "profile_table":
+        try:
+            table = arguments.get("table")
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "public"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            profile, cached = state.get_table_profile(
+                table_info, arguments.get("columns"), arguments.get("refresh", False)
+            )
+
+            tracing.current_span().set_attributes(columns=len(profile["columns"]), cache_hit=cached)
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "cached": cached,
+                        **profile
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "export_query":
+        try:
+            query = arguments.get("query")
+            error = check_read_only(query)
+            if error:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": error
+                        })
+                    )
+                ]
+
+            export_format = arguments.get("format", "parquet")
+            if export_format not in EXPORT_FORMATS:
+                export_format = "parquet"
+            max_rows = min(int(arguments.get("max_rows") or Config.EXPORT_MAX_ROWS), Config.EXPORT_MAX_ROWS)
+
+            # Cursor nomeado (server-side): o PostgreSQL entrega as linhas em lotes
+            state.statement_counter += 1
+            cursor = state.connection.cursor(name=f"mcp_export_{state.statement_counter}")
+            cursor.itersize = Config.EXPORT_BATCH_SIZE
+            cursor.execute(query)
+
+            export = export_cursor(
+                cursor,
+                export_format,
+                Config.EXPORT_DIR,
+                prefix=arguments.get("file_name") or state.database_name,
+                batch_size=Config.EXPORT_BATCH_SIZE,
+                max_rows=max_rows
+            )
+            tracing.current_span().set_attributes(rows=export["rows"], export_bytes=export["bytes"])
+
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        **export
+                    })
                 )
             ]
 
@@ -562,10 +1831,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
 
@@ -573,9 +1842,9 @@ async def handle_call_tool(
         return [
             types.TextContent(
                 type="text",
-                text=json.dumps({
+                text=dumps({
                     "error": f"Tool '{name}' não reconhecida"
-                }, indent=2, ensure_ascii=False)
+                })
             )
         ]
 
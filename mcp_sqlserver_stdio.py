@@ -5,16 +5,26 @@ Desenvolvido por ness.
 Implementação nativa de MCP server via stdio para acesso ao SQL Server
 """
 
+import os
+import re
 import sys
-import json
+import time
 import asyncio
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from decimal import Decimal
 from typing import Any, Sequence
 
+import anyio
 import mcp.types as types
 from mcp.server import NotificationOptions, Server
 from mcp.server.models import InitializationOptions
 from mcp.server.stdio import stdio_server
 
+from app import tracing
+from app.serialization import dumps, loads
+from app.exporters import EXPORT_FORMATS, export_cursor
+
 import pyodbc
 from datetime import datetime
 
@@ -23,6 +33,65 @@ from datetime import datetime
 app = Server("sql-server-mcp")
 
 
+class Config:
+    """Configurações do servidor (variáveis de ambiente)"""
+
+    # Cost guard: SHOWPLAN_XML antes de executar queries do agente
+    # Modos: reject (recusa), rewrite (aplica TOP e reavalia), off (desligado)
+    COST_GUARD_MODE = os.getenv("COST_GUARD_MODE", "reject").lower()
+    COST_GUARD_MAX_ROWS = int(os.getenv("COST_GUARD_MAX_ROWS", "1000000"))
+    COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST_MSSQL", "500"))
+
+    # SQL_ATTR_QUERY_TIMEOUT por ferramenta (segundos, 0 = sem limite)
+    STATEMENT_TIMEOUT = float(os.getenv("STATEMENT_TIMEOUT", "30"))
+    TOOL_TIMEOUTS = {
+        "connect_database": float(os.getenv("TIMEOUT_CONNECT_DATABASE", "120")),
+        "execute_query": float(os.getenv("TIMEOUT_EXECUTE_QUERY", "30")),
+        "preview_table": float(os.getenv("TIMEOUT_PREVIEW_TABLE", "10")),
+        "search_data": float(os.getenv("TIMEOUT_SEARCH_DATA", "15")),
+        "export_query": float(os.getenv("TIMEOUT_EXPORT_QUERY", "600")),
+        "aggregate": float(os.getenv("TIMEOUT_AGGREGATE", "60")),
+        "profile_table": float(os.getenv("TIMEOUT_PROFILE_TABLE", "60")),
+    }
+
+    # Ferramenta opt-in que cria índice full-text em tabelas quentes
+    ALLOW_SEARCH_INDEX_CREATION = os.getenv("ALLOW_SEARCH_INDEX_CREATION", "false").lower() == "true"
+    FULLTEXT_CATALOG = os.getenv("FULLTEXT_CATALOG", "mcp_search_catalog")
+
+    # search_data progressivo (TABLESAMPLE crescente) para tabelas grandes
+    PROGRESSIVE_SEARCH_MIN_ROWS = int(os.getenv("PROGRESSIVE_SEARCH_MIN_ROWS", "1000000"))
+    SEARCH_TIME_BUDGET_MS = int(os.getenv("SEARCH_TIME_BUDGET_MS", "5000"))
+    SEARCH_SAMPLE_STEPS = [float(p) for p in os.getenv("SEARCH_SAMPLE_STEPS", "0.1,1,10,100").split(",")]
+    SEARCH_SAMPLE_SEED = int(os.getenv("SEARCH_SAMPLE_SEED", "42"))
+
+    # Normalização de literais + cache de statements preparados no execute_query
+    PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "false").lower() == "true"
+    PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("PREPARED_STATEMENT_CACHE_SIZE", "64"))
+
+    # export_query: arquivos Parquet/CSV gerados em lotes no disco local
+    EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+    EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+    EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "5000000"))
+
+    # aggregate: máximo de grupos devolvidos ao agente
+    AGGREGATE_MAX_GROUPS = int(os.getenv("AGGREGATE_MAX_GROUPS", "1000"))
+
+    # profile_table: tabelas acima de PROFILE_SAMPLE_MIN_ROWS são amostradas
+    # (TABLESAMPLE) para ler ~PROFILE_SAMPLE_ROWS linhas
+    PROFILE_SAMPLE_MIN_ROWS = int(os.getenv("PROFILE_SAMPLE_MIN_ROWS", "1000000"))
+    PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "100000"))
+    PROFILE_TOP_VALUES = int(os.getenv("PROFILE_TOP_VALUES", "5"))
+
+    @classmethod
+    def timeout_for(cls, tool_name: str) -> float:
+        """Timeout configurado para a ferramenta"""
+        return cls.TOOL_TIMEOUTS.get(tool_name, cls.STATEMENT_TIMEOUT)
+
+
+# Namespace do XML de showplan
+SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+
 @app.list_tools()
 async def handle_list_tools() -> list[types.Tool]:
     """Lista todas as ferramentas disponíveis"""
@@ -68,7 +137,7 @@ async def handle_list_tools() -> list[types.Tool]:
         ),
         types.Tool(
             name="execute_query",
-            description="Executa query SQL SELECT de forma segura",
+            description="Executa query SQL SELECT de forma segura (estimativa do planner é verificada antes da execução e devolvida no resultado)",
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -129,14 +198,381 @@ async def handle_list_tools() -> list[types.Tool]:
                         "type": "array",
                         "items": {"type": "string"},
                         "description": "Colunas específicas (opcional)"
+                    },
+                    "match": {
+                        "type": "string",
+                        "enum": ["substring", "word_prefix"],
+                        "description": "substring (LIKE '%termo%' em todas as colunas) ou word_prefix (CONTAINS no índice full-text, só início de palavras; colunas sem índice seguem com LIKE) (padrão: substring)"
+                    },
+                    "exhaustive": {
+                        "type": "boolean",
+                        "description": "Força LIKE em todas as colunas, mesmo com match=word_prefix (padrão: false)"
+                    },
+                    "mode": {
+                        "type": "string",
+                        "enum": ["auto", "full", "progressive"],
+                        "description": "auto (amostragem progressiva em tabelas grandes sem índice), full ou progressive (padrão: auto)"
+                    },
+                    "time_budget_ms": {
+                        "type": "integer",
+                        "description": "Orçamento de tempo do modo progressivo em ms (padrão: 5000)"
                     }
                 },
                 "required": ["table", "search_term"]
             }
+        ),
+        types.Tool(
+            name="create_search_index",
+            description="Cria índice full-text nas colunas de texto de uma tabela para acelerar search_data com match=word_prefix (opt-in, requer ALLOW_SEARCH_INDEX_CREATION=true)",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas a indexar (padrão: todas as colunas de texto)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="aggregate",
+            description="Agrega uma tabela no banco (COUNT/SUM/AVG/MIN/MAX com GROUP BY e filtros) e retorna só os grupos. Use para totais, médias, contagens e rankings em vez de buscar linhas com execute_query.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "group_by": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas de agrupamento (vazio = um único total)"
+                    },
+                    "measures": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "function": {"type": "string", "enum": list(AGGREGATE_FUNCTIONS)},
+                                "column": {"type": "string", "description": "Coluna (opcional em count)"},
+                                "alias": {"type": "string", "description": "Nome da medida no resultado"}
+                            },
+                            "required": ["function"]
+                        },
+                        "description": "Medidas a calcular (padrão: count)"
+                    },
+                    "filters": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "column": {"type": "string"},
+                                "operator": {"type": "string", "enum": list(FILTER_OPERATORS)},
+                                "value": {"description": "Valor; lista em in/not_in, [mínimo, máximo] em between"}
+                            },
+                            "required": ["column", "operator"]
+                        },
+                        "description": "Filtros combinados com AND"
+                    },
+                    "order_by": {
+                        "type": "string",
+                        "description": "Medida (alias) ou coluna do group_by para ordenar (padrão: primeira medida)"
+                    },
+                    "ascending": {
+                        "type": "boolean",
+                        "description": "Ordem crescente (padrão: false, maiores primeiro)"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "Máximo de grupos (padrão: 100)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="profile_table",
+            description="Perfil estatístico das colunas de uma tabela em uma passada: nulos, distintos, mín/máx, média, comprimento médio e valores mais frequentes (estatísticas do catálogo quando disponíveis, amostragem em tabelas grandes). Resultado fica em cache no schema.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "table": {
+                        "type": "string",
+                        "description": "Nome completo da tabela (schema.table)"
+                    },
+                    "columns": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Colunas a perfilar (padrão: todas)"
+                    },
+                    "refresh": {
+                        "type": "boolean",
+                        "description": "Ignora o perfil em cache e recalcula (padrão: false)"
+                    }
+                },
+                "required": ["table"]
+            }
+        ),
+        types.Tool(
+            name="export_query",
+            description="Exporta o resultado completo de uma query SELECT para arquivo Parquet ou CSV (lido em lotes, memória constante) e retorna apenas o caminho do arquivo e estatísticas. Use para extrações grandes em vez de execute_query.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "Query SELECT a exportar (sem limite de linhas)"
+                    },
+                    "format": {
+                        "type": "string",
+                        "enum": list(EXPORT_FORMATS),
+                        "description": "Formato do arquivo (padrão: parquet; CSV se pyarrow não estiver instalado)"
+                    },
+                    "file_name": {
+                        "type": "string",
+                        "description": "Prefixo do nome do arquivo"
+                    },
+                    "max_rows": {
+                        "type": "integer",
+                        "description": "Máximo de linhas exportadas (padrão: EXPORT_MAX_ROWS)"
+                    }
+                },
+                "required": ["query"]
+            }
         )
     ]
 
 
+# Tipos de texto pesquisáveis via LIKE
+TEXT_TYPES = ["VARCHAR", "NVARCHAR", "TEXT", "NTEXT", "CHAR", "NCHAR"]
+
+# profile_table: estatísticas calculadas por tipo de coluna (text/ntext/image
+# não aceitam DISTINCT nem MIN/MAX)
+NUMERIC_TYPES = {"tinyint", "smallint", "int", "bigint", "decimal", "numeric", "float", "real",
+                 "money", "smallmoney"}
+STRING_TYPES = {"varchar", "nvarchar", "char", "nchar"}
+ORDERABLE_TYPES = NUMERIC_TYPES | STRING_TYPES | {
+    "date", "datetime", "datetime2", "smalldatetime", "datetimeoffset", "time",
+}
+DISTINCT_TYPES = ORDERABLE_TYPES | {"bit", "uniqueidentifier", "binary", "varbinary"}
+
+
+def quote_ident(name: str) -> str:
+    """Quota identificador SQL Server"""
+    return "[" + name.replace("]", "]]") + "]"
+
+
+# aggregate: só funções e operadores conhecidos, valores sempre como parâmetros
+AGGREGATE_FUNCTIONS = {
+    "count": "COUNT_BIG({})",
+    "count_distinct": "COUNT_BIG(DISTINCT {})",
+    "sum": "SUM({})",
+    # AVG de inteiros no SQL Server trunca: média em float
+    "avg": "AVG(CAST({} AS FLOAT))",
+    "min": "MIN({})",
+    "max": "MAX({})",
+}
+# ilike vira LIKE: a collation padrão já é case-insensitive
+FILTER_OPERATORS = {
+    "=": "=", "!=": "<>", "<>": "<>", ">": ">", ">=": ">=", "<": "<", "<=": "<=",
+    "like": "LIKE", "ilike": "LIKE", "in": "IN", "not_in": "NOT IN",
+    "between": "BETWEEN", "is_null": "IS NULL", "is_not_null": "IS NOT NULL",
+}
+
+
+# Literais precedidos destes tipos não podem virar parâmetro (ex.: DATE '2024-01-01')
+TYPED_LITERAL_KEYWORDS = {"DATE", "TIME", "TIMESTAMP"}
+COMPARISON_OPERATORS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+NUMBER_RE = re.compile(r"\d+(\.\d+)?([eE][+-]?\d+)?")
+WORD_RE = re.compile(r"[^\W\d][\w$]*")
+# str do Python é enviado como NVARCHAR: literais '...' (VARCHAR) são convertidos no
+# parâmetro para a coluna VARCHAR não sofrer CONVERT_IMPLICIT (que impede seek no índice)
+PARAMETER_PLACEHOLDERS = {
+    "varchar": "CAST(? AS VARCHAR(8000))",
+    "varchar_max": "CAST(? AS VARCHAR(MAX))",
+}
+
+
+def number_parameter(literal: str) -> tuple[Any, str]:
+    """Valor e tipo do literal numérico como o SQL Server tiparia
+
+    Inteiros cabem em INT (acima disso o literal é NUMERIC), decimais são
+    NUMERIC exatos (Decimal) e notação científica é FLOAT.
+    """
+    if "e" in literal.lower():
+        return float(literal), "float"
+    if "." in literal or int(literal) > 2 ** 31 - 1:
+        return Decimal(literal), "numeric"
+    return int(literal), "int"
+
+
+def string_parameter(value: str, unicode: bool) -> str:
+    """Tipo do parâmetro de um literal de texto: N'...' é NVARCHAR, '...' é VARCHAR"""
+    if unicode:
+        return "nvarchar"
+    return "varchar" if len(value) <= 8000 else "varchar_max"
+
+
+def normalize_query(query: str, placeholder) -> tuple[str, list]:
+    """Extrai literais da query para parâmetros (mesmo formato = mesmo plano)
+
+    Strings viram parâmetros, exceto literais tipados (DATE '...'); números
+    só quando comparados (ORDER BY 1 e LIMIT 10 continuam literais).
+    `placeholder(n, tipo)` gera o marcador do n-ésimo parâmetro preservando
+    o tipo que o literal teria (number_parameter / string_parameter).
+    """
+    out = []
+    params = []
+    last_token = ""
+    i, n = 0, len(query)
+
+    while i < n:
+        ch = query[i]
+
+        # Comentários e identificadores quotados são copiados sem alteração
+        if query.startswith("--", i):
+            end = query.find("\n", i)
+            end = n if end == -1 else end
+            out.append(query[i:end])
+            i = end
+            continue
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            out.append(query[i:end])
+            i = end
+            continue
+        if ch in '"[':
+            close = '"' if ch == '"' else "]"
+            end = i + 1
+            while end < n:
+                if query[end] == close:
+                    if end + 1 < n and query[end + 1] == close:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            out.append(query[i:end + 1])
+            last_token = "IDENT"
+            i = end + 1
+            continue
+
+        if ch == "'":
+            end = i + 1
+            value = []
+            while end < n:
+                if query[end] == "'":
+                    if end + 1 < n and query[end + 1] == "'":
+                        value.append("'")
+                        end += 2
+                        continue
+                    break
+                value.append(query[end])
+                end += 1
+            literal = query[i:end + 1]
+            i = end + 1
+
+            prefix = out[-1] if out else ""
+            unicode = False
+            if prefix and (prefix[-1:].isalnum() or prefix[-1:] == "_"):
+                # Prefixo colado (E'', B'', N''): N'' vira parâmetro unicode
+                if prefix[-1] in "Nn" and (len(prefix) == 1 or not (prefix[-2].isalnum() or prefix[-2] == "_")):
+                    out[-1] = prefix[:-1]
+                    unicode = True
+                else:
+                    out.append(literal)
+                    last_token = "LITERAL"
+                    continue
+            if last_token in TYPED_LITERAL_KEYWORDS or last_token == "AS":
+                out.append(literal)
+            else:
+                params.append("".join(value))
+                out.append(placeholder(len(params), string_parameter(params[-1], unicode)))
+            last_token = "LITERAL"
+            continue
+
+        if ch.isdigit() and not (out and (out[-1][-1:].isalnum() or out[-1][-1:] in "_$.")):
+            match = NUMBER_RE.match(query, i)
+            literal = match.group(0)
+            i = match.end()
+            if last_token in COMPARISON_OPERATORS:
+                value, kind = number_parameter(literal)
+                params.append(value)
+                out.append(placeholder(len(params), kind))
+            else:
+                out.append(literal)
+            last_token = "LITERAL"
+            continue
+
+        if ch.isalpha() or ch == "_":
+            word = WORD_RE.match(query, i).group(0)
+            out.append(word)
+            last_token = word.upper()
+            i += len(word)
+            continue
+
+        if ch in "<>!=":
+            op = query[i:i + 2] if query[i:i + 2] in COMPARISON_OPERATORS else ch
+            out.append(op)
+            last_token = op
+            i += len(op)
+            continue
+
+        out.append(ch)
+        if not ch.isspace():
+            last_token = ch
+        i += 1
+
+    return "".join(out), params
+
+
+class StatementCache:
+    """LRU de statements preparados por conexão, com contadores de reuso"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, shape: str):
+        """Statement preparado para o formato de query (None se ausente)"""
+        entry = self.entries.get(shape)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(shape)
+        self.hits += 1
+        return entry
+
+    def add(self, shape: str, entry):
+        """Registra statement; retorna o statement despejado pelo LRU (ou None)"""
+        self.entries[shape] = entry
+        if len(self.entries) > self.max_size:
+            self.evictions += 1
+            return self.entries.popitem(last=False)[1]
+        return None
+
+    def stats(self) -> dict:
+        """Contadores de reuso de plano"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "cached_statements": len(self.entries),
+            "evictions": self.evictions
+        }
+
+
 # Estado global do servidor
 class MCPState:
     def __init__(self):
@@ -144,10 +580,60 @@ class MCPState:
         self.schema_cache: dict = {}
         self.server_name: str = ""
         self.database_name: str = ""
+        # Serializa o uso da conexão entre requests concorrentes
+        self.lock = asyncio.Lock()
+        # Cursores abertos pela ferramenta em execução
+        self.tool_cursors: list = []
+        # Cursores preparados por formato de query (pyodbc não re-prepara o mesmo SQL)
+        self.statement_cache = StatementCache(Config.PREPARED_STATEMENT_CACHE_SIZE)
+        self.active_prepared = None
+
+    def cursor(self):
+        """Cria cursor registrado (timeout da ferramenta e cancelamento)"""
+        cursor = self.connection.cursor()
+        self.tool_cursors.append(cursor)
+        return cursor
+
+    def begin_tool(self, tool_name: str):
+        """Aplica o timeout da ferramenta aos cursores criados a seguir"""
+        self.connection.timeout = int(Config.timeout_for(tool_name))
+
+    def end_tool(self):
+        """Fecha os cursores da ferramenta (libera result sets pendentes no servidor)"""
+        cursors, self.tool_cursors = self.tool_cursors, []
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        if self.connection:
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+
+    def reset_statement_cache(self):
+        """Descarta os cursores preparados (troca de conexão)"""
+        for cursor in self.statement_cache.entries.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.statement_cache = StatementCache(Config.PREPARED_STATEMENT_CACHE_SIZE)
+
+    def cancel_running(self):
+        """Cancela o statement em execução (chamado de outra thread)"""
+        for cursor in list(self.tool_cursors) + [self.active_prepared]:
+            if cursor is None:
+                continue
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
     
     def discover_schema(self):
         """Descobre schema completo do banco"""
-        cursor = self.connection.cursor()
+        cursor = self.cursor()
         
         # 1. Descobrir tabelas
         cursor.execute("""
@@ -192,7 +678,7 @@ class MCPState:
     
     def _get_columns(self, schema: str, table: str) -> list[dict]:
         """Descobre colunas de uma tabela"""
-        cursor = self.connection.cursor()
+        cursor = self.cursor()
         cursor.execute("""
             SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, 
                    IS_NULLABLE, COLUMN_DEFAULT
@@ -215,7 +701,7 @@ class MCPState:
     
     def _get_primary_keys(self, schema: str, table: str) -> list[str]:
         """Descobre primary keys"""
-        cursor = self.connection.cursor()
+        cursor = self.cursor()
         cursor.execute("""
             SELECT COLUMN_NAME
             FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
@@ -228,7 +714,7 @@ class MCPState:
     
     def _get_foreign_keys(self, schema: str, table: str) -> list[dict]:
         """Descobre foreign keys"""
-        cursor = self.connection.cursor()
+        cursor = self.cursor()
         cursor.execute("""
             SELECT 
                 COL_NAME(fc.parent_object_id, fc.parent_column_id) AS column_name,
@@ -254,7 +740,7 @@ class MCPState:
     def _get_row_count(self, schema: str, table: str) -> int:
         """Obtém contagem aproximada de linhas"""
         try:
-            cursor = self.connection.cursor()
+            cursor = self.cursor()
             table_full = f"{schema}.{table}"
             cursor.execute(f"""
                 SELECT SUM(rows) 
@@ -268,14 +754,505 @@ class MCPState:
         except:
             return 0
 
+    def find_table(self, schema: str, table: str) -> dict | None:
+        """Busca tabela no schema cache"""
+        return next((t for t in self.schema_cache.get("tables", [])
+                     if t["schema"] == schema and t["name"] == table), None)
+
+    def get_search_indexes(self, table_info: dict) -> dict:
+        """Detecta colunas com índice full-text na tabela (cache no schema)"""
+        if "search_indexes" in table_info:
+            return table_info["search_indexes"]
+
+        cursor = self.cursor()
+        cursor.execute("""
+            SELECT c.name
+            FROM sys.fulltext_index_columns AS fic
+            JOIN sys.columns AS c
+              ON c.object_id = fic.object_id AND c.column_id = fic.column_id
+            WHERE fic.object_id = OBJECT_ID(?)
+        """, f"{table_info['schema']}.{table_info['name']}")
+
+        search_indexes = {"fulltext": [row[0] for row in cursor.fetchall()]}
+        table_info["search_indexes"] = search_indexes
+        return search_indexes
+
+    def get_table_profile(self, table_info: dict, columns: list[str] = None,
+                          refresh: bool = False) -> tuple[dict, bool]:
+        """Perfil por coluna (cache no schema); retorna (perfil, veio do cache)
+
+        Só as colunas ainda sem perfil são calculadas, todas na mesma passada.
+        """
+        known = {col["name"]: col for col in table_info.get("columns", [])}
+        names = columns or list(known)
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"Colunas não encontradas: {', '.join(unknown)}")
+
+        profile = table_info.get("profile")
+        if refresh or not profile:
+            profile = {"columns": {}}
+        missing = [known[name] for name in names if name not in profile["columns"]]
+
+        if missing:
+            computed = self._profile_columns(table_info, missing)
+            profile["columns"].update(computed.pop("columns"))
+            profile.update(computed)
+            table_info["profile"] = profile
+
+        return {
+            **{key: value for key, value in profile.items() if key != "columns"},
+            "columns": {name: profile["columns"][name] for name in names}
+        }, not missing
+
+    def _profile_columns(self, table_info: dict, columns: list[dict]) -> dict:
+        """Uma única varredura (amostrada em tabelas grandes) com agregados por coluna"""
+        start = time.perf_counter()
+        schema, table = table_info["schema"], table_info["name"]
+        approx_rows = table_info.get("approx_rows", 0)
+        catalog = self._get_column_stats(schema, table)
+
+        table_ref = f"{quote_ident(schema)}.{quote_ident(table)}"
+        sample_percent = 100.0
+        if approx_rows >= Config.PROFILE_SAMPLE_MIN_ROWS:
+            sample_percent = max(round(Config.PROFILE_SAMPLE_ROWS * 100 / approx_rows, 4), 0.0001)
+            table_ref += f" TABLESAMPLE ({sample_percent} PERCENT) REPEATABLE ({Config.SEARCH_SAMPLE_SEED})"
+
+        select = ["COUNT_BIG(*)"]
+        layout = []  # (coluna, estatística) na ordem do SELECT
+        for col in columns:
+            ident = quote_ident(col["name"])
+            data_type = col["type"].lower()
+            expressions = {"non_null": f"COUNT_BIG({ident})"}
+            if data_type in DISTINCT_TYPES and col["name"] not in catalog:
+                expressions["distinct"] = f"COUNT_BIG(DISTINCT {ident})"
+            if data_type in ORDERABLE_TYPES:
+                expressions["min"] = f"MIN({ident})"
+                expressions["max"] = f"MAX({ident})"
+            if data_type in NUMERIC_TYPES:
+                expressions["avg"] = f"AVG(CAST({ident} AS FLOAT))"
+            if data_type in STRING_TYPES:
+                expressions["avg_length"] = f"AVG(CAST(LEN({ident}) AS FLOAT))"
+            for stat, expression in expressions.items():
+                select.append(expression)
+                layout.append((col["name"], stat))
+
+        cursor = self.cursor()
+        cursor.execute(f"SELECT {', '.join(select)} FROM {table_ref}")
+        row = cursor.fetchone()
+        rows = row[0]
+
+        stats = {col["name"]: {"type": col["type"]} for col in columns}
+        for (name, stat), value in zip(layout, row[1:]):
+            stats[name][stat] = value
+
+        sampled = sample_percent < 100
+        for name, entry in stats.items():
+            nulls = rows - entry.pop("non_null")
+            entry["null_fraction"] = round(nulls / rows, 4) if rows else None
+            if "distinct" in entry:
+                entry["source"] = "sample" if sampled else "scan"
+            if name in catalog:
+                # Histograma da estatística cobre a tabela toda (última atualização)
+                entry.update(catalog[name])
+
+        return {
+            "rows_scanned": rows,
+            "approx_rows": approx_rows,
+            "sampled": sampled,
+            "sample_percent": sample_percent,
+            "profiled_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "columns": stats
+        }
+
+    def _get_column_stats(self, schema: str, table: str) -> dict:
+        """Distintos e valores frequentes das estatísticas do otimizador
+
+        Usa a estatística mais recente que tem a coluna como chave principal:
+        sys.dm_db_stats_properties (atualização, amostra, modificações) e
+        sys.dm_db_stats_histogram (SQL Server 2016 SP1 CU2+). Vazio se
+        indisponível.
+        """
+        cursor = self.cursor()
+        try:
+            cursor.execute("""
+                SELECT c.name, s.stats_id, sp.last_updated, sp.rows, sp.rows_sampled,
+                       sp.modification_counter,
+                       -- sql_variant não é suportado pelo pyodbc
+                       CAST(h.range_high_key AS NVARCHAR(4000)), h.equal_rows,
+                       h.distinct_range_rows
+                FROM sys.stats AS s
+                JOIN sys.stats_columns AS sc
+                  ON sc.object_id = s.object_id AND sc.stats_id = s.stats_id AND sc.stats_column_id = 1
+                JOIN sys.columns AS c
+                  ON c.object_id = sc.object_id AND c.column_id = sc.column_id
+                CROSS APPLY sys.dm_db_stats_properties(s.object_id, s.stats_id) AS sp
+                CROSS APPLY sys.dm_db_stats_histogram(s.object_id, s.stats_id) AS h
+                WHERE s.object_id = OBJECT_ID(?)
+                ORDER BY c.name, sp.last_updated, s.stats_id
+            """, f"{schema}.{table}")
+            rows = cursor.fetchall()
+        except pyodbc.Error:
+            return {}
+
+        # Uma estatística por coluna: a mais recente (última na ordenação)
+        histograms = {}
+        for name, stats_id, last_updated, total, sampled, modifications, key, equal_rows, range_distinct in rows:
+            current = histograms.get(name)
+            if current is None or current["stats_id"] != stats_id:
+                current = histograms[name] = {
+                    "stats_id": stats_id, "updated": last_updated, "rows": total, "rows_sampled": sampled,
+                    "modifications": modifications, "steps": []
+                }
+            current["steps"].append((key, equal_rows or 0, range_distinct or 0))
+
+        stats = {}
+        for name, histogram in histograms.items():
+            steps = histogram["steps"]
+            # Cada passo tem 1 valor na chave (exceto o passo NULL) + distinct_range_rows antes dela
+            distinct = int(sum((key is not None) + range_distinct for key, _, range_distinct in steps))
+            top = sorted(steps, key=lambda step: step[1], reverse=True)[:Config.PROFILE_TOP_VALUES]
+            total = histogram["rows"] or 0
+            stats[name] = {
+                "distinct": distinct,
+                "top_values": [
+                    {"value": key, "fraction": round(equal_rows / total, 4) if total else None}
+                    for key, equal_rows, _ in top if key is not None
+                ],
+                "stats_updated": histogram["updated"].isoformat() if histogram["updated"] else None,
+                "stats_rows_sampled": histogram["rows_sampled"],
+                "modifications_since_stats": histogram["modifications"],
+                "source": "dm_db_stats_histogram"
+            }
+        return stats
+
+    def explain_query(self, query: str, params: list = None) -> dict:
+        """Estimativa do otimizador via SET SHOWPLAN_XML, sem executar a query"""
+        cursor = self.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(query, *(params or []))
+            plan_xml = cursor.fetchone()[0]
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+
+        root = ET.fromstring(plan_xml)
+        stmt = root.find(".//sp:StmtSimple", SHOWPLAN_NS)
+        rel_op = root.find(".//sp:RelOp", SHOWPLAN_NS)
+
+        return {
+            "estimated_rows": int(float(stmt.get("StatementEstRows", 0))) if stmt is not None else 0,
+            "estimated_cost": float(stmt.get("StatementSubTreeCost", 0)) if stmt is not None else 0.0,
+            "plan_root": rel_op.get("PhysicalOp") if rel_op is not None else None
+        }
+
 
 # Estado global
 state = MCPState()
 
 
+DANGEROUS_COMMANDS = ["DROP", "DELETE", "UPDATE", "INSERT", "EXEC", "XP_CMDSHELL", "SP_"]
+
+
+def check_read_only(query: str):
+    """Erro se a query não for um SELECT somente leitura (None se ok)"""
+    query_upper = query.strip().upper()
+    if not query_upper.startswith("SELECT"):
+        return "Apenas queries SELECT são permitidas"
+    for cmd in DANGEROUS_COMMANDS:
+        if cmd in query_upper:
+            return f"Comando '{cmd}' não permitido por segurança"
+    return None
+
+
+def check_query_cost(query: str, limit: int, params: list = None) -> tuple[str, dict, dict | None]:
+    """Pre-flight do otimizador antes de executar uma query do agente
+
+    Retorna (query a executar, estimativa, erro). Se erro não for None a query
+    foi recusada e o erro (com a estimativa) deve ser devolvido ao agente.
+    """
+    if Config.COST_GUARD_MODE == "off":
+        return query, {}, None
+
+    thresholds = {
+        "max_rows": Config.COST_GUARD_MAX_ROWS,
+        "max_cost": Config.COST_GUARD_MAX_COST
+    }
+    estimate = state.explain_query(query, params)
+    estimate["rewritten"] = False
+
+    if (estimate["estimated_rows"] > Config.COST_GUARD_MAX_ROWS
+            and Config.COST_GUARD_MODE == "rewrite"
+            and not re.match(r"^\s*SELECT\s+(DISTINCT\s+)?TOP\b", query, re.IGNORECASE)):
+        # Injeta TOP e reavalia: o otimizador passa a considerar row goal
+        query = re.sub(r"^\s*SELECT\s+(DISTINCT\s+)?", lambda m: f"{m.group(0)}TOP ({int(limit)}) ",
+                       query, count=1, flags=re.IGNORECASE)
+        estimate = state.explain_query(query, params)
+        estimate["rewritten"] = True
+
+    if (estimate["estimated_rows"] > Config.COST_GUARD_MAX_ROWS
+            or estimate["estimated_cost"] > Config.COST_GUARD_MAX_COST):
+        return query, estimate, {
+            "success": False,
+            "error": "Query recusada pelo cost guard: estimativa do otimizador acima dos limites configurados",
+            "cost_estimate": estimate,
+            "thresholds": thresholds,
+            "suggestion": "Adicione filtros (WHERE), agregue no banco (GROUP BY) ou evite JOINs sem condição e tente novamente"
+        }
+
+    return query, estimate, None
+
+
+def execute_prepared(query: str) -> tuple[Any, dict]:
+    """Executa a query normalizada no cursor preparado do seu formato
+
+    O pyodbc mantém o último statement preparado por cursor: reexecutar o
+    mesmo SQL parametrizado reaproveita o handle (SQLExecute sem novo
+    SQLPrepare) e o SQL Server reaproveita o plano em cache.
+    """
+    cache = state.statement_cache
+    shape, params = normalize_query(query, lambda n, kind: PARAMETER_PLACEHOLDERS.get(kind, "?"))
+
+    cursor = cache.get(shape)
+    hit = cursor is not None
+    if not hit:
+        # Fora de tool_cursors: sobrevive ao fim da ferramenta
+        cursor = state.connection.cursor()
+        evicted = cache.add(shape, cursor)
+        if evicted:
+            evicted.close()
+
+    state.active_prepared = cursor
+    cursor.execute(shape, *params)
+    return cursor, {"parameterized": True, "hit": hit, "parameters": len(params), **cache.stats()}
+
+
+def release_prepared(cursor):
+    """Descarta linhas pendentes do cursor preparado sem perder o prepare"""
+    state.active_prepared = None
+    try:
+        cursor.cancel()
+        while cursor.nextset():
+            pass
+    except pyodbc.Error:
+        pass
+
+
+def progressive_search(table_ref: str, where_clause: str, params: list, limit: int,
+                       approx_rows: int, budget_ms: int) -> tuple[list[dict], dict]:
+    """Busca em amostras TABLESAMPLE crescentes até achar `limit` linhas ou esgotar o tempo
+
+    Cada etapa substitui o resultado da anterior; a última etapa concluída
+    define a cobertura reportada.
+    """
+    start = time.monotonic()
+    tool_timeout_ms = Config.timeout_for("search_data") * 1000
+    results: list[dict] = []
+    steps = []
+    sample_percent = 0.0
+    budget_exhausted = False
+
+    try:
+        for percent in Config.SEARCH_SAMPLE_STEPS:
+            remaining_ms = budget_ms - (time.monotonic() - start) * 1000
+            if tool_timeout_ms:
+                remaining_ms = min(remaining_ms, tool_timeout_ms - (time.monotonic() - start) * 1000)
+            if remaining_ms < 1000:
+                # SQL_ATTR_QUERY_TIMEOUT tem granularidade de segundos
+                budget_exhausted = True
+                break
+
+            step_start = time.monotonic()
+            state.connection.timeout = int(remaining_ms / 1000)
+            cursor = state.cursor()
+            try:
+                cursor.execute(f"""
+                    SELECT TOP {int(limit)} * FROM {table_ref}
+                    TABLESAMPLE ({min(percent, 100.0)} PERCENT) REPEATABLE ({Config.SEARCH_SAMPLE_SEED})
+                    WHERE {where_clause}
+                """, *params)
+                columns = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchmany(limit)
+            except pyodbc.Error as e:
+                # HYT00 = timeout: fica com o resultado da etapa anterior
+                if e.args and e.args[0] == "HYT00":
+                    budget_exhausted = True
+                    break
+                raise
+
+            results = [dict(zip(columns, row)) for row in rows]
+            sample_percent = min(percent, 100.0)
+            steps.append({
+                "sample_percent": sample_percent,
+                "hits": len(results),
+                "elapsed_ms": round((time.monotonic() - step_start) * 1000, 1)
+            })
+            if len(results) >= limit:
+                break
+    finally:
+        state.begin_tool("search_data")
+
+    return results, {
+        "mode": "progressive",
+        "sample_percent": sample_percent,
+        "approx_total_rows": approx_rows,
+        "approx_rows_scanned": int(approx_rows * sample_percent / 100),
+        "exhaustive": sample_percent >= 100,
+        "budget_exhausted": budget_exhausted,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "steps": steps
+    }
+
+
+def plan_text_search(columns: list[str], search_term: str, search_indexes: dict,
+                     exhaustive: bool = False, match: str = "substring") -> tuple[str, list, dict]:
+    """Escolhe a estratégia de busca textual conforme os índices disponíveis
+
+    O padrão (substring) mantém LIKE '%termo%' em todas as colunas. CONTAINS
+    só encontra início de palavras, então o full-text é opt-in (word_prefix);
+    nesse modo as colunas sem índice continuam no OR com LIKE.
+    Retorna (cláusula WHERE, parâmetros, descrição da estratégia).
+    """
+    fulltext = [col for col in columns if col in search_indexes.get("fulltext", [])]
+
+    if match == "word_prefix" and fulltext and not exhaustive:
+        term = search_term.replace('"', "")
+        cols = ", ".join(quote_ident(col) for col in fulltext)
+        others = [col for col in columns if col not in fulltext]
+        where = " OR ".join([f"CONTAINS(({cols}), ?)"] + [f"{quote_ident(col)} LIKE ?" for col in others])
+        return where, [f'"{term}*"'] + [f"%{search_term}%"] * len(others), {
+            "strategy": "full_text" if not others else "full_text_with_like",
+            "match": "word_prefix",
+            "columns_searched": columns,
+            "columns_full_text": fulltext,
+            "columns_skipped": []
+        }
+
+    where = " OR ".join(f"{quote_ident(col)} LIKE ?" for col in columns)
+    return where, [f"%{search_term}%"] * len(columns), {
+        "strategy": "sequential_scan",
+        "match": "substring",
+        "columns_searched": columns,
+        "columns_skipped": []
+    }
+
+
+def build_aggregate_query(table_info: dict, arguments: dict, limit: int) -> tuple[str, list, list[str]]:
+    """Monta o SELECT ... GROUP BY do aggregate a partir da especificação do agente
+
+    Colunas validadas contra o schema cache, funções/operadores contra as
+    listas permitidas e valores sempre parametrizados. Retorna (query,
+    parâmetros, aliases das medidas); ValueError se a especificação for inválida.
+    """
+    table_ref = f"{table_info['schema']}.{table_info['name']}"
+    known_columns = {col["name"] for col in table_info.get("columns", [])}
+
+    def column(name) -> str:
+        if name not in known_columns:
+            raise ValueError(f"Coluna '{name}' não existe em {table_ref}")
+        return quote_ident(name)
+
+    group_by = arguments.get("group_by") or []
+    group_columns = [column(col) for col in group_by]
+    select = list(group_columns)
+
+    aliases = []
+    for measure in arguments.get("measures") or [{"function": "count"}]:
+        function = str(measure.get("function", "")).lower()
+        if function not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Função '{function}' não permitida (use: {', '.join(AGGREGATE_FUNCTIONS)})")
+        col = measure.get("column")
+        if col in (None, "", "*"):
+            if function != "count":
+                raise ValueError(f"Função '{function}' exige uma coluna")
+            expression, default_alias = AGGREGATE_FUNCTIONS["count"].format("*"), "count"
+        else:
+            expression, default_alias = AGGREGATE_FUNCTIONS[function].format(column(col)), f"{function}_{col}"
+
+        alias = measure.get("alias") or default_alias
+        if alias in aliases or alias in group_by:
+            raise ValueError(f"Nome de medida duplicado: '{alias}'")
+        aliases.append(alias)
+        select.append(f"{expression} AS {quote_ident(alias)}")
+
+    where, params = [], []
+    for condition in arguments.get("filters") or []:
+        target = column(condition.get("column"))
+        operator = str(condition.get("operator", "=")).lower()
+        value = condition.get("value")
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Operador '{operator}' não permitido (use: {', '.join(FILTER_OPERATORS)})")
+        sql_operator = FILTER_OPERATORS[operator]
+
+        if operator in ("is_null", "is_not_null"):
+            where.append(f"{target} {sql_operator}")
+        elif operator in ("in", "not_in"):
+            values = value if isinstance(value, list) else [value]
+            if not values:
+                raise ValueError(f"Filtro '{operator}' exige ao menos um valor")
+            where.append(f"{target} {sql_operator} ({', '.join(['?'] * len(values))})")
+            params.extend(values)
+        elif operator == "between":
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError("Filtro 'between' exige [mínimo, máximo]")
+            where.append(f"{target} BETWEEN ? AND ?")
+            params.extend(value)
+        else:
+            where.append(f"{target} {sql_operator} ?")
+            params.append(value)
+
+    top = f"TOP ({int(limit)}) " if group_by else ""
+    query = f"SELECT {top}{', '.join(select)} FROM {quote_ident(table_info['schema'])}.{quote_ident(table_info['name'])}"
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    if group_by:
+        order_by = arguments.get("order_by") or aliases[0]
+        if order_by not in aliases and order_by not in group_by:
+            raise ValueError("order_by deve ser uma medida ou coluna do group_by")
+        direction = "ASC" if arguments.get("ascending") else "DESC"
+        query += f" GROUP BY {', '.join(group_columns)} ORDER BY {quote_ident(order_by)} {direction}"
+
+    return query, params, aliases
+
+
 @app.call_tool()
 async def handle_call_tool(
     name: str, arguments: dict
+) -> list[types.TextContent]:
+    """Executa ferramentas em thread, com timeout e cancelamento via MCP"""
+    # Contexto do trace enviado pelo app no _meta da request (fora dos argumentos)
+    meta = app.request_context.meta
+    trace_context = (meta.model_extra or {}).get("trace") if meta else None
+
+    async with state.lock:
+        future = asyncio.get_running_loop().run_in_executor(None, run_tool, name, arguments, trace_context)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Request cancelada pelo cliente: interrompe o statement no servidor
+            state.cancel_running()
+            # Aguarda a thread soltar a conexão antes de liberar o lock
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait([future])
+            raise
+
+
+def run_tool(name: str, arguments: dict, trace_context: dict = None) -> list[types.TextContent]:
+    """Executa a ferramenta com o timeout configurado e libera os cursores ao final"""
+    with tracing.span(f"mcp.tool.{name}", parent=trace_context, tool=name, database=state.database_name) as tool_span:
+        try:
+            if state.connection and name != "connect_database":
+                state.begin_tool(name)
+            result = dispatch_tool(name, arguments)
+            tool_span.set_attribute("bytes", sum(len(content.text) for content in result))
+            return result
+        finally:
+            state.end_tool()
+
+
+def dispatch_tool(
+    name: str, arguments: dict
 ) -> list[types.TextContent]:
     """Executa ferramentas"""
     
@@ -296,8 +1273,10 @@ async def handle_call_tool(
                 f"TrustServerCertificate=yes;"
             )
             
+            state.reset_statement_cache()
             state.connection = pyodbc.connect(conn_str, timeout=30)
             state.server_name = server
+            state.begin_tool(name)
             state.database_name = database
             state.discover_schema()
             
@@ -306,11 +1285,11 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "message": f"Conectado a {server}/{database}",
                         "tables_discovered": tables_count
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
             
@@ -318,10 +1297,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
     
@@ -329,7 +1308,7 @@ async def handle_call_tool(
         return [
             types.TextContent(
                 type="text",
-                text=json.dumps(state.schema_cache, indent=2, ensure_ascii=False, default=str)
+                text=dumps(state.schema_cache)
             )
         ]
     
@@ -340,49 +1319,57 @@ async def handle_call_tool(
             
             # Validação de segurança
             query_upper = query.strip().upper()
-            
-            if not query_upper.startswith("SELECT"):
+            error = check_read_only(query)
+            if error:
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "success": False,
-                            "error": "Apenas queries SELECT são permitidas"
-                        }, indent=2, ensure_ascii=False)
+                            "error": error
+                        })
                     )
                 ]
             
-            dangerous = ["DROP", "DELETE", "UPDATE", "INSERT", "EXEC", "XP_CMDSHELL", "SP_"]
-            for cmd in dangerous:
-                if cmd in query_upper:
-                    return [
-                        types.TextContent(
-                            type="text",
-                            text=json.dumps({
-                                "success": False,
-                                "error": f"Comando '{cmd}' não permitido por segurança"
-                            }, indent=2, ensure_ascii=False)
-                        )
-                    ]
-            
-            cursor = state.connection.cursor()
-            cursor.execute(query)
+            # Cost guard: estimativa do otimizador antes de tocar nos dados
+            query, estimate, rejection = check_query_cost(query, limit)
+            if rejection:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps(rejection)
+                    )
+                ]
+
+            if Config.PREPARED_STATEMENTS:
+                cursor, statement_cache = execute_prepared(query)
+            else:
+                cursor = state.cursor()
+                cursor.execute(query)
+                statement_cache = None
             
             columns = [desc[0] for desc in cursor.description]
             rows = cursor.fetchmany(limit)
+            if statement_cache:
+                release_prepared(cursor)
             
             results = [dict(zip(columns, row)) for row in rows]
             
+            tracing.current_span().set_attribute("rows", len(results))
+            if statement_cache:
+                tracing.current_span().set_attribute("cache_hit", statement_cache.get("hit"))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns,
                         "rows": results,
                         "count": len(results),
-                        "limited": len(results) == limit
-                    }, indent=2, ensure_ascii=False, default=str)
+                        "limited": len(results) == limit,
+                        "cost_estimate": estimate,
+                        "statement_cache": statement_cache
+                    })
                 )
             ]
             
@@ -390,10 +1377,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
     
@@ -403,9 +1390,9 @@ async def handle_call_tool(
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "error": "Schema não descoberto"
-                        }, indent=2, ensure_ascii=False)
+                        })
                     )
                 ]
             
@@ -424,10 +1411,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "total_relationships": len(relationships),
                         "relationships": relationships
-                    }, indent=2, ensure_ascii=False, default=str)
+                    })
                 )
             ]
             
@@ -435,9 +1422,9 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
     
@@ -453,7 +1440,7 @@ async def handle_call_tool(
             query = f"SELECT TOP {limit} * FROM {schema}.{table_name}"
             query_upper = query.strip().upper()
             
-            cursor = state.connection.cursor()
+            cursor = state.cursor()
             cursor.execute(query)
             
             columns = [desc[0] for desc in cursor.description]
@@ -461,16 +1448,17 @@ async def handle_call_tool(
             
             results = [dict(zip(columns, row)) for row in rows]
             
+            tracing.current_span().set_attribute("rows", len(results))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns,
                         "rows": results,
                         "count": len(results),
                         "limited": len(results) == limit
-                    }, indent=2, ensure_ascii=False, default=str)
+                    })
                 )
             ]
             
@@ -478,10 +1466,10 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
     
@@ -490,61 +1478,84 @@ async def handle_call_tool(
             table = arguments.get("table")
             search_term = arguments.get("search_term")
             columns = arguments.get("columns")
+            exhaustive = arguments.get("exhaustive", False)
+            match = arguments.get("match", "substring")
+            mode = arguments.get("mode", "auto")
+            time_budget_ms = arguments.get("time_budget_ms", Config.SEARCH_TIME_BUDGET_MS)
             
             table_parts = table.split(".")
             schema = table_parts[0] if len(table_parts) > 1 else "dbo"
             table_name = table_parts[-1]
             
+            table_info = state.find_table(schema, table_name)
             if not columns:
-                table_info = next((t for t in state.schema_cache.get("tables", []) 
-                                 if t["schema"] == schema and t["name"] == table_name), None)
                 if not table_info:
                     return [
                         types.TextContent(
                             type="text",
-                            text=json.dumps({
+                            text=dumps({
                                 "error": "Tabela não encontrada"
-                            }, indent=2, ensure_ascii=False)
+                            })
                         )
                     ]
                 
-                text_types = ["VARCHAR", "NVARCHAR", "TEXT", "NTEXT", "CHAR", "NCHAR"]
                 columns = [col["name"] for col in table_info["columns"] 
-                          if col["type"].upper() in text_types]
+                          if col["type"].upper() in TEXT_TYPES]
             
             if not columns:
                 return [
                     types.TextContent(
                         type="text",
-                        text=json.dumps({
+                        text=dumps({
                             "error": "Nenhuma coluna de texto encontrada"
-                        }, indent=2, ensure_ascii=False)
+                        })
                     )
                 ]
             
-            like_clauses = [f"{col} LIKE '%{search_term}%'" for col in columns]
-            where_clause = " OR ".join(like_clauses)
-            
-            query = f"SELECT TOP 50 * FROM {schema}.{table_name} WHERE {where_clause}"
-            
-            cursor = state.connection.cursor()
-            cursor.execute(query)
-            
-            columns_result = [desc[0] for desc in cursor.description]
-            rows = cursor.fetchmany(50)
+            # Índice full-text só com match=word_prefix (CONTAINS não busca substring)
+            search_indexes = state.get_search_indexes(table_info) if table_info else {}
+            where_clause, params, search_plan = plan_text_search(
+                columns, search_term, search_indexes, exhaustive, match
+            )
             
-            results = [dict(zip(columns_result, row)) for row in rows]
+            # Tabelas grandes sem índice: amostragem progressiva com tempo limitado
+            approx_rows = table_info.get("approx_rows", 0) if table_info else 0
+            use_sampling = mode == "progressive" or (
+                mode == "auto"
+                and search_plan["strategy"] == "sequential_scan"
+                and approx_rows >= Config.PROGRESSIVE_SEARCH_MIN_ROWS
+            )
+
+            if use_sampling:
+                results, coverage = progressive_search(
+                    f"{schema}.{table_name}", where_clause, params, 50, approx_rows, time_budget_ms
+                )
+                columns_result = list(results[0].keys()) if results else []
+            else:
+                query = f"SELECT TOP 50 * FROM {schema}.{table_name} WHERE {where_clause}"
+
+                cursor = state.cursor()
+                cursor.execute(query, *params)
+
+                columns_result = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchmany(50)
+
+                results = [dict(zip(columns_result, row)) for row in rows]
+                coverage = {"mode": "full", "exhaustive": True}
             
+            tracing.current_span().set_attribute("rows", len(results))
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
                         "success": True,
                         "columns": columns_result,
                         "rows": results,
                         "count": len(results),
-                        "limited": len(results) == 50
-                    }, indent=2, ensure_ascii=False, default=str)
+                        "limited": len(results) == 50,
+                        "search_plan": search_plan,
+                        "coverage": coverage
+                    })
                 )
             ]
             
@@ -552,20 +1563,312 @@ async def handle_call_tool(
             return [
                 types.TextContent(
                     type="text",
-                    text=json.dumps({
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "create_search_index":
+        try:
+            if not Config.ALLOW_SEARCH_INDEX_CREATION:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Criação de índices desabilitada (ALLOW_SEARCH_INDEX_CREATION=false)"
+                        })
+                    )
+                ]
+
+            table = arguments.get("table")
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "dbo"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            text_columns = [col["name"] for col in table_info["columns"]
+                            if col["type"].upper() in TEXT_TYPES]
+            columns = [col for col in arguments.get("columns") or text_columns
+                       if col in text_columns]
+            if not columns:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "error": "Nenhuma coluna de texto encontrada"
+                        })
+                    )
+                ]
+
+            # Full-text exige um índice único de coluna única como KEY INDEX
+            cursor = state.cursor()
+            cursor.execute("""
+                SELECT TOP 1 i.name
+                FROM sys.indexes AS i
+                WHERE i.object_id = OBJECT_ID(?)
+                  AND i.is_unique = 1
+                  AND (SELECT COUNT(*) FROM sys.index_columns AS ic
+                       WHERE ic.object_id = i.object_id AND ic.index_id = i.index_id) = 1
+                ORDER BY i.is_primary_key DESC
+            """, f"{schema}.{table_name}")
+            key_index = cursor.fetchone()
+            if not key_index:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Tabela sem índice único de coluna única (necessário para full-text)"
+                        })
+                    )
+                ]
+
+            # DDL full-text não roda dentro de transação
+            state.connection.rollback()
+            state.connection.autocommit = True
+            try:
+                cursor.execute(f"""
+                    IF NOT EXISTS (SELECT 1 FROM sys.fulltext_catalogs WHERE name = ?)
+                        CREATE FULLTEXT CATALOG {quote_ident(Config.FULLTEXT_CATALOG)}
+                """, Config.FULLTEXT_CATALOG)
+                cols = ", ".join(quote_ident(col) for col in columns)
+                cursor.execute(f"""
+                    CREATE FULLTEXT INDEX ON {quote_ident(schema)}.{quote_ident(table_name)} ({cols})
+                    KEY INDEX {quote_ident(key_index[0])}
+                    ON {quote_ident(Config.FULLTEXT_CATALOG)}
+                    WITH CHANGE_TRACKING AUTO
+                """)
+            finally:
+                state.connection.autocommit = False
+
+            # Invalida cache para a próxima busca detectar o índice
+            table_info.pop("search_indexes", None)
+
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "catalog": Config.FULLTEXT_CATALOG,
+                        "key_index": key_index[0],
+                        "columns": columns,
+                        "message": "Índice criado; a população do full-text ocorre em background"
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
                         "success": False,
                         "error": str(e)
-                    }, indent=2, ensure_ascii=False)
+                    })
                 )
             ]
     
+    elif name == "aggregate":
+        try:
+            table = arguments.get("table")
+            limit = min(int(arguments.get("limit") or 100), Config.AGGREGATE_MAX_GROUPS)
+
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "dbo"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            try:
+                query, params, measures = build_aggregate_query(table_info, arguments, limit)
+            except ValueError as e:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": str(e)
+                        })
+                    )
+                ]
+
+            # Cost guard: o agregado ainda varre a tabela (custo do plano)
+            query, estimate, rejection = check_query_cost(query, limit, params)
+            if rejection:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps(rejection)
+                    )
+                ]
+
+            cursor = state.cursor()
+            cursor.execute(query, *params)
+            columns = [desc[0] for desc in cursor.description]
+            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+            tracing.current_span().set_attribute("rows", len(results))
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "group_by": arguments.get("group_by") or [],
+                        "measures": measures,
+                        "rows": results,
+                        "count": len(results),
+                        "limited": len(results) == limit,
+                        "sql": query,
+                        "cost_estimate": estimate
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "profile_table":
+        try:
+            table = arguments.get("table")
+            table_parts = table.split(".")
+            schema = table_parts[0] if len(table_parts) > 1 else "dbo"
+            table_name = table_parts[-1]
+
+            table_info = state.find_table(schema, table_name)
+            if not table_info:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": "Tabela não encontrada"
+                        })
+                    )
+                ]
+
+            profile, cached = state.get_table_profile(
+                table_info, arguments.get("columns"), arguments.get("refresh", False)
+            )
+
+            tracing.current_span().set_attributes(columns=len(profile["columns"]), cache_hit=cached)
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        "table": f"{schema}.{table_name}",
+                        "cached": cached,
+                        **profile
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
+    elif name == "export_query":
+        try:
+            query = arguments.get("query")
+            error = check_read_only(query)
+            if error:
+                return [
+                    types.TextContent(
+                        type="text",
+                        text=dumps({
+                            "success": False,
+                            "error": error
+                        })
+                    )
+                ]
+
+            export_format = arguments.get("format", "parquet")
+            if export_format not in EXPORT_FORMATS:
+                export_format = "parquet"
+            max_rows = min(int(arguments.get("max_rows") or Config.EXPORT_MAX_ROWS), Config.EXPORT_MAX_ROWS)
+
+            # pyodbc lê o resultado do servidor sob demanda a cada fetchmany
+            cursor = state.cursor()
+            cursor.execute(query)
+
+            export = export_cursor(
+                cursor,
+                export_format,
+                Config.EXPORT_DIR,
+                prefix=arguments.get("file_name") or state.database_name,
+                batch_size=Config.EXPORT_BATCH_SIZE,
+                max_rows=max_rows
+            )
+            tracing.current_span().set_attributes(rows=export["rows"], export_bytes=export["bytes"])
+
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": True,
+                        **export
+                    })
+                )
+            ]
+
+        except Exception as e:
+            return [
+                types.TextContent(
+                    type="text",
+                    text=dumps({
+                        "success": False,
+                        "error": str(e)
+                    })
+                )
+            ]
+
     else:
         return [
             types.TextContent(
                 type="text",
-                text=json.dumps({
+                text=dumps({
                     "error": f"Tool '{name}' não reconhecida"
-                }, indent=2, ensure_ascii=False)
+                })
             )
         ]
 
@@ -0,0 +1,91 @@
+"""
+Testes da exportação em Parquet (app/exporters.py)
+Desenvolvido por ness.
+
+O schema vem do cursor.description: tipos que variam entre lotes (escala de
+NUMERIC, colunas só com NULL no primeiro lote) não podem quebrar a exportação.
+"""
+
+import os
+import sys
+import datetime
+from decimal import Decimal
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from app.exporters import export_cursor  # noqa: E402
+
+
+class FakeCursor:
+    """Cursor DB-API mínimo: description + fetchmany/fetchone"""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = list(rows)
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+
+def export(tmp_path, description, rows):
+    result = export_cursor(FakeCursor(description, rows), "parquet", str(tmp_path), batch_size=1)
+    return result, pq.read_table(result["path"])
+
+
+def test_pyodbc_type_drift_across_batches(tmp_path):
+    # (name, type_code, display_size, internal_size, precision, scale, null_ok)
+    description = [
+        ("valor", Decimal, None, 18, 18, 3, True),
+        ("quantidade", int, None, 10, 10, 0, True),
+        ("codigo", str, None, 36, 36, 0, True),
+    ]
+    rows = [
+        (Decimal("1.50"), None, None),
+        (Decimal("123456.789"), 42, "abc"),
+        (None, 7, None),
+    ]
+
+    result, table = export(tmp_path, description, rows)
+
+    assert result["batches"] == 3
+    assert table.column("valor").to_pylist() == [Decimal("1.500"), Decimal("123456.789"), None]
+    assert table.column("quantidade").to_pylist() == [None, 42, 7]
+    assert table.column("codigo").to_pylist() == [None, "abc", None]
+
+
+def test_psycopg2_type_codes(tmp_path):
+    description = [
+        ("preco", 1700, None, None, 12, 2, None),
+        ("livre", 1700, None, None, None, None, None),
+        ("id", 20, None, None, None, None, None),
+        ("criado_em", 1184, None, None, None, None, None),
+        ("dados", 3802, None, None, None, None, None),
+    ]
+    moment = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    rows = [
+        (None, None, None, None, None),
+        (Decimal("10.25"), Decimal("0.123456789012345"), 2 ** 40, moment, {"a": 1}),
+    ]
+
+    _, table = export(tmp_path, description, rows)
+
+    assert table.column("preco").to_pylist() == [None, Decimal("10.25")]
+    assert table.column("livre").to_pylist()[1] == pytest.approx(0.123456789012345)
+    assert table.column("id").to_pylist() == [None, 2 ** 40]
+    assert table.column("criado_em").to_pylist()[1] == moment
+    assert table.column("dados").to_pylist() == [None, '{"a": 1}']
+
+
+def test_empty_result_keeps_columns(tmp_path):
+    result, table = export(tmp_path, [("id", int, None, 10, 10, 0, True)], [])
+
+    assert result["rows"] == 0
+    assert table.column_names == ["id"]